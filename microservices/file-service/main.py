@@ -323,7 +323,7 @@ async def upload_file(
         url=file_url,
         status="active",
         is_public=False,
-        metadata={
+        file_metadata={
             "upload_source": "api",
             "file_extension": file_ext,
             "storage_type": "minio"
@@ -14,9 +14,9 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'shared'))
 
 from shared.config.settings import settings
 from shared.models import (
-    User, CreditScore, Loan, Repayment,
-    Blacklist, RiskAssessment, FraudDetection, RiskRule, RiskEvent,
-    Notification, NotificationTemplate, NotificationChannel, NotificationStats,
+    User, CreditScore, Loan, Repayment, RepaymentEntry, OverdueAging,
+    Blacklist, RiskAssessment, FraudDetection, RiskRule, RiskEvent, IpReputation, UserFeatureEvent, ShadowScore,
+    Notification, NotificationCampaign, NotificationTemplate, NotificationChannel, NotificationStats,
     FileInfo, FileProcess, FileAccess, FileStorage
 )
 
@@ -59,9 +59,9 @@ def create_tables():
     databases = {
         'user_service': [User, CreditScore],
         'loan_service': [Loan, Repayment],
-        'repayment_service': [Loan, Repayment],
-        'risk_service': [Blacklist, RiskAssessment, FraudDetection, RiskRule, RiskEvent],
-        'notification_service': [Notification, NotificationTemplate, NotificationChannel, NotificationStats],
+        'repayment_service': [Loan, Repayment, RepaymentEntry, OverdueAging],
+        'risk_service': [Blacklist, RiskAssessment, FraudDetection, RiskRule, RiskEvent, IpReputation, UserFeatureEvent, ShadowScore],
+        'notification_service': [Notification, NotificationCampaign, NotificationTemplate, NotificationChannel, NotificationStats],
         'file_service': [FileInfo, FileProcess, FileAccess, FileStorage]
     }
     
@@ -82,6 +82,202 @@ def create_tables():
         except Exception as e:
             print(f"❌ 创建数据库 {db_name} 表失败: {e}")
 
+# 已有库的表结构升级：create_all 只建新表，不会修改已存在的表。
+# 每条语句都可重复执行，按数据库顺序执行；同一数据库的语句在一个事务中执行，失败时整体回滚
+SCHEMA_UPGRADES = {
+    'user_service': [
+        # 通知服务按用户ID批量解析联系方式
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS email VARCHAR(128)",
+        "CREATE INDEX IF NOT EXISTS ix_users_email ON users (email)",
+    ],
+    'repayment_service': [
+        # 还款计划/待还查询的覆盖索引，逾期扫描与账龄明细的状态+到期日索引
+        "CREATE INDEX IF NOT EXISTS ix_repayments_loan_status_due "
+        "ON repayments (loan_id, status, due_date) INCLUDE (due_amount, paid_amount)",
+        "CREATE INDEX IF NOT EXISTS ix_repayments_status_due_date ON repayments (status, due_date)",
+    ],
+    'risk_service': [
+        # 黑名单增量同步依据，历史记录以创建时间作为最近更新时间
+        "ALTER TABLE blacklist ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP",
+        "UPDATE blacklist SET updated_at = COALESCE(created_at, now() AT TIME ZONE 'utc') WHERE updated_at IS NULL",
+        "CREATE INDEX IF NOT EXISTS ix_blacklist_updated_at ON blacklist (updated_at)",
+        # 审计记录的JSON文本列改为JSONB，仍是 text 类型时才转换（转换会重写整表）
+        """
+        DO $$
+        BEGIN
+            IF (SELECT data_type FROM information_schema.columns
+                WHERE table_name = 'risk_assessments' AND column_name = 'reasons') = 'text' THEN
+                ALTER TABLE risk_assessments
+                    ALTER COLUMN reasons TYPE JSONB USING NULLIF(reasons, '')::jsonb,
+                    ALTER COLUMN recommendations TYPE JSONB USING NULLIF(recommendations, '')::jsonb,
+                    ALTER COLUMN assessment_data TYPE JSONB USING NULLIF(assessment_data, '')::jsonb;
+            END IF;
+            IF (SELECT data_type FROM information_schema.columns
+                WHERE table_name = 'fraud_detections' AND column_name = 'behavior_data') = 'text' THEN
+                ALTER TABLE fraud_detections
+                    ALTER COLUMN behavior_data TYPE JSONB USING NULLIF(behavior_data, '')::jsonb,
+                    ALTER COLUMN risk_factors TYPE JSONB USING NULLIF(risk_factors, '')::jsonb;
+            END IF;
+        END $$
+        """,
+    ],
+    'notification_service': [
+        # 通知表改为按月分区：原表不是分区表时改名保留，连同索引、序列一起让出名称
+        """
+        DO $$
+        DECLARE
+            idx record;
+        BEGIN
+            IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('notifications')) = 'r' THEN
+                ALTER TABLE notifications RENAME TO notifications_legacy;
+                FOR idx IN SELECT indexname FROM pg_indexes
+                           WHERE schemaname = current_schema() AND tablename = 'notifications_legacy' LOOP
+                    EXECUTE format('ALTER INDEX %I RENAME TO %I', idx.indexname, idx.indexname || '_legacy');
+                END LOOP;
+                ALTER SEQUENCE IF EXISTS notifications_id_seq RENAME TO notifications_legacy_id_seq;
+            END IF;
+        END $$
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS notifications (
+            id SERIAL NOT NULL,
+            user_id INTEGER NOT NULL,
+            message TEXT NOT NULL,
+            type VARCHAR(32) NOT NULL,
+            channel VARCHAR(16) NOT NULL,
+            priority VARCHAR(16) NOT NULL,
+            status VARCHAR(16) NOT NULL,
+            sent_at TIMESTAMP WITHOUT TIME ZONE,
+            error_message TEXT,
+            channel_results JSON,
+            attempts INTEGER NOT NULL,
+            next_attempt_at TIMESTAMP WITHOUT TIME ZONE,
+            locked_until TIMESTAMP WITHOUT TIME ZONE,
+            template_id VARCHAR(64),
+            template_data JSON,
+            digest_items JSON,
+            campaign_id INTEGER,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            updated_at TIMESTAMP WITHOUT TIME ZONE,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_notifications_campaign_id ON notifications (campaign_id)",
+        "CREATE INDEX IF NOT EXISTS ix_notifications_queue ON notifications (priority, status, next_attempt_at)",
+        "CREATE INDEX IF NOT EXISTS ix_notifications_status ON notifications (status)",
+        "CREATE INDEX IF NOT EXISTS ix_notifications_type ON notifications (type)",
+        "CREATE INDEX IF NOT EXISTS ix_notifications_user_history ON notifications (user_id, created_at, id)",
+        # 把原表数据搬进分区表：历史数据所在的每个月各建一个分区，默认分区保持为空；
+        # 原表没有投递队列字段的未完成通知（旧版同步发送中断）与 failed 一起记为死信，可按需重新入队
+        """
+        DO $$
+        DECLARE
+            partition_start date;
+        BEGIN
+            IF to_regclass('notifications_legacy') IS NULL THEN
+                RETURN;
+            END IF;
+
+            ALTER TABLE notifications_legacy
+                ADD COLUMN IF NOT EXISTS priority VARCHAR(16),
+                ADD COLUMN IF NOT EXISTS channel_results JSON,
+                ADD COLUMN IF NOT EXISTS attempts INTEGER,
+                ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP WITHOUT TIME ZONE,
+                ADD COLUMN IF NOT EXISTS locked_until TIMESTAMP WITHOUT TIME ZONE,
+                ADD COLUMN IF NOT EXISTS digest_items JSON,
+                ADD COLUMN IF NOT EXISTS campaign_id INTEGER;
+            UPDATE notifications_legacy
+            SET created_at = COALESCE(updated_at, now() AT TIME ZONE 'utc')
+            WHERE created_at IS NULL;
+
+            FOR partition_start IN SELECT DISTINCT date_trunc('month', created_at)::date FROM notifications_legacy LOOP
+                EXECUTE format(
+                    'CREATE TABLE IF NOT EXISTS %I PARTITION OF notifications FOR VALUES FROM (%L) TO (%L)',
+                    'notifications_y' || to_char(partition_start, 'YYYY') || 'm' || to_char(partition_start, 'MM'),
+                    partition_start,
+                    (partition_start + interval '1 month')::date
+                );
+            END LOOP;
+            CREATE TABLE IF NOT EXISTS notifications_default PARTITION OF notifications DEFAULT;
+
+            INSERT INTO notifications (
+                id, user_id, message, type, channel, priority, status, sent_at, error_message,
+                channel_results, attempts, next_attempt_at, locked_until, template_id, template_data,
+                digest_items, campaign_id, created_at, updated_at
+            )
+            SELECT
+                id, user_id, message, type, channel, COALESCE(priority, 'normal'),
+                CASE
+                    WHEN status = 'failed' THEN 'dead'
+                    WHEN next_attempt_at IS NULL AND status NOT IN ('sent', 'dead', 'cancelled') THEN 'dead'
+                    ELSE status
+                END,
+                sent_at,
+                CASE
+                    WHEN next_attempt_at IS NULL AND status NOT IN ('sent', 'dead', 'cancelled', 'failed')
+                    THEN COALESCE(error_message, '迁移前未完成投递')
+                    ELSE error_message
+                END,
+                channel_results, COALESCE(attempts, 0), COALESCE(next_attempt_at, created_at), locked_until,
+                template_id, template_data, digest_items, campaign_id, created_at, updated_at
+            FROM notifications_legacy;
+
+            PERFORM setval(
+                pg_get_serial_sequence('notifications', 'id'),
+                (SELECT COALESCE(max(id), 0) + 1 FROM notifications_legacy),
+                false
+            );
+            DROP TABLE notifications_legacy;
+        END $$
+        """,
+        # 投递结果按 (日期, 渠道) 累加到日汇总，依赖唯一约束；先合并已有的重复行
+        """
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_notification_stats_date_channel') THEN
+                UPDATE notification_stats AS stats
+                SET total_sent = merged.total_sent,
+                    success_count = merged.success_count,
+                    failure_count = merged.failure_count
+                FROM (
+                    SELECT min(id) AS id,
+                           sum(COALESCE(total_sent, 0)) AS total_sent,
+                           sum(COALESCE(success_count, 0)) AS success_count,
+                           sum(COALESCE(failure_count, 0)) AS failure_count
+                    FROM notification_stats
+                    GROUP BY date, channel
+                    HAVING count(*) > 1
+                ) AS merged
+                WHERE stats.id = merged.id;
+                DELETE FROM notification_stats AS duplicate
+                USING notification_stats AS kept
+                WHERE duplicate.date = kept.date AND duplicate.channel = kept.channel AND duplicate.id > kept.id;
+                ALTER TABLE notification_stats
+                    ADD CONSTRAINT uq_notification_stats_date_channel UNIQUE (date, channel);
+            END IF;
+        END $$
+        """,
+        # 编译缓存按模板版本区分，已有模板从版本 1 开始
+        "ALTER TABLE notification_templates ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1",
+    ],
+}
+
+
+def upgrade_tables():
+    """对已存在的表执行结构升级"""
+    base_url = settings.database_url.rsplit('/', 1)[0] + '/'
+
+    for db_name, statements in SCHEMA_UPGRADES.items():
+        try:
+            engine = create_engine(base_url + db_name, future=True)
+            with engine.begin() as conn:
+                for statement in statements:
+                    conn.exec_driver_sql(statement)
+            print(f"✅ 数据库 {db_name} 表结构升级成功")
+        except Exception as e:
+            print(f"❌ 升级数据库 {db_name} 表结构失败: {e}")
+
+
 def insert_initial_data():
     """插入初始数据"""
     base_url = settings.database_url.rsplit('/', 1)[0] + '/'
@@ -155,7 +351,11 @@ def main():
     print("\n📋 创建表结构...")
     create_tables()
     
-    # 3. 插入初始数据
+    # 3. 升级已有表结构
+    print("\n🔧 升级表结构...")
+    upgrade_tables()
+    
+    # 4. 插入初始数据
     print("\n📝 插入初始数据...")
     insert_initial_data()
     
@@ -1,5 +1,6 @@
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from typing import List, Optional
 import sys
@@ -14,7 +15,7 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'shared'))
 
 from shared.config.settings import settings
 from shared.utils.database import get_db_session
-from shared.utils.auth import verify_token
+from shared.utils.auth import verify_internal_token, verify_token
 from shared.models.loan import Loan
 from pydantic import BaseModel
 
@@ -148,6 +149,36 @@ async def send_notification(user_id: int, message: str, notification_type: str =
             pass  # 通知发送失败不影响主流程
 
 
+def loan_summary(db: Session, user_id: int) -> dict:
+    """用户的借款汇总：风控特征 total_borrowed 与 pending_repay 的唯一来源"""
+    total_borrowed, pending_repay = db.query(
+        func.coalesce(func.sum(Loan.amount), 0),
+        func.coalesce(func.sum(Loan.remaining_amount), 0)
+    ).filter(
+        Loan.user_id == user_id,
+        Loan.status.in_(("approved", "settled"))
+    ).one()
+    return {"total_borrowed": float(total_borrowed), "pending_repay": float(pending_repay)}
+
+
+async def publish_loan_features(db: Session, user_id: int):
+    """把用户的借款汇总推送给风控服务的特征存储"""
+    features = loan_summary(db, user_id)
+    
+    async with httpx.AsyncClient() as client:
+        try:
+            await client.post(f"{settings.risk_service_url}/features/events", json={
+                "events": [{
+                    "user_id": user_id,
+                    "features": features,
+                    "event_time": datetime.utcnow().isoformat(),
+                    "source": "loan_service"
+                }]
+            })
+        except Exception:
+            pass  # 推送失败时风控服务在特征过期后回源
+
+
 # API路由
 @app.post("/apply", response_model=LoanResponse)
 async def apply_loan(
@@ -222,6 +253,9 @@ async def apply_loan(
     db.commit()
     db.refresh(loan)
     
+    if not need_manual_approval:
+        await publish_loan_features(db, loan.user_id)
+    
     # 发送通知
     if need_manual_approval:
         await send_notification(
@@ -316,6 +350,9 @@ async def approve_loan(
     db.commit()
     db.refresh(loan)
     
+    if approval_data.approved:
+        await publish_loan_features(db, loan.user_id)
+    
     return loan
 
 
@@ -332,6 +369,15 @@ async def get_all_loans(
     return query.all()
 
 
+@app.get("/internal/users/{user_id}/loan-summary", dependencies=[Depends(verify_internal_token)])
+async def get_loan_summary(
+    user_id: int,
+    db: Session = Depends(lambda: next(get_db_session("loan_service")))
+):
+    """用户的借款汇总（内部接口，风控服务特征过期时回源用）"""
+    return {"user_id": user_id, **loan_summary(db, user_id)}
+
+
 @app.get("/health")
 async def health_check():
     """健康检查"""
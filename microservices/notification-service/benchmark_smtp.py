@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+邮件发送吞吐基准
+在独立进程中启动 aiosmtpd 邮件接收端，对比每封邮件新建连接（旧的 smtplib 方式）与连接池并发发送的 封/秒
+
+用法（需要额外安装 aiosmtpd）:
+    pip install aiosmtpd
+    python benchmark_smtp.py --messages 2000 --connections 10 --latency-ms 5
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import smtplib
+import time
+from email.message import EmailMessage
+
+from aiosmtpd.controller import Controller
+
+from smtp_pool import EmailTransport, SmtpProvider
+
+
+class CountingHandler:
+    """只计数的接收端，可模拟服务器处理每封邮件的耗时"""
+
+    def __init__(self, latency: float, received):
+        self.latency = latency
+        self.received = received
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        with self.received.get_lock():
+            self.received.value += 1
+        return "250 OK"
+
+
+def run_sink(port: int, latency: float, received, ready, done):
+    """接收端放在单独进程，避免与发送端争用 GIL"""
+    controller = Controller(CountingHandler(latency, received), hostname="127.0.0.1", port=port)
+    controller.start()
+    ready.set()
+    done.wait()
+    controller.stop()
+
+
+def build_message(index: int) -> EmailMessage:
+    msg = EmailMessage()
+    msg['From'] = "noreply@example.com"
+    msg['To'] = f"user{index}@example.com"
+    msg['Subject'] = "系统通知"
+    msg.set_content(f"<p>您的还款日即将到来 #{index}</p>", subtype='html')
+    return msg
+
+
+def run_connect_per_message(host: str, port: int, messages: int) -> float:
+    """每封邮件建立连接、发送、QUIT，顺序执行"""
+    start = time.perf_counter()
+    for index in range(messages):
+        server = smtplib.SMTP(host, port)
+        server.send_message(build_message(index))
+        server.quit()
+    return time.perf_counter() - start
+
+
+async def run_pooled(host: str, port: int, messages: int, connections: int) -> float:
+    """连接池复用连接，所有邮件并发提交，并发数由连接上限约束"""
+    transport = EmailTransport([
+        SmtpProvider(
+            name="sink",
+            hostname=host,
+            port=port,
+            start_tls=False,
+            max_connections=connections,
+            max_messages_per_connection=messages
+        )
+    ])
+    start = time.perf_counter()
+    await asyncio.gather(*[transport.send(build_message(index)) for index in range(messages)])
+    elapsed = time.perf_counter() - start
+    await transport.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SMTP发送吞吐基准")
+    parser.add_argument("--messages", type=int, default=2000, help="发送邮件数")
+    parser.add_argument("--connections", type=int, default=10, help="连接池连接上限")
+    parser.add_argument("--latency-ms", type=float, default=5, help="接收端模拟的每封处理耗时（毫秒）")
+    parser.add_argument("--port", type=int, default=8025, help="接收端端口")
+    args = parser.parse_args()
+
+    received = multiprocessing.Value("i", 0)
+    ready, done = multiprocessing.Event(), multiprocessing.Event()
+    sink = multiprocessing.Process(
+        target=run_sink,
+        args=(args.port, args.latency_ms / 1000, received, ready, done)
+    )
+    sink.start()
+    ready.wait()
+    try:
+        # 旧方式太慢，只发一部分来估算
+        sample = min(args.messages, 500)
+        elapsed = run_connect_per_message("127.0.0.1", args.port, sample)
+        print(f"每封新建连接: {sample / elapsed:.0f} 封/秒（{sample} 封，{elapsed:.2f} 秒）")
+
+        elapsed = asyncio.run(run_pooled("127.0.0.1", args.port, args.messages, args.connections))
+        print(
+            f"连接池（{args.connections} 个连接）: {args.messages / elapsed:.0f} 封/秒"
+            f"（{args.messages} 封，{elapsed:.2f} 秒）"
+        )
+        print(f"接收端共收到 {received.value} 封")
+    finally:
+        done.set()
+        sink.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+# 批量通知活动
+
+import asyncio
+import threading
+import time
+from datetime import datetime
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from prometheus_client import Counter
+from sqlalchemy import func, insert
+
+from shared.models.notification import Notification, NotificationCampaign
+from templates import TemplateRegistry, TemplateRenderError
+
+
+CAMPAIGN_RECIPIENTS = Counter('notification_campaign_recipients_total', 'Campaign recipients processed', ['outcome'])
+
+# 活动结束后的状态
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+# 尚未投递完成的通知状态
+UNFINISHED_DELIVERY_STATUSES = ("pending", "retry", "sending")
+
+
+class ChannelThrottle:
+    """按渠道服务商的速率上限给批量通知排投递时间
+
+    每条通知占用目标渠道的一个时间槽，同一渠道相邻两槽间隔 1/速率 秒；
+    channel=all 的通知同时占用所有渠道，间隔取最慢的渠道。
+    只约束本实例安排的批量通知，单条 /send 不经过这里。
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        self.rates = rates
+        self._next_slot: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def targets(self, channel: str) -> List[str]:
+        return list(self.rates) if channel == "all" else [channel]
+
+    def schedule(self, channel: str, count: int) -> List[datetime]:
+        """为 count 条通知预留时间槽，返回每条的最早投递时间"""
+        targets = self.targets(channel)
+        interval = max(1.0 / self.rates[target] for target in targets)
+        with self._lock:
+            start = max([time.time()] + [self._next_slot.get(target, 0.0) for target in targets])
+            for target in targets:
+                self._next_slot[target] = start + count * interval
+        return [datetime.utcfromtimestamp(start + i * interval) for i in range(count)]
+
+
+class CampaignRunner:
+    """在后台逐块拉取收件人、按用户数据渲染模板并批量写入通知
+
+    每块的通知与活动进度（游标、计数）在同一事务提交，实例重启后从游标继续，不会重复入队；
+    多个实例同时继续同一活动时，只有游标仍是本块起点的实例能写入，其余实例发现游标已前进后退出；
+    写入的通知由投递协程按安排的时间发送，收件人的联系方式在认领后批量解析。
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        templates: TemplateRegistry,
+        throttle: ChannelThrottle,
+        repayment_service_url: str,
+        chunk_size: int = 500,
+        on_enqueued: Optional[Callable[[], None]] = None,
+        headers: Optional[Dict[str, str]] = None
+    ):
+        self.session_factory = session_factory
+        self.templates = templates
+        self.throttle = throttle
+        self.repayment_service_url = repayment_service_url
+        self.chunk_size = chunk_size
+        self.on_enqueued = on_enqueued
+        # 还款服务的内部接口要求服务令牌
+        self.http_client = httpx.AsyncClient(timeout=30, headers=headers)
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def start(self, campaign_id: int):
+        if campaign_id in self._tasks:
+            return
+        task = asyncio.ensure_future(self._run(campaign_id))
+        self._tasks[campaign_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(campaign_id, None))
+
+    async def resume(self):
+        """继续上次停机时仍在运行的活动"""
+        loop = asyncio.get_running_loop()
+        for campaign_id in await loop.run_in_executor(None, self._running_ids):
+            self.start(campaign_id)
+
+    async def stop(self):
+        """停止后台任务，活动保持运行状态，下次启动时继续"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.http_client.aclose()
+
+    def _running_ids(self) -> List[int]:
+        with self.session_factory() as db:
+            rows = db.query(NotificationCampaign.id).filter(NotificationCampaign.status == "running").all()
+        return [row.id for row in rows]
+
+    def _load(self, campaign_id: int) -> dict:
+        with self.session_factory() as db:
+            campaign = db.query(NotificationCampaign).filter(NotificationCampaign.id == campaign_id).one()
+            return {
+                "id": campaign.id,
+                "template_id": campaign.template_id,
+                "channel": campaign.channel,
+                "type": campaign.type,
+                "source": campaign.source,
+                "source_params": campaign.source_params or {},
+                "resume_after": campaign.resume_after,
+            }
+
+    def _source(self, campaign: dict) -> AsyncIterator[Tuple[List[dict], int]]:
+        if campaign["source"] == "list":
+            return self._list_recipients(campaign["source_params"]["recipients"], campaign["resume_after"])
+        if campaign["source"] == "repayments_due":
+            return self._due_repayment_recipients(campaign["source_params"]["due_date"], campaign["resume_after"])
+        raise ValueError(f"未知的收件人来源: {campaign['source']}")
+
+    async def _list_recipients(self, recipients: List[dict], resume_after: int):
+        """请求中给出的收件人列表，游标是下一块的起始下标"""
+        for start in range(resume_after, len(recipients), self.chunk_size):
+            chunk = recipients[start:start + self.chunk_size]
+            yield chunk, start + len(chunk)
+
+    async def _due_repayment_recipients(self, due_date: str, resume_after: int):
+        """从还款服务分页拉取某日到期的期次，游标是最后一条还款记录ID"""
+        after_id = resume_after
+        while True:
+            response = await self.http_client.get(
+                f"{self.repayment_service_url}/internal/due-repayments",
+                params={"due_date": due_date, "after_id": after_id, "limit": self.chunk_size}
+            )
+            response.raise_for_status()
+            rows = response.json()
+            if not rows:
+                return
+
+            after_id = rows[-1]["repayment_id"]
+            yield [
+                {
+                    "user_id": row["user_id"],
+                    "data": {"amount": row["amount"], "due_date": row["due_date"], "loan_id": row["loan_id"]},
+                }
+                for row in rows
+            ], after_id
+
+            if len(rows) < self.chunk_size:
+                return
+
+    async def _run(self, campaign_id: int):
+        loop = asyncio.get_running_loop()
+        try:
+            campaign = await loop.run_in_executor(None, self._load, campaign_id)
+            cursor = campaign["resume_after"]
+            async for recipients, resume_after in self._source(campaign):
+                if not await loop.run_in_executor(
+                    None, self._enqueue_chunk, campaign, recipients, cursor, resume_after
+                ):
+                    return
+                cursor = resume_after
+                if self.on_enqueued is not None:
+                    self.on_enqueued()
+            await loop.run_in_executor(None, self._finish, campaign_id, "completed", None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"通知活动 {campaign_id} 执行失败: {e}")
+            await loop.run_in_executor(None, self._finish, campaign_id, "failed", str(e))
+
+    def _enqueue_chunk(self, campaign: dict, recipients: List[dict], cursor: int, resume_after: int) -> bool:
+        """渲染一块收件人的通知并批量插入，与活动进度同一事务提交
+
+        cursor 是本块的起始游标。活动已结束，或游标已被其他实例推进（本块已入队）时返回 False。
+        """
+        with self.session_factory() as db:
+            record = db.query(NotificationCampaign).filter(
+                NotificationCampaign.id == campaign["id"]
+            ).with_for_update().one()
+            if record.status != "running":
+                return False
+            if record.resume_after != cursor:
+                print(f"通知活动 {campaign['id']} 已由其他实例继续执行，本实例停止")
+                return False
+
+            rows = []
+            for recipient in recipients:
+                data = recipient.get("data") or {}
+                try:
+                    message = self.templates.render(db, campaign["template_id"], data)
+                except TemplateRenderError as e:
+                    print(f"通知活动 {campaign['id']} 渲染用户 {recipient['user_id']} 的模板失败: {e}")
+                    continue
+                rows.append({
+                    "user_id": recipient["user_id"],
+                    "message": message,
+                    "type": campaign["type"],
+                    "channel": campaign["channel"],
+                    "priority": "bulk",
+                    "status": "pending",
+                    "template_id": campaign["template_id"],
+                    "template_data": data,
+                    "campaign_id": campaign["id"],
+                    "attempts": 0,
+                })
+
+            for row, due_at in zip(rows, self.throttle.schedule(campaign["channel"], len(rows))):
+                row["next_attempt_at"] = due_at
+            if rows:
+                # 多行 VALUES 一条语句写入整块
+                db.execute(insert(Notification).values(rows))
+
+            failed = len(recipients) - len(rows)
+            record.resume_after = resume_after
+            record.total_recipients += len(recipients)
+            record.enqueued += len(rows)
+            record.render_failed += failed
+            db.commit()
+
+        CAMPAIGN_RECIPIENTS.labels(outcome="enqueued").inc(len(rows))
+        CAMPAIGN_RECIPIENTS.labels(outcome="render_failed").inc(failed)
+        return True
+
+    def _finish(self, campaign_id: int, status: str, error_message: Optional[str]):
+        with self.session_factory() as db:
+            db.query(NotificationCampaign).filter(
+                NotificationCampaign.id == campaign_id,
+                NotificationCampaign.status == "running"
+            ).update({
+                "status": status,
+                "error_message": error_message,
+                "finished_at": datetime.utcnow()
+            }, synchronize_session=False)
+            db.commit()
+
+    def cancel(self, db, campaign_id: int) -> bool:
+        """取消活动：停止入队，尚未投递的通知不再发送"""
+        updated = db.query(NotificationCampaign).filter(
+            NotificationCampaign.id == campaign_id,
+            NotificationCampaign.status == "running"
+        ).update({"status": "cancelled", "finished_at": datetime.utcnow()}, synchronize_session=False)
+        if updated:
+            db.query(Notification).filter(
+                Notification.campaign_id == campaign_id,
+                Notification.status.in_(("pending", "retry"))
+            ).update({"status": "cancelled"}, synchronize_session=False)
+        db.commit()
+        return updated > 0
+
+
+def campaign_progress(db, campaign: NotificationCampaign) -> dict:
+    """活动的入队进度与已入队通知的投递情况"""
+    delivery = dict(db.query(Notification.status, func.count(Notification.id)).filter(
+        Notification.campaign_id == campaign.id
+    ).group_by(Notification.status).all())
+
+    return {
+        "id": campaign.id,
+        "name": campaign.name,
+        "template_id": campaign.template_id,
+        "channel": campaign.channel,
+        "source": campaign.source,
+        "status": campaign.status,
+        "total_recipients": campaign.total_recipients,
+        "enqueued": campaign.enqueued,
+        "render_failed": campaign.render_failed,
+        "delivery": delivery,
+        "done": campaign.status in FINISHED_STATUSES and not any(
+            delivery.get(status, 0) for status in UNFINISHED_DELIVERY_STATUSES
+        ),
+        "error_message": campaign.error_message,
+        "created_at": campaign.created_at.isoformat() if campaign.created_at else None,
+        "finished_at": campaign.finished_at.isoformat() if campaign.finished_at else None,
+    }
@@ -0,0 +1,244 @@
+# 用户联系方式解析
+
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+import httpx
+from prometheus_client import Counter
+from redis.exceptions import RedisError
+
+
+CONTACT_LOOKUPS = Counter('notification_contact_lookups_total', 'Contact cache lookups by outcome', ['outcome'])
+CONTACT_FETCHES = Counter('notification_contact_fetches_total', 'Batched contact requests sent to user-service')
+CONTACT_INVALIDATIONS = Counter(
+    'notification_contact_invalidations_total', 'Contact invalidation broadcasts received', ['outcome']
+)
+
+
+class ContactLookupError(Exception):
+    """从用户服务获取联系方式失败"""
+
+
+class Contact:
+    """一个用户的联系方式，用户不存在或未填写时字段为 None"""
+
+    __slots__ = ("user_id", "email", "phone")
+
+    def __init__(self, user_id: int, email: Optional[str] = None, phone: Optional[str] = None):
+        self.user_id = user_id
+        self.email = email
+        self.phone = phone
+
+
+class ContactCache:
+    """带过期时间的 LRU 缓存，超出容量时淘汰最久未使用的用户"""
+
+    def __init__(self, max_size: int = 100000, ttl: float = 1800):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # user_id -> (过期时间, Contact)
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[Contact]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, contact = entry
+            if expires_at <= now:
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return contact
+
+    def put_many(self, contacts: Iterable[Contact]):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for contact in contacts:
+                self._entries[contact.user_id] = (expires_at, contact)
+                self._entries.move_to_end(contact.user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_ids: Iterable[int]) -> int:
+        with self._lock:
+            return sum(1 for user_id in user_ids if self._entries.pop(user_id, None) is not None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ContactResolver:
+    """按用户ID解析邮箱与手机号：先查缓存，未命中的合并成批量请求发给用户服务
+
+    同一时刻并发投递的未命中会在 batch_window 秒内攒成一次请求；
+    投递协程认领一批通知后调用 prefetch，一次请求拉取整批收件人中未缓存的用户。
+    """
+
+    def __init__(
+        self,
+        user_service_url: str,
+        cache: ContactCache,
+        headers: Optional[Dict[str, str]] = None,
+        batch_size: int = 1000,
+        batch_window: float = 0.01,
+        timeout: float = 5
+    ):
+        self.user_service_url = user_service_url
+        self.cache = cache
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        # 用户服务的内部接口要求服务令牌
+        self.http_client = httpx.AsyncClient(timeout=timeout, headers=headers)
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    async def close(self):
+        await self.http_client.aclose()
+
+    async def get(self, user_id: int) -> Contact:
+        """解析单个用户的联系方式"""
+        contact = self.cache.get(user_id)
+        if contact is not None:
+            CONTACT_LOOKUPS.labels(outcome="hit").inc()
+            return contact
+        CONTACT_LOOKUPS.labels(outcome="miss").inc()
+
+        future = self._pending.get(user_id)
+        if future is None:
+            future = self._pending[user_id] = asyncio.get_running_loop().create_future()
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+            elif self._flush_handle is None:
+                self._flush_handle = asyncio.get_running_loop().call_later(self.batch_window, self._flush)
+        # 多个等待者共享同一个 future，取消其中一个不影响其他
+        return await asyncio.shield(future)
+
+    async def prefetch(self, user_ids: Iterable[int]):
+        """批量预取缓存中没有的用户，失败只记录日志，发送时会再次获取"""
+        missing = list(dict.fromkeys(user_id for user_id in user_ids if self.cache.get(user_id) is None))
+        for start in range(0, len(missing), self.batch_size):
+            try:
+                await self._fetch(missing[start:start + self.batch_size])
+            except ContactLookupError as e:
+                print(f"预取用户联系方式失败: {e}")
+                return
+
+    def invalidate(self, user_ids: Iterable[int]) -> int:
+        return self.cache.invalidate(user_ids)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, {}
+        if pending:
+            asyncio.ensure_future(self._resolve(pending))
+
+    async def _resolve(self, pending: Dict[int, asyncio.Future]):
+        try:
+            contacts = await self._fetch(list(pending))
+        except Exception as e:
+            error = e if isinstance(e, ContactLookupError) else ContactLookupError(str(e))
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(error)
+                    # 所有等待者都已取消时避免 "exception was never retrieved" 警告
+                    future.exception()
+            return
+        for user_id, future in pending.items():
+            if not future.done():
+                future.set_result(contacts[user_id])
+
+    async def _fetch(self, user_ids: List[int]) -> Dict[int, Contact]:
+        """向用户服务批量请求联系方式并写入缓存；用户不存在时缓存空的联系方式"""
+        CONTACT_FETCHES.inc()
+        try:
+            response = await self.http_client.post(
+                f"{self.user_service_url}/internal/contacts",
+                json={"user_ids": user_ids}
+            )
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            raise ContactLookupError(f"用户服务请求失败: {e}")
+
+        contacts = {user_id: Contact(user_id) for user_id in user_ids}
+        for row in response.json():
+            contacts[row["user_id"]] = Contact(row["user_id"], row.get("email"), row.get("phone"))
+        self.cache.put_many(contacts.values())
+        return contacts
+
+    def stats(self) -> dict:
+        return {
+            "cached": len(self.cache),
+            "max_size": self.cache.max_size,
+            "ttl": self.cache.ttl,
+            "pending": len(self._pending),
+        }
+
+
+class ContactInvalidationSubscriber:
+    """订阅用户服务经 Redis 广播的联系方式变更，每个实例各自清除缓存
+
+    消息是用户ID的 JSON 数组。Pub/Sub 不保留未连接期间的消息，每次（重新）订阅成功后清空整个缓存；
+    连接断开期间的变更最迟在重新连上或缓存过期时生效。
+    """
+
+    def __init__(self, redis_client, channel: str, resolver: ContactResolver, retry_interval: float = 5):
+        self.redis = redis_client
+        self.channel = channel
+        self.resolver = resolver
+        self.retry_interval = retry_interval
+        self.subscribed = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                self.resolver.cache.clear()
+                self.subscribed = True
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._apply(message["data"])
+            except RedisError as e:
+                print(f"联系方式失效订阅中断，{self.retry_interval} 秒后重新订阅: {e}")
+            finally:
+                self.subscribed = False
+                await pubsub.aclose()
+            await asyncio.sleep(self.retry_interval)
+
+    def _apply(self, data):
+        try:
+            user_ids = [int(user_id) for user_id in json.loads(data)]
+        except (TypeError, ValueError) as e:
+            CONTACT_INVALIDATIONS.labels(outcome="invalid").inc()
+            print(f"忽略无法解析的联系方式失效消息: {e}")
+            return
+        self.resolver.invalidate(user_ids)
+        CONTACT_INVALIDATIONS.labels(outcome="applied").inc()
+
+
+async def publish_invalidation(redis_client, channel: str, user_ids: List[int]) -> int:
+    """向所有实例广播联系方式失效，返回收到消息的订阅者数"""
+    return await redis_client.publish(channel, json.dumps(user_ids))
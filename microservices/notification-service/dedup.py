@@ -0,0 +1,206 @@
+# 通知去重与合并
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from prometheus_client import Counter
+from redis.exceptions import RedisError
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from shared.models.notification import Notification
+
+
+DEDUP_RESULTS = Counter('notification_dedup_total', 'Incoming notifications by dedup outcome', ['type', 'outcome'])
+
+# 仅当键仍指向本次写入的值时才删除，避免删掉窗口内其他请求写入的键
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# 仅当键仍指向本次写入的值时才延长过期时间
+_CONFIRM_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def dedup_key(user_id: int, notification_type: str, message: str) -> str:
+    """(用户, 类型, 内容摘要) 组成的去重键"""
+    digest = hashlib.sha256(message.encode("utf-8")).hexdigest()
+    return f"notification_dedup:{user_id}:{notification_type}:{digest}"
+
+
+class RedisDedupStore:
+    """Redis 去重：SET NX EX 占位，多个实例共享同一窗口"""
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self._release = redis_client.register_script(_RELEASE_SCRIPT)
+        self._confirm = redis_client.register_script(_CONFIRM_SCRIPT)
+
+    def claim(self, key: str, value: str, ttl: int) -> Optional[str]:
+        """键不存在时写入并返回 None，已存在时返回已有的值；一次往返完成"""
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.set(key, value, nx=True, ex=ttl)
+        pipe.get(key)
+        created, existing = pipe.execute()
+        return None if created else existing
+
+    def release(self, key: str, value: str):
+        self._release(keys=[key], args=[value])
+
+    def confirm(self, key: str, value: str, ttl: int):
+        self._confirm(keys=[key], args=[value, ttl])
+
+
+class LocalDedupStore:
+    """进程内去重，Redis 不可用或未启用时使用，只对本实例收到的请求去重"""
+
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> (过期时间, 值)
+        self._lock = threading.Lock()
+
+    def claim(self, key: str, value: str, ttl: int) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+            self._entries.pop(key, None)
+            self._entries[key] = (now + ttl, value)
+            return None
+
+    def release(self, key: str, value: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == value:
+                del self._entries[key]
+
+    def confirm(self, key: str, value: str, ttl: int):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == value:
+                self._entries[key] = (time.monotonic() + ttl, value)
+                self._entries.move_to_end(key)
+
+    def _evict(self, now: float):
+        """按写入（确认）顺序淘汰，与过期顺序最多相差一个占位时长；同时限制条目数
+
+        队首未过期时其后已过期的条目暂不回收，claim 时仍会检查过期时间。
+        """
+        while self._entries:
+            expires_at, _ = next(iter(self._entries.values()))
+            if expires_at > now and len(self._entries) < self.max_size:
+                break
+            self._entries.popitem(last=False)
+
+
+class NotificationDeduplicator:
+    """窗口内相同 (用户, 类型, 内容) 的通知只入队一次；Redis 出错时退回进程内去重
+
+    入队事务提交前只以 claim_ttl 秒临时占位，提交后 confirm 延长到完整窗口；
+    实例在提交前崩溃时占位很快过期，调用方重试不会被当成重复而丢失通知。
+    """
+
+    def __init__(self, redis_client=None, window: int = 600, claim_ttl: int = 30):
+        self.redis_store = RedisDedupStore(redis_client) if redis_client is not None else None
+        self.local_store = LocalDedupStore()
+        self.window = window
+        self.claim_ttl = min(claim_ttl, window)
+
+    def claim(self, key: str, notification_id: int) -> Optional[int]:
+        """临时登记本次通知，窗口内已有相同通知时返回其ID"""
+        value = str(notification_id)
+        if self.redis_store is not None:
+            try:
+                existing = self.redis_store.claim(key, value, self.claim_ttl)
+                return int(existing) if existing is not None else None
+            except RedisError as e:
+                print(f"通知去重读写Redis失败，使用进程内去重: {e}")
+        existing = self.local_store.claim(key, value, self.claim_ttl)
+        return int(existing) if existing is not None else None
+
+    def confirm(self, key: str, notification_id: int):
+        """入队事务提交后把登记延长到完整去重窗口"""
+        value = str(notification_id)
+        if self.redis_store is not None:
+            try:
+                self.redis_store.confirm(key, value, self.window)
+            except RedisError as e:
+                print(f"确认通知去重登记失败: {e}")
+        self.local_store.confirm(key, value, self.window)
+
+    def release(self, key: str, notification_id: int):
+        """入队失败时撤销登记"""
+        value = str(notification_id)
+        if self.redis_store is not None:
+            try:
+                self.redis_store.release(key, value)
+            except RedisError as e:
+                print(f"撤销通知去重登记失败: {e}")
+        self.local_store.release(key, value)
+
+
+def digest_message(items: List[str]) -> str:
+    """把窗口内的多条通知合并成一条摘要"""
+    if len(items) == 1:
+        return items[0]
+    return f"您有 {len(items)} 条新通知：\n" + "\n".join(
+        f"{index}. {item}" for index, item in enumerate(items, 1)
+    )
+
+
+def coalesce(db: Session, user_id: int, notification_type: str, channel: str,
+             message: str, window: int, priority: str = "normal") -> Notification:
+    """合并到同一用户同类型、仍在等待窗口内的摘要通知，没有时新建一条并推迟 window 秒投递
+
+    用事务级 advisory 锁串行化同一 (用户, 类型) 的合并，多个实例同时收到也只会有一条摘要；
+    摘要一旦被投递协程认领（状态不再是 pending），之后的通知开启新的摘要。调用方负责提交事务。
+    """
+    db.execute(select(func.pg_advisory_xact_lock(user_id, func.hashtext(notification_type))))
+
+    now = datetime.utcnow()
+    notification = db.query(Notification).filter(
+        Notification.user_id == user_id,
+        Notification.type == notification_type,
+        Notification.channel == channel,
+        Notification.priority == priority,
+        Notification.status == "pending",
+        Notification.digest_items.isnot(None),
+        Notification.created_at >= now - timedelta(seconds=window)
+    ).order_by(Notification.created_at.desc()).with_for_update().first()
+
+    if notification is None:
+        notification = Notification(
+            user_id=user_id,
+            message=message,
+            type=notification_type,
+            channel=channel,
+            priority=priority,
+            status="pending",
+            digest_items=[message],
+            next_attempt_at=now + timedelta(seconds=window)
+        )
+        db.add(notification)
+        db.flush()
+        DEDUP_RESULTS.labels(type=notification_type, outcome="digest_opened").inc()
+        return notification
+
+    items = list(notification.digest_items) + [message]
+    notification.digest_items = items
+    notification.message = digest_message(items)
+    db.flush()
+    DEDUP_RESULTS.labels(type=notification_type, outcome="coalesced").inc()
+    return notification
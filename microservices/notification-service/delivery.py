@@ -0,0 +1,360 @@
+# 通知投递队列
+
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import and_, func, or_
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from shared.models.notification import Notification
+from rollups import record_outcomes, retract_outcomes
+from lanes import LANES, LANE_RANK, WeightedLaneScheduler
+from rate_limit import TokenBucket
+from contacts import ContactResolver
+
+
+# Prometheus指标
+DELIVERY_RESULTS = Counter(
+    'notification_delivery_total', 'Notification delivery attempts by outcome', ['channel', 'outcome']
+)
+DELIVERY_RETRIES = Counter('notification_retries_total', 'Notifications rescheduled for retry', ['channel'])
+DELIVERY_DEAD_LETTERED = Counter('notification_dead_lettered_total', 'Notifications moved to dead letter', ['channel'])
+DELIVERY_SECONDS = Histogram('notification_delivery_seconds', 'Time spent delivering one notification', ['channel'])
+CHANNEL_RESULTS = Counter('notification_channel_sends_total', 'Per-channel send results', ['channel', 'outcome'])
+CHANNEL_SECONDS = Histogram('notification_channel_send_seconds', 'Time spent in one channel send', ['channel'])
+STATS_UPDATE_ERRORS = Counter('notification_stats_update_errors_total', 'Daily rollup updates rolled back')
+QUEUE_LAG = Histogram(
+    'notification_queue_lag_seconds', 'Delay between a notification becoming due and being claimed', ['lane'],
+    buckets=(0.1, 0.5, 1, 2, 5, 10, 30, 60, 300, 900, 3600)
+)
+QUEUE_OLDEST_DUE = Gauge('notification_queue_oldest_due_seconds', 'Age of the oldest due notification', ['lane'])
+QUEUE_DEPTH = Gauge('notification_queue_depth', 'Notifications waiting for delivery', ['lane'])
+
+# 可认领的状态：新建与等待重试
+QUEUED_STATUSES = ("pending", "retry")
+
+
+class DeliveryFailed(Exception):
+    """可重试的投递失败，附带各渠道的发送结果"""
+
+    def __init__(self, message: str, channel_results: Optional[Dict[str, dict]] = None):
+        super().__init__(message)
+        self.channel_results = channel_results
+
+
+class PermanentDeliveryError(Exception):
+    """不可重试的投递失败（如渠道不存在、收件人无效），直接进入死信"""
+
+
+class DeliveryJob:
+    """认领出来的一条通知，脱离数据库会话使用"""
+
+    __slots__ = (
+        "id", "user_id", "message", "type", "channel", "lane", "template_id", "attempts", "created_at", "due_at"
+    )
+
+    def __init__(self, notification: Notification, due_at: datetime):
+        self.id = notification.id
+        self.user_id = notification.user_id
+        self.message = notification.message
+        self.type = notification.type
+        self.channel = notification.channel
+        self.lane = notification.priority or "normal"
+        self.template_id = notification.template_id
+        self.attempts = notification.attempts
+        self.created_at = notification.created_at
+        self.due_at = due_at
+
+
+async def send_to_channel(
+    name: str,
+    channel,
+    job: DeliveryJob,
+    timeout: float,
+    limiter: Optional[TokenBucket] = None
+) -> dict:
+    """发送到单个渠道，超时或出错都记为该渠道的结果而不抛出；先按通道优先级取服务商令牌"""
+    if limiter is not None:
+        await limiter.acquire(LANE_RANK.get(job.lane, len(LANES)), job.lane)
+
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(channel.send(job.user_id, job.message, lane=job.lane), timeout)
+        result = {"status": "sent", "error": None}
+    except asyncio.TimeoutError:
+        result = {"status": "timeout", "error": f"超过 {timeout} 秒未完成"}
+    except Exception as e:
+        result = {"status": "failed", "error": str(e) or type(e).__name__}
+
+    elapsed = time.perf_counter() - start
+    result["latency_ms"] = round(elapsed * 1000, 1)
+    CHANNEL_RESULTS.labels(channel=name, outcome=result["status"]).inc()
+    CHANNEL_SECONDS.labels(channel=name).observe(elapsed)
+    return result
+
+
+async def fan_out(
+    targets: Dict[str, object],
+    job: DeliveryJob,
+    timeouts: Dict[str, float],
+    limiters: Optional[Dict[str, TokenBucket]] = None
+) -> Dict[str, dict]:
+    """并发发送到各渠道，每个渠道单独超时，耗时取最慢的渠道而不是各渠道之和"""
+    names = list(targets)
+    limiters = limiters or {}
+    results = await asyncio.gather(*[
+        send_to_channel(name, targets[name], job, timeouts[name], limiters.get(name)) for name in names
+    ])
+    return dict(zip(names, results))
+
+
+class DeliveryQueue:
+    """以 notifications 表为队列：FOR UPDATE SKIP LOCKED 认领，租约过期的投递可被重新认领"""
+
+    def __init__(
+        self,
+        session_factory,
+        lease_seconds: int = 120,
+        max_attempts: int = 5,
+        retry_base_seconds: float = 5,
+        retry_max_seconds: float = 3600
+    ):
+        self.session_factory = session_factory
+        self.lease = timedelta(seconds=lease_seconds)
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+
+    def claim(self, limit: int, lane: str = "normal") -> List[DeliveryJob]:
+        """认领某个通道到期的通知并标记为投递中"""
+        now = datetime.utcnow()
+        with self.session_factory() as db:
+            notifications = db.query(Notification).filter(
+                Notification.priority == lane,
+                or_(
+                    and_(Notification.status.in_(QUEUED_STATUSES), Notification.next_attempt_at <= now),
+                    # 投递中但租约已过期（认领的实例已退出）
+                    and_(Notification.status == "sending", Notification.locked_until < now)
+                )
+            ).order_by(Notification.next_attempt_at).limit(limit).with_for_update(skip_locked=True).all()
+
+            jobs = []
+            for notification in notifications:
+                due_at = notification.next_attempt_at or notification.created_at
+                notification.status = "sending"
+                notification.locked_until = now + self.lease
+                notification.attempts = (notification.attempts or 0) + 1
+                jobs.append(DeliveryJob(notification, due_at))
+            db.commit()
+
+        for job in jobs:
+            QUEUE_LAG.labels(lane=lane).observe(max((now - job.due_at).total_seconds(), 0))
+        return jobs
+
+    def backoff(self, attempts: int) -> float:
+        """第 attempts 次失败后的等待秒数：指数增长、封顶并加随机抖动"""
+        delay = min(self.retry_base_seconds * (2 ** (attempts - 1)), self.retry_max_seconds)
+        return delay * random.uniform(0.5, 1.0)
+
+    def complete(self, results: List[tuple]):
+        """一次事务写回一批投递结果：(job, 成功, 错误信息, 是否永久失败, 各渠道结果)"""
+        now = datetime.utcnow()
+        outcomes = []
+        with self.session_factory() as db:
+            for job, success, error_message, permanent, channel_results in results:
+                values = {"locked_until": None, "error_message": error_message, "channel_results": channel_results}
+                if success:
+                    values.update(status="sent", sent_at=now)
+                    DELIVERY_RESULTS.labels(channel=job.channel, outcome="sent").inc()
+                elif permanent or job.attempts >= self.max_attempts:
+                    values.update(status="dead")
+                    DELIVERY_RESULTS.labels(channel=job.channel, outcome="dead").inc()
+                    DELIVERY_DEAD_LETTERED.labels(channel=job.channel).inc()
+                else:
+                    values.update(
+                        status="retry",
+                        next_attempt_at=now + timedelta(seconds=self.backoff(job.attempts))
+                    )
+                    DELIVERY_RESULTS.labels(channel=job.channel, outcome="retry").inc()
+                    DELIVERY_RETRIES.labels(channel=job.channel).inc()
+
+                updated = db.query(Notification).filter(
+                    Notification.id == job.id,
+                    # 带上分区键，只更新所在的分区
+                    Notification.created_at == job.created_at,
+                    Notification.status == "sending"
+                ).update(values, synchronize_session=False)
+                if updated and values["status"] != "retry":
+                    outcomes.append((job.channel, success))
+
+            # 日汇总与通知状态同一事务提交
+            update_stats(db, record_outcomes, outcomes, now)
+            db.commit()
+
+    def requeue(self, notification_id: int) -> bool:
+        """把死信重新放回队列，并从日汇总中撤销它之前计入的失败"""
+        with self.session_factory() as db:
+            notification = db.query(Notification).filter(
+                Notification.id == notification_id,
+                Notification.status == "dead"
+            ).with_for_update().first()
+            if notification is None:
+                return False
+
+            # 进入死信时的更新时间即计入汇总的时间
+            dead_at = notification.updated_at or datetime.utcnow()
+            notification.status = "pending"
+            notification.attempts = 0
+            notification.next_attempt_at = datetime.utcnow()
+            notification.error_message = None
+            db.flush()
+            update_stats(db, retract_outcomes, [(notification.channel, False)], dead_at)
+            db.commit()
+        return True
+
+    def measure(self) -> Dict[str, dict]:
+        """按通道刷新队列深度与最老到期通知的等待时间"""
+        now = datetime.utcnow()
+        with self.session_factory() as db:
+            rows = db.query(
+                Notification.priority,
+                func.count(Notification.id),
+                func.min(Notification.next_attempt_at)
+            ).filter(Notification.status.in_(QUEUED_STATUSES)).group_by(Notification.priority).all()
+
+        lanes = {lane: {"depth": 0, "oldest_due_seconds": 0.0} for lane in LANES}
+        for lane, depth, oldest in rows:
+            lanes[lane] = {
+                "depth": depth,
+                "oldest_due_seconds": max((now - oldest).total_seconds(), 0) if oldest else 0.0,
+            }
+        for lane, values in lanes.items():
+            QUEUE_DEPTH.labels(lane=lane).set(values["depth"])
+            QUEUE_OLDEST_DUE.labels(lane=lane).set(values["oldest_due_seconds"])
+        return lanes
+
+
+def update_stats(db: Session, update: Callable, outcomes: List[tuple], at: datetime):
+    """在保存点中更新日汇总；失败时只回滚汇总，投递结果照常提交，之后可用 rebuild 对账
+
+    汇总失败若回滚整批状态，通知会停留在投递中，租约过期后被重新认领并重复发送。
+    """
+    try:
+        with db.begin_nested():
+            update(db, outcomes, at)
+    except SQLAlchemyError as e:
+        STATS_UPDATE_ERRORS.inc()
+        print(f"更新通知日汇总失败，投递结果已保留: {e}")
+
+
+class DeliveryWorkerPool:
+    """一组异步投递协程：认领一批、并发投递、一次写回结果
+
+    每次认领前由加权轮询选出优先的通道，该通道没有到期通知时依次尝试其他通道；
+    前 critical_workers 个协程只认领紧急通知，其他协程都在发送整批批量通知时紧急通知也不用排队等协程；
+    认领后先一次批量解析整批收件人的联系方式，批量通知入队数小时后才发送时联系方式也不会已过期；
+    数据库操作是同步的，放在线程池中执行；本进程入队后可立即唤醒空闲协程。
+    """
+
+    def __init__(
+        self,
+        queue: DeliveryQueue,
+        deliver: Callable[[DeliveryJob], Awaitable[Optional[Dict[str, dict]]]],
+        workers: int = 4,
+        batch_size: int = 20,
+        poll_interval: float = 1.0,
+        scheduler: Optional[WeightedLaneScheduler] = None,
+        critical_workers: int = 0,
+        contacts: Optional[ContactResolver] = None
+    ):
+        self.queue = queue
+        self.deliver = deliver
+        self.workers = workers
+        # 至少留一个协程认领其他通道
+        self.critical_workers = min(critical_workers, max(workers - 1, 0))
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.scheduler = scheduler or WeightedLaneScheduler({lane: 1 for lane in LANES})
+        self.contacts = contacts
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.ensure_future(self._monitor()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """有新通知入队"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def lane_order(self, index: int) -> List[str]:
+        """第 index 个协程本轮尝试认领的通道顺序"""
+        if index < self.critical_workers:
+            return ["critical"]
+        return self.scheduler.next_order()
+
+    async def _worker(self, index: int):
+        loop = asyncio.get_running_loop()
+        while True:
+            jobs = []
+            try:
+                for lane in self.lane_order(index):
+                    jobs = await loop.run_in_executor(None, self.queue.claim, self.batch_size, lane)
+                    if jobs:
+                        break
+            except Exception as e:
+                print(f"投递协程 {index} 认领通知失败: {e}")
+                jobs = []
+
+            if not jobs:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+
+            if self.contacts is not None:
+                await self.contacts.prefetch(job.user_id for job in jobs)
+            results = await asyncio.gather(*[self._deliver(job) for job in jobs])
+            try:
+                await loop.run_in_executor(None, self.queue.complete, results)
+            except Exception as e:
+                # 结果未写回的通知在租约过期后会被重新认领
+                print(f"投递协程 {index} 写回结果失败: {e}")
+
+    async def _deliver(self, job: DeliveryJob) -> tuple:
+        start = time.perf_counter()
+        try:
+            channel_results = await self.deliver(job)
+            return job, True, None, False, channel_results
+        except PermanentDeliveryError as e:
+            return job, False, str(e), True, None
+        except DeliveryFailed as e:
+            return job, False, str(e), False, e.channel_results
+        except Exception as e:
+            return job, False, str(e), False, None
+        finally:
+            DELIVERY_SECONDS.labels(channel=job.channel).observe(time.perf_counter() - start)
+
+    async def _monitor(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.queue.measure)
+            except Exception as e:
+                print(f"统计通知队列失败: {e}")
+            await asyncio.sleep(max(self.poll_interval, 5))
@@ -0,0 +1,61 @@
+# 通知投递优先级通道
+
+from typing import Dict, List, Optional
+
+
+# 通道按优先级从高到低排列
+LANES = ("critical", "normal", "bulk")
+LANE_RANK = {lane: rank for rank, lane in enumerate(LANES)}
+
+# 未指定优先级时按通知类型归入通道，其余类型走 normal
+LANE_BY_TYPE = {
+    "login_otp": "critical",
+    "otp": "critical",
+    "loan_approved": "critical",
+    "loan_rejected": "critical",
+    "loan_pending": "critical",
+    "campaign": "bulk",
+}
+
+
+def lane_for(notification_type: str, priority: Optional[str] = None) -> str:
+    """通知所在的通道；显式指定的优先级必须是已知通道"""
+    if priority is not None:
+        if priority not in LANE_RANK:
+            raise ValueError(f"优先级必须是 {', '.join(LANES)} 之一")
+        return priority
+    return LANE_BY_TYPE.get(notification_type, "normal")
+
+
+def parse_weights(raw: str) -> Dict[str, int]:
+    """解析 "critical:8,normal:3,bulk:1" 形式的通道权重，未列出的通道权重为 1"""
+    weights = {lane: 1 for lane in LANES}
+    for item in filter(None, (part.strip() for part in raw.split(","))):
+        lane, _, weight = item.partition(":")
+        lane = lane.strip()
+        if lane not in LANE_RANK:
+            raise ValueError(f"未知的通道: {lane}")
+        weights[lane] = max(int(weight), 1)
+    return weights
+
+
+class WeightedLaneScheduler:
+    """平滑加权轮询：按权重比例轮流选出优先认领的通道
+
+    每轮先认领选中的通道，为空时再按权重从高到低尝试其他通道，空闲的通道不占用份额；
+    低权重通道也能按比例得到投递机会，不会被高优先级流量完全饿死。
+    """
+
+    def __init__(self, weights: Dict[str, int]):
+        self.weights = weights
+        self._current = {lane: 0 for lane in weights}
+        self._total = sum(weights.values())
+        self._fallback = sorted(weights, key=lambda lane: (-weights[lane], LANE_RANK[lane]))
+
+    def next_order(self) -> List[str]:
+        """本轮尝试认领的通道顺序"""
+        for lane, weight in self.weights.items():
+            self._current[lane] += weight
+        picked = max(self._fallback, key=lambda lane: self._current[lane])
+        self._current[picked] -= self._total
+        return [picked] + [lane for lane in self._fallback if lane != picked]
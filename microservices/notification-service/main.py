@@ -1,25 +1,44 @@
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import tuple_
 from sqlalchemy.orm import Session
 from typing import List, Optional, Dict, Any
 import sys
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 import httpx
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from jinja2 import Template
+import redis
+import redis.asyncio
+from email.message import EmailMessage
+from jinja2 import TemplateError
 import json
+import asyncio
+from fastapi.responses import Response, StreamingResponse
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.cron import CronTrigger
 
 # 添加共享模块路径
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'shared'))
 
 from shared.config.settings import settings
-from shared.utils.database import get_db_session
-from shared.utils.auth import verify_token
-from shared.models.notification import Notification, NotificationTemplate, NotificationChannel, NotificationStats
+from shared.utils.database import get_db_session, get_database_url, create_database_engine, create_session_factory
+from shared.utils.auth import verify_token, internal_headers, verify_internal_token
+from shared.models.notification import Notification, NotificationCampaign, NotificationStats
+from shared.models.notification import NotificationTemplate as NotificationTemplateModel
 from pydantic import BaseModel
+from delivery import DeliveryQueue, DeliveryWorkerPool, DeliveryJob, DeliveryFailed, PermanentDeliveryError, fan_out
+from smtp_pool import EmailTransport, SmtpProvider, parse_providers
+from templates import TemplateRegistry, TemplateNotFound, TemplateRenderError
+from campaigns import ChannelThrottle, CampaignRunner, campaign_progress
+import rollups as stats_rollups
+import partitions
+from contacts import (
+    ContactCache, ContactResolver, ContactLookupError, ContactInvalidationSubscriber, publish_invalidation
+)
+from dedup import NotificationDeduplicator, DEDUP_RESULTS, dedup_key, coalesce
+from lanes import LANES, LANE_RANK, lane_for, parse_weights, WeightedLaneScheduler
+from rate_limit import TokenBucket, make_bucket
 
 app = FastAPI(
     title="通知服务",
@@ -38,6 +57,7 @@ class NotificationRequest(BaseModel):
     channel: str = "all"  # all, email, sms, push
     template_id: Optional[str] = None
     template_data: Optional[Dict[str, Any]] = None
+    priority: Optional[str] = None  # critical, normal, bulk；不填时按通知类型决定
     timestamp: str
 
 
@@ -47,6 +67,7 @@ class NotificationResponse(BaseModel):
     message: str
     type: str
     channel: str
+    priority: str = "normal"
     status: str
     sent_at: Optional[datetime]
     created_at: datetime
@@ -62,6 +83,30 @@ class NotificationTemplate(BaseModel):
     content: str
     channel: str
     variables: List[str]
+    version: int = 1
+
+
+class CampaignRecipient(BaseModel):
+    user_id: int
+    data: Dict[str, Any] = {}
+
+
+class CampaignQuery(BaseModel):
+    source: str = "repayments_due"  # 目前支持：repayments_due（还款到期用户）
+    due_in_days: int = 1
+
+
+class CampaignRequest(BaseModel):
+    name: str
+    template_id: str
+    channel: str = "all"
+    type: str = "campaign"
+    recipients: Optional[List[CampaignRecipient]] = None
+    query: Optional[CampaignQuery] = None
+
+
+class ContactInvalidation(BaseModel):
+    user_ids: List[int]
 
 
 class NotificationHistory(BaseModel):
@@ -73,6 +118,7 @@ class NotificationHistory(BaseModel):
     status: str
     sent_at: Optional[datetime]
     error_message: Optional[str]
+    channel_results: Optional[Dict[str, Any]] = None
     created_at: datetime
 
     class Config:
@@ -87,156 +133,383 @@ def get_current_user_id(credentials: HTTPAuthorizationCredentials = Depends(secu
     return payload.get("user_id", 0)
 
 
-# 通知渠道接口
+# 通知渠道接口：发送失败直接抛出异常，由投递协程按渠道记录结果
+class ChannelError(Exception):
+    """渠道发送失败"""
+
+
 class NotificationChannel:
-    def send(self, user_id: int, message: str, **kwargs) -> bool:
+    async def send(self, user_id: int, message: str, **kwargs):
         """发送通知"""
         raise NotImplementedError
 
 
 class EmailChannel(NotificationChannel):
-    def __init__(self):
-        self.smtp_server = "smtp.gmail.com"
-        self.smtp_port = 587
-        self.username = os.getenv("EMAIL_USERNAME", "")
-        self.password = os.getenv("EMAIL_PASSWORD", "")
+    def __init__(self, transport: EmailTransport, contacts: ContactResolver):
+        self.transport = transport
+        self.contacts = contacts
+        self.sender = settings.smtp_username
     
-    def send(self, user_id: int, message: str, subject: str = "系统通知", **kwargs) -> bool:
-        """发送邮件"""
-        try:
-            # 获取用户邮箱
-            user_email = self.get_user_email(user_id)
-            if not user_email:
-                return False
-            
-            # 创建邮件
-            msg = MIMEMultipart()
-            msg['From'] = self.username
-            msg['To'] = user_email
-            msg['Subject'] = subject
-            
-            msg.attach(MIMEText(message, 'html', 'utf-8'))
-            
-            # 发送邮件
-            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-            server.starttls()
-            server.login(self.username, self.password)
-            text = msg.as_string()
-            server.sendmail(self.username, user_email, text)
-            server.quit()
-            
-            return True
-        except Exception as e:
-            print(f"邮件发送失败: {e}")
-            return False
+    async def send(self, user_id: int, message: str, subject: str = "系统通知", lane: str = "normal", **kwargs):
+        """发送邮件：使用连接池中已登录的连接，按通知所在通道的优先级取服务商令牌"""
+        # 获取用户邮箱
+        user_email = await self.get_user_email(user_id)
+        if not user_email:
+            raise ChannelError(f"用户 {user_id} 没有邮箱")
+        
+        # 创建邮件
+        msg = EmailMessage()
+        msg['From'] = self.sender
+        msg['To'] = user_email
+        msg['Subject'] = subject
+        msg.set_content(message, subtype='html')
+        
+        await self.transport.send(msg, LANE_RANK.get(lane, len(LANES)), lane)
     
-    def get_user_email(self, user_id: int) -> Optional[str]:
-        """获取用户邮箱"""
-        # 这里应该从用户服务获取用户邮箱
-        # 简化处理，返回默认邮箱
-        return f"user{user_id}@example.com"
+    async def get_user_email(self, user_id: int) -> Optional[str]:
+        """获取用户邮箱：经联系方式缓存从用户服务批量获取"""
+        try:
+            return (await self.contacts.get(user_id)).email
+        except ContactLookupError as e:
+            raise ChannelError(str(e))
 
 
 class SMSChannel(NotificationChannel):
-    def __init__(self):
+    def __init__(self, client: httpx.AsyncClient, contacts: ContactResolver):
+        self.client = client
+        self.contacts = contacts
         self.account_sid = os.getenv("TWILIO_ACCOUNT_SID", "")
         self.auth_token = os.getenv("TWILIO_AUTH_TOKEN", "")
         self.from_number = os.getenv("TWILIO_FROM_NUMBER", "")
     
-    def send(self, user_id: int, message: str, **kwargs) -> bool:
-        """发送短信"""
-        try:
-            # 获取用户手机号
-            user_phone = self.get_user_phone(user_id)
-            if not user_phone:
-                return False
-            
-            # 这里应该使用Twilio SDK发送短信
-            # 简化处理，直接返回成功
-            print(f"发送短信到 {user_phone}: {message}")
-            return True
-        except Exception as e:
-            print(f"短信发送失败: {e}")
-            return False
+    async def send(self, user_id: int, message: str, **kwargs):
+        """发送短信：调用Twilio REST接口"""
+        # 获取用户手机号
+        user_phone = await self.get_user_phone(user_id)
+        if not user_phone:
+            raise ChannelError(f"用户 {user_id} 没有手机号")
+        
+        if not self.account_sid:
+            # 未配置Twilio账号时不实际发送
+            return
+        
+        response = await self.client.post(
+            f"https://api.twilio.com/2010-04-01/Accounts/{self.account_sid}/Messages.json",
+            data={"From": self.from_number, "To": user_phone, "Body": message},
+            auth=(self.account_sid, self.auth_token)
+        )
+        if response.status_code >= 400:
+            raise ChannelError(f"Twilio返回 {response.status_code}: {response.text[:200]}")
     
-    def get_user_phone(self, user_id: int) -> Optional[str]:
-        """获取用户手机号"""
-        # 这里应该从用户服务获取用户手机号
-        # 简化处理，返回默认手机号
-        return f"+861380000{user_id:04d}"
+    async def get_user_phone(self, user_id: int) -> Optional[str]:
+        """获取用户手机号：经联系方式缓存从用户服务批量获取"""
+        try:
+            return (await self.contacts.get(user_id)).phone
+        except ContactLookupError as e:
+            raise ChannelError(str(e))
 
 
 class PushChannel(NotificationChannel):
-    def send(self, user_id: int, message: str, **kwargs) -> bool:
+    async def send(self, user_id: int, message: str, **kwargs):
         """发送推送通知"""
-        try:
-            # 这里应该使用推送服务（如Firebase、极光推送等）
-            # 简化处理，直接返回成功
-            print(f"发送推送通知到用户 {user_id}: {message}")
-            return True
-        except Exception as e:
-            print(f"推送通知发送失败: {e}")
-            return False
+        # 这里应该使用推送服务（如Firebase、极光推送等）
+        # 简化处理，直接视为成功
+        return
+
+
+def load_smtp_providers() -> List[SmtpProvider]:
+    """读取SMTP服务商配置"""
+    defaults = {
+        "hostname": settings.smtp_host,
+        "port": settings.smtp_port,
+        "username": settings.smtp_username,
+        "password": settings.smtp_password,
+        "start_tls": settings.smtp_start_tls,
+        "max_connections": settings.smtp_max_connections,
+        "timeout": settings.smtp_timeout,
+        "max_messages_per_connection": settings.smtp_max_messages_per_connection,
+        "idle_timeout": settings.smtp_idle_timeout,
+        "rate_limit": settings.notification_email_rate_limit
+    }
+    if settings.smtp_providers:
+        return parse_providers(settings.smtp_providers, defaults)
+    return [SmtpProvider(name="default", **defaults)]
+
+
+# 服务商限流令牌：默认放在 Redis 中由所有实例共享，合计不超过服务商速率；
+# 不使用 Redis 或 Redis 不可用时，各实例按 速率/notification_replicas 限速
+rate_limit_redis = (
+    redis.asyncio.Redis.from_url(settings.redis_url)
+    if settings.notification_rate_limit_backend == "redis" else None
+)
+
+
+def provider_bucket(name: str, rate: float) -> TokenBucket:
+    return make_bucket(
+        name,
+        rate,
+        rate * settings.notification_rate_limit_burst,
+        redis_client=rate_limit_redis,
+        replicas=settings.notification_replicas
+    )
+
+
+# 每个SMTP服务商各自限速，令牌桶在邮件传输内部按实际使用的服务商获取
+email_transport = EmailTransport(
+    load_smtp_providers(),
+    health_check_interval=settings.smtp_health_check_interval,
+    cooldown=settings.smtp_provider_cooldown,
+    limiter_factory=lambda provider: provider_bucket(f"email:{provider.name}", provider.rate_limit)
+)
+
+# 渠道共用的HTTP客户端
+channel_http_client = httpx.AsyncClient(timeout=settings.notification_sms_timeout)
+
+# 用户联系方式缓存
+contact_resolver = ContactResolver(
+    settings.user_service_url,
+    ContactCache(
+        max_size=settings.notification_contact_cache_size,
+        ttl=settings.notification_contact_cache_ttl
+    ),
+    headers=internal_headers(),
+    batch_size=settings.notification_contact_batch_size
+)
+# 用户服务经 Redis 广播联系方式变更，每个实例各自清除缓存
+contact_events_redis = redis.asyncio.Redis.from_url(settings.redis_url)
+contact_invalidation_subscriber = ContactInvalidationSubscriber(
+    contact_events_redis,
+    settings.notification_contact_invalidation_channel,
+    contact_resolver
+)
+
+# 通知渠道
+channels = {
+    "email": EmailChannel(email_transport, contact_resolver),
+    "sms": SMSChannel(channel_http_client, contact_resolver),
+    "push": PushChannel()
+}
+
+# 各渠道单次发送超时（秒）
+channel_timeouts = {
+    "email": settings.notification_email_timeout,
+    "sms": settings.notification_sms_timeout,
+    "push": settings.notification_push_timeout
+}
+
+# 短信与推送服务商的发送速率上限，所有通道共用，令牌优先发给高优先级通道；邮件在传输内部按服务商限速
+channel_limiters = {
+    name: provider_bucket(name, rate)
+    for name, rate in (
+        ("sms", settings.notification_sms_rate_limit),
+        ("push", settings.notification_push_rate_limit)
+    )
+}
+
+
+async def deliver_notification(job: DeliveryJob) -> Dict[str, dict]:
+    """并发发送到目标渠道并返回各渠道结果，任一渠道成功即视为成功"""
+    if job.channel == "all":
+        targets = dict(channels)
+    elif job.channel in channels:
+        targets = {job.channel: channels[job.channel]}
+    else:
+        raise PermanentDeliveryError(f"渠道 {job.channel} 不存在")
+    
+    results = await fan_out(targets, job, channel_timeouts, channel_limiters)
+    if not any(result["status"] == "sent" for result in results.values()):
+        raise DeliveryFailed(
+            "; ".join(f"渠道 {name} 发送失败: {result['error']}" for name, result in results.items()),
+            results
+        )
+    return results
+
+
+# 后台任务使用独立的连接池
+background_engine = create_database_engine(get_database_url("notification_service"))
+background_session_factory = create_session_factory(background_engine)
+
+# 投递队列与投递协程
+delivery_queue = DeliveryQueue(
+    background_session_factory,
+    lease_seconds=settings.notification_lease_seconds,
+    max_attempts=settings.notification_max_attempts,
+    retry_base_seconds=settings.notification_retry_base_seconds,
+    retry_max_seconds=settings.notification_retry_max_seconds
+)
+delivery_workers = DeliveryWorkerPool(
+    delivery_queue,
+    deliver_notification,
+    workers=settings.notification_workers,
+    batch_size=settings.notification_claim_batch,
+    poll_interval=settings.notification_poll_interval,
+    scheduler=WeightedLaneScheduler(parse_weights(settings.notification_lane_weights)),
+    critical_workers=settings.notification_critical_workers,
+    contacts=contact_resolver
+)
+
+
+# 通知表分区维护
+scheduler = BackgroundScheduler()
+
+
+def maintain_partitions() -> dict:
+    """建好后续月份的分区，归档并删除超过保留期的分区"""
+    return partitions.run_maintenance(
+        background_engine,
+        months_ahead=settings.notification_partition_months_ahead,
+        retention_months=settings.notification_retention_months,
+        archive_dir=settings.notification_archive_dir
+    )
+
+
+@scheduler.scheduled_job(CronTrigger(hour=1, minute=0))  # 每天凌晨执行
+def daily_partition_maintenance():
+    """每日分区维护"""
+    try:
+        result = maintain_partitions()
+        if result["created"] or result["archived"]:
+            print(f"通知分区维护完成: 新建 {result['created']}，归档 {result['archived']}")
+    except Exception as e:
+        print(f"通知分区维护失败: {e}")
+
+
+# 启动调度器
+scheduler.start()
+
+
+@app.on_event("startup")
+async def start_delivery_workers():
+    """确保当月分区存在，启动通知投递协程，继续上次未完成的批量通知活动"""
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, maintain_partitions)
+    except partitions.PartitionSchemaError:
+        # 表结构未升级时入队与认领都会失败，直接停止启动
+        raise
+    except Exception as e:
+        print(f"通知分区维护失败: {e}")
+    contact_invalidation_subscriber.start()
+    delivery_workers.start()
+    await campaign_runner.resume()
+
+
+@app.on_event("shutdown")
+async def stop_delivery_workers():
+    await campaign_runner.stop()
+    await delivery_workers.stop()
+    await email_transport.close()
+    await channel_http_client.aclose()
+    await contact_invalidation_subscriber.stop()
+    await contact_resolver.close()
+    await contact_events_redis.aclose()
+
+
+# 通知模板注册表
+template_registry = TemplateRegistry(check_interval=settings.notification_template_check_interval)
+
+# 批量通知活动
+channel_throttle = ChannelThrottle({
+    "email": settings.notification_email_rate_limit,
+    "sms": settings.notification_sms_rate_limit,
+    "push": settings.notification_push_rate_limit
+})
+campaign_runner = CampaignRunner(
+    background_session_factory,
+    template_registry,
+    channel_throttle,
+    settings.repayment_service_url,
+    chunk_size=settings.notification_campaign_chunk_size,
+    on_enqueued=delivery_workers.notify,
+    headers=internal_headers()
+)
+
+
+# 通知去重：Redis 共享去重窗口，Redis 不可用时退回进程内去重
+redis_client = (
+    redis.Redis.from_url(settings.redis_url, decode_responses=True)
+    if settings.notification_dedup_backend == "redis" else None
+)
+deduplicator = NotificationDeduplicator(
+    redis_client,
+    window=settings.notification_dedup_window,
+    claim_ttl=settings.notification_dedup_claim_ttl
+)
+
+# 合并成摘要发送的通知类型
+coalesce_types = set(filter(None, (t.strip() for t in settings.notification_coalesce_types.split(","))))
 
 
 # 通知管理器
 class NotificationManager:
     def __init__(self, db: Session):
         self.db = db
-        self.channels = {
-            "email": EmailChannel(),
-            "sms": SMSChannel(),
-            "push": PushChannel()
-        }
+        self.channels = channels
     
-    def send_notification(self, request: NotificationRequest) -> NotificationResponse:
-        """发送通知"""
-        # 创建通知记录
-        notification = Notification(
-            user_id=request.user_id,
-            message=request.message,
-            type=request.type,
-            channel=request.channel,
-            status="pending",
-            template_id=request.template_id,
-            template_data=request.template_data
-        )
-        
-        self.db.add(notification)
-        self.db.commit()
-        self.db.refresh(notification)
-        
-        # 发送通知
-        success = False
-        error_message = None
+    def enqueue_notification(self, request: NotificationRequest) -> NotificationResponse:
+        """通知入队，由投递协程异步发送
+
+        窗口内相同 (用户, 类型, 内容) 的重复通知直接返回已入队的通知，状态为 duplicate；
+        需要合并的类型并入等待中的摘要通知。
+        """
+        try:
+            lane = lane_for(request.type, request.priority)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
         
-        if request.channel == "all":
-            # 发送到所有渠道
-            for channel_name, channel in self.channels.items():
-                try:
-                    if channel.send(request.user_id, request.message):
-                        success = True
-                except Exception as e:
-                    error_message = f"渠道 {channel_name} 发送失败: {e}"
-                    print(error_message)
+        if request.type in coalesce_types:
+            notification = coalesce(
+                self.db,
+                request.user_id,
+                request.type,
+                request.channel,
+                request.message,
+                settings.notification_coalesce_window,
+                priority=lane
+            )
         else:
-            # 发送到指定渠道
-            if request.channel in self.channels:
-                try:
-                    success = self.channels[request.channel].send(
-                        request.user_id, 
-                        request.message
-                    )
-                except Exception as e:
-                    error_message = f"渠道 {request.channel} 发送失败: {e}"
-                    print(error_message)
+            notification = Notification(
+                user_id=request.user_id,
+                message=request.message,
+                type=request.type,
+                channel=request.channel,
+                priority=lane,
+                status="pending",
+                template_id=request.template_id,
+                template_data=request.template_data,
+                next_attempt_at=datetime.utcnow()
+            )
+            self.db.add(notification)
+            self.db.flush()
         
-        # 更新状态
-        notification.status = "sent" if success else "failed"
-        notification.sent_at = datetime.utcnow() if success else None
-        notification.error_message = error_message
+        key = dedup_key(request.user_id, request.type, request.message)
+        existing_id = deduplicator.claim(key, notification.id)
+        if existing_id is not None:
+            self.db.rollback()
+            DEDUP_RESULTS.labels(type=request.type, outcome="duplicate").inc()
+            return NotificationResponse(
+                id=existing_id,
+                user_id=request.user_id,
+                message=request.message,
+                type=request.type,
+                channel=request.channel,
+                priority=lane,
+                status="duplicate",
+                sent_at=None,
+                created_at=datetime.utcnow()
+            )
         
-        self.db.commit()
+        try:
+            self.db.commit()
+        except Exception:
+            deduplicator.release(key, notification.id)
+            raise
+        # 通知已落库，占位延长到完整去重窗口
+        deduplicator.confirm(key, notification.id)
+        self.db.refresh(notification)
         
         return NotificationResponse(
             id=notification.id,
@@ -244,63 +517,26 @@ class NotificationManager:
             message=notification.message,
             type=notification.type,
             channel=notification.channel,
+            priority=notification.priority,
             status=notification.status,
             sent_at=notification.sent_at,
             created_at=notification.created_at
         )
     
-    def get_notification_templates(self) -> List[NotificationTemplate]:
-        """获取通知模板"""
-        templates = [
-            NotificationTemplate(
-                id="loan_approved",
-                name="贷款批准通知",
-                subject="恭喜！您的贷款申请已批准",
-                content="<h2>贷款申请批准通知</h2><p>尊敬的客户，您的贷款申请已通过审批，贷款金额：{{amount}}元，请及时查看详情。</p>",
-                channel="email",
-                variables=["amount", "loan_id"]
-            ),
-            NotificationTemplate(
-                id="loan_rejected",
-                name="贷款拒绝通知",
-                subject="贷款申请结果通知",
-                content="<h2>贷款申请结果通知</h2><p>很抱歉，您的贷款申请未通过审批。原因：{{reason}}。如有疑问，请联系客服。</p>",
-                channel="email",
-                variables=["reason"]
-            ),
-            NotificationTemplate(
-                id="repayment_reminder",
-                name="还款提醒",
-                subject="还款提醒",
-                content="<h2>还款提醒</h2><p>您有一笔贷款即将到期，请及时还款。还款金额：{{amount}}元，到期日期：{{due_date}}。</p>",
-                channel="all",
-                variables=["amount", "due_date"]
-            ),
-            NotificationTemplate(
-                id="repayment_overdue",
-                name="逾期通知",
-                subject="贷款逾期通知",
-                content="<h2>贷款逾期通知</h2><p>您的贷款已逾期，请尽快还款。逾期金额：{{amount}}元，逾期天数：{{overdue_days}}天。</p>",
-                channel="all",
-                variables=["amount", "overdue_days"]
-            )
-        ]
-        
-        return templates
-    
     def render_template(self, template_id: str, data: Dict[str, Any]) -> str:
         """渲染模板"""
-        templates = self.get_notification_templates()
-        template = next((t for t in templates if t.id == template_id), None)
-        
-        if not template:
-            return f"模板 {template_id} 不存在"
-        
         try:
-            jinja_template = Template(template.content)
-            return jinja_template.render(**data)
-        except Exception as e:
-            return f"模板渲染失败: {e}"
+            return template_registry.render(self.db, template_id, data)
+        except TemplateNotFound as e:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=str(e)
+            )
+        except TemplateRenderError as e:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"模板渲染失败: {e}"
+            )
 
 
 # API路由
@@ -309,7 +545,7 @@ async def send_notification(
     request: NotificationRequest,
     db: Session = Depends(lambda: next(get_db_session("notification_service")))
 ):
-    """发送通知"""
+    """发送通知：只入队，立即返回"""
     manager = NotificationManager(db)
     
     # 如果提供了模板ID，渲染模板
@@ -320,7 +556,9 @@ async def send_notification(
         )
         request.message = rendered_message
     
-    return manager.send_notification(request)
+    response = manager.enqueue_notification(request)
+    delivery_workers.notify()
+    return response
 
 
 @app.get("/templates", response_model=List[NotificationTemplate])
@@ -328,21 +566,34 @@ async def get_templates(
     db: Session = Depends(lambda: next(get_db_session("notification_service")))
 ):
     """获取通知模板"""
-    manager = NotificationManager(db)
-    return manager.get_notification_templates()
+    return [NotificationTemplate(**entry.to_dict()) for entry in template_registry.list(db)]
 
 
 @app.get("/history/{user_id}", response_model=List[NotificationHistory])
 async def get_notification_history(
     user_id: int,
     limit: int = 50,
-    offset: int = 0,
+    before_created_at: Optional[datetime] = None,
+    before_id: Optional[int] = None,
     db: Session = Depends(lambda: next(get_db_session("notification_service")))
 ):
-    """获取用户通知历史"""
-    notifications = db.query(Notification).filter(
-        Notification.user_id == user_id
-    ).order_by(Notification.created_at.desc()).offset(offset).limit(limit).all()
+    """获取用户通知历史：按 (created_at, id) 倒序键集分页，传入上一页最后一条的 created_at 与 id 取下一页"""
+    if (before_created_at is None) != (before_id is None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="before_created_at 与 before_id 需同时提供"
+        )
+
+    query = db.query(Notification).filter(Notification.user_id == user_id)
+    if before_created_at is not None:
+        query = query.filter(
+            tuple_(Notification.created_at, Notification.id) < tuple_(before_created_at, before_id)
+        )
+
+    notifications = query.order_by(
+        Notification.created_at.desc(),
+        Notification.id.desc()
+    ).limit(limit).all()
     
     return [
         NotificationHistory(
@@ -354,6 +605,7 @@ async def get_notification_history(
             status=notification.status,
             sent_at=notification.sent_at,
             error_message=notification.error_message,
+            channel_results=notification.channel_results,
             created_at=notification.created_at
         )
         for notification in notifications
@@ -362,37 +614,47 @@ async def get_notification_history(
 
 @app.get("/stats")
 async def get_notification_stats(
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
     db: Session = Depends(lambda: next(get_db_session("notification_service")))
 ):
-    """获取通知统计"""
-    # 查询总发送数
-    total_sent = db.query(Notification).count()
-    
-    # 查询成功发送数
-    success_count = db.query(Notification).filter(Notification.status == "sent").count()
-    
-    # 计算成功率
-    success_rate = success_count / total_sent if total_sent > 0 else 0
-    
-    # 按渠道统计
-    channel_stats = {}
-    for channel in ["email", "sms", "push", "all"]:
-        sent_count = db.query(Notification).filter(Notification.channel == channel).count()
-        success_count = db.query(Notification).filter(
-            Notification.channel == channel,
-            Notification.status == "sent"
-        ).count()
-        
-        channel_stats[channel] = {
-            "sent": sent_count,
-            "success": success_count
-        }
+    """获取通知统计：从按天、按渠道的汇总读取，可按日期范围过滤"""
+    return stats_rollups.summarize(db, start_date, end_date)
+
+
+@app.post("/stats/rebuild")
+async def rebuild_notification_stats(
+    start_date: date,
+    end_date: date,
+    db: Session = Depends(lambda: next(get_db_session("notification_service")))
+):
+    """按通知表重算日期范围内的统计汇总（管理员接口，用于初始化与对账）"""
+    if end_date < start_date:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="结束日期不能早于开始日期"
+        )
     
-    return {
-        "total_sent": total_sent,
-        "success_rate": round(success_rate, 4),
-        "channel_stats": channel_stats
-    }
+    try:
+        rows = stats_rollups.rebuild(db, start_date, end_date)
+    except stats_rollups.StatsRangeError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    db.commit()
+    return {"message": "统计汇总已重算", "rows": rows}
+
+
+def validate_template_content(content: str):
+    """保存前先编译一次，语法错误直接拒绝"""
+    try:
+        template_registry.compile(content)
+    except TemplateError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"模板语法错误: {e}"
+        )
 
 
 @app.post("/template", response_model=NotificationTemplate)
@@ -401,9 +663,33 @@ async def create_template(
     db: Session = Depends(lambda: next(get_db_session("notification_service")))
 ):
     """创建通知模板"""
-    # 这里应该保存到数据库
-    # 简化处理，直接返回
-    return template
+    validate_template_content(template.content)
+    
+    existing = db.query(NotificationTemplateModel).filter(NotificationTemplateModel.id == template.id).first()
+    if existing and existing.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="模板已存在"
+        )
+    
+    if existing:
+        # 重新启用已删除的模板，版本继续递增
+        record = existing
+        record.version = (record.version or 1) + 1
+        record.is_active = True
+    else:
+        record = NotificationTemplateModel(id=template.id, version=1)
+        db.add(record)
+    
+    record.name = template.name
+    record.subject = template.subject
+    record.content = template.content
+    record.channel = template.channel
+    record.variables = template.variables
+    db.commit()
+    
+    template_registry.invalidate(db)
+    return NotificationTemplate(**template_registry.get(db, template.id).to_dict())
 
 
 @app.put("/template/{template_id}", response_model=NotificationTemplate)
@@ -413,9 +699,28 @@ async def update_template(
     db: Session = Depends(lambda: next(get_db_session("notification_service")))
 ):
     """更新通知模板"""
-    # 这里应该更新数据库
-    # 简化处理，直接返回
-    return template
+    record = db.query(NotificationTemplateModel).filter(
+        NotificationTemplateModel.id == template_id,
+        NotificationTemplateModel.is_active == True
+    ).first()
+    if not record:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="模板不存在"
+        )
+    
+    validate_template_content(template.content)
+    
+    record.name = template.name
+    record.subject = template.subject
+    record.content = template.content
+    record.channel = template.channel
+    record.variables = template.variables
+    record.version = (record.version or 1) + 1
+    db.commit()
+    
+    template_registry.invalidate(db)
+    return NotificationTemplate(**template_registry.get(db, template_id).to_dict())
 
 
 @app.delete("/template/{template_id}")
@@ -423,11 +728,232 @@ async def delete_template(
     template_id: str,
     db: Session = Depends(lambda: next(get_db_session("notification_service")))
 ):
-    """删除通知模板"""
-    # 这里应该从数据库删除
+    """删除通知模板（停用，历史通知仍引用其ID）"""
+    record = db.query(NotificationTemplateModel).filter(
+        NotificationTemplateModel.id == template_id,
+        NotificationTemplateModel.is_active == True
+    ).first()
+    if not record:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="模板不存在"
+        )
+    
+    record.is_active = False
+    record.version = (record.version or 1) + 1
+    db.commit()
+    
+    template_registry.invalidate(db)
     return {"message": f"模板 {template_id} 已删除"}
 
 
+@app.post("/campaigns")
+async def create_campaign(
+    request: CampaignRequest,
+    db: Session = Depends(lambda: next(get_db_session("notification_service")))
+):
+    """创建批量通知活动：后台分块拉取收件人、渲染并入队，立即返回（管理员接口）"""
+    if (request.recipients is None) == (request.query is None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="recipients 与 query 必须且只能提供一个"
+        )
+    
+    if request.channel != "all" and request.channel not in channels:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"渠道 {request.channel} 不存在"
+        )
+    
+    try:
+        template_registry.get(db, request.template_id)
+    except TemplateNotFound as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    
+    if request.recipients is not None:
+        source = "list"
+        source_params = {"recipients": [recipient.dict() for recipient in request.recipients]}
+    elif request.query.source == "repayments_due":
+        source = "repayments_due"
+        due_date = datetime.utcnow().date() + timedelta(days=request.query.due_in_days)
+        source_params = {"due_date": due_date.isoformat()}
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"不支持的收件人查询: {request.query.source}"
+        )
+    
+    campaign = NotificationCampaign(
+        name=request.name,
+        template_id=request.template_id,
+        channel=request.channel,
+        type=request.type,
+        source=source,
+        source_params=source_params,
+        status="running"
+    )
+    db.add(campaign)
+    db.commit()
+    db.refresh(campaign)
+    
+    campaign_runner.start(campaign.id)
+    return campaign_progress(db, campaign)
+
+
+def get_campaign_or_404(db: Session, campaign_id: int) -> NotificationCampaign:
+    campaign = db.query(NotificationCampaign).filter(NotificationCampaign.id == campaign_id).first()
+    if not campaign:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="活动不存在"
+        )
+    return campaign
+
+
+@app.get("/campaigns/{campaign_id}")
+async def get_campaign(
+    campaign_id: int,
+    db: Session = Depends(lambda: next(get_db_session("notification_service")))
+):
+    """查询批量通知活动进度"""
+    return campaign_progress(db, get_campaign_or_404(db, campaign_id))
+
+
+@app.get("/campaigns/{campaign_id}/events")
+async def stream_campaign_progress(
+    campaign_id: int,
+    interval: float = 1.0,
+    db: Session = Depends(lambda: next(get_db_session("notification_service")))
+):
+    """以 Server-Sent Events 推送活动进度，入队结束且通知全部投递完成后关闭"""
+    get_campaign_or_404(db, campaign_id)
+    interval = max(interval, 0.5)
+    
+    def read_progress() -> dict:
+        with background_session_factory() as session:
+            return campaign_progress(session, get_campaign_or_404(session, campaign_id))
+    
+    async def events():
+        loop = asyncio.get_running_loop()
+        while True:
+            progress = await loop.run_in_executor(None, read_progress)
+            yield f"data: {json.dumps(progress, ensure_ascii=False)}\n\n"
+            if progress["done"]:
+                return
+            await asyncio.sleep(interval)
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/campaigns/{campaign_id}/cancel")
+async def cancel_campaign(
+    campaign_id: int,
+    db: Session = Depends(lambda: next(get_db_session("notification_service")))
+):
+    """取消批量通知活动，尚未投递的通知不再发送（管理员接口）"""
+    get_campaign_or_404(db, campaign_id)
+    if not campaign_runner.cancel(db, campaign_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="活动已结束"
+        )
+    return {"message": "活动已取消"}
+
+
+@app.get("/dead-letters", response_model=List[NotificationHistory])
+async def get_dead_letters(
+    limit: int = 50,
+    db: Session = Depends(lambda: next(get_db_session("notification_service")))
+):
+    """获取投递失败进入死信的通知"""
+    return db.query(Notification).filter(
+        Notification.status == "dead"
+    ).order_by(Notification.updated_at.desc()).limit(min(limit, 500)).all()
+
+
+@app.post("/dead-letters/{notification_id}/retry")
+async def retry_dead_letter(notification_id: int):
+    """把死信重新放回投递队列（管理员接口）"""
+    if not await asyncio.get_running_loop().run_in_executor(None, delivery_queue.requeue, notification_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="死信不存在"
+        )
+    delivery_workers.notify()
+    return {"message": "已重新入队"}
+
+
+@app.get("/delivery/lanes")
+async def get_delivery_lanes():
+    """各优先级通道的权重与排队情况，以及各渠道服务商令牌桶状态"""
+    loop = asyncio.get_running_loop()
+    queue = await loop.run_in_executor(None, delivery_queue.measure)
+    return {
+        "lanes": {
+            lane: dict(queue[lane], weight=delivery_workers.scheduler.weights[lane])
+            for lane in LANES
+        },
+        "providers": {
+            limiter.name: limiter.stats()
+            for limiter in [*channel_limiters.values(), *email_transport.limiters.values()]
+        },
+    }
+
+
+@app.get("/email/transport")
+async def get_email_transport():
+    """查看各SMTP服务商的连接池状态"""
+    return {"providers": email_transport.stats()}
+
+
+@app.post("/contacts/invalidate", dependencies=[Depends(verify_internal_token)])
+async def invalidate_contacts(request: ContactInvalidation):
+    """清除联系方式缓存：经 Redis 广播给所有实例，Redis 不可用时只清除本实例"""
+    try:
+        receivers = await publish_invalidation(
+            contact_events_redis, settings.notification_contact_invalidation_channel, request.user_ids
+        )
+        return {"broadcast": True, "receivers": receivers}
+    except redis.RedisError as e:
+        print(f"广播联系方式失效失败，只清除本实例缓存: {e}")
+        return {"broadcast": False, "invalidated": contact_resolver.invalidate(request.user_ids)}
+
+
+@app.get("/contacts/cache")
+async def get_contact_cache_stats():
+    """联系方式缓存状态"""
+    return {**contact_resolver.stats(), "invalidation_subscribed": contact_invalidation_subscriber.subscribed}
+
+
+@app.get("/partitions")
+async def list_partitions():
+    """通知表的分区，以及已摘除待归档的分区"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partitions.describe, background_engine)
+
+
+@app.post("/partitions/maintenance")
+async def run_partition_maintenance():
+    """立即执行一次分区维护"""
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(None, maintain_partitions)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"分区维护失败: {str(e)}"
+        )
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus指标"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.get("/health")
 async def health_check():
     """健康检查"""
@@ -0,0 +1,217 @@
+# 通知表按月分区与归档
+
+import csv
+import gzip
+import io
+import json
+import os
+import re
+from datetime import date, datetime
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from shared.models.notification import Notification
+
+
+PARENT_TABLE = Notification.__tablename__
+DEFAULT_PARTITION = f"{PARENT_TABLE}_default"
+PARTITION_PATTERN = re.compile(rf"^{PARENT_TABLE}_y(\d{{4}})m(\d{{2}})$")
+
+# 归档导出的列
+ARCHIVE_COLUMNS = tuple(column.name for column in Notification.__table__.columns)
+
+# 多个实例同时维护分区时只让一个执行
+MAINTENANCE_LOCK_ID = 740251
+
+EXPORT_CHUNK_SIZE = 5000
+
+
+class PartitionSchemaError(Exception):
+    """通知表不是分区表（已有库尚未执行表结构升级）"""
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARENT_TABLE}_y{month.year:04d}m{month.month:02d}"
+
+
+def partition_month(name: str) -> Optional[date]:
+    """按命名规则解析分区对应的月份，不是按月分区时返回 None"""
+    match = PARTITION_PATTERN.match(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def is_partitioned(conn: Connection) -> bool:
+    return conn.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"), {"name": PARENT_TABLE}
+    ).scalar() == "p"
+
+
+def attached_partitions(conn: Connection) -> List[str]:
+    """当前挂在通知表下的分区"""
+    return sorted(conn.execute(text("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = :parent
+    """), {"parent": PARENT_TABLE}).scalars().all())
+
+
+def detached_partitions(conn: Connection) -> List[str]:
+    """已摘除但尚未归档删除的按月分区（上次归档中断时留下）"""
+    tables = conn.execute(text(
+        "SELECT tablename FROM pg_tables WHERE schemaname = current_schema()"
+    )).scalars().all()
+    attached = set(attached_partitions(conn))
+    return sorted(name for name in tables if partition_month(name) is not None and name not in attached)
+
+
+def ensure_partitions(conn: Connection, today: date, months_ahead: int) -> List[str]:
+    """创建默认分区以及当月和之后 months_ahead 个月的分区，返回新建的分区名
+
+    默认分区只兜底落在已建分区之外的数据；提前建好后续月份的分区，默认分区平时保持为空，
+    否则之后为同一范围建分区时需要先把默认分区里的数据移走。
+    """
+    existing = set(attached_partitions(conn))
+    created = []
+
+    if DEFAULT_PARTITION not in existing:
+        conn.execute(text(f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{PARENT_TABLE}" DEFAULT'))
+        created.append(DEFAULT_PARTITION)
+
+    for offset in range(months_ahead + 1):
+        month = add_months(month_start(today), offset)
+        name = partition_name(month)
+        if name in existing:
+            continue
+        conn.execute(text(
+            f'CREATE TABLE "{name}" PARTITION OF "{PARENT_TABLE}" '
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+        ))
+        created.append(name)
+
+    conn.commit()
+    return created
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def export_partition(conn: Connection, name: str, archive_dir: str) -> str:
+    """把一个分区导出为 gzip 压缩的 CSV，返回文件路径
+
+    服务端游标分块读取；先写临时文件，落盘并核对行数后再改名，中断不会留下不完整的归档。
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    tmp_path = path + ".tmp"
+
+    columns = ", ".join(f'"{column}"' for column in ARCHIVE_COLUMNS)
+    result = conn.execute(
+        text(f'SELECT {columns} FROM "{name}" ORDER BY id').execution_options(
+            stream_results=True,
+            yield_per=EXPORT_CHUNK_SIZE
+        )
+    )
+
+    exported = 0
+    with open(tmp_path, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as compressed:
+            writer_stream = io.TextIOWrapper(compressed, encoding="utf-8", newline="")
+            writer = csv.writer(writer_stream)
+            writer.writerow(ARCHIVE_COLUMNS)
+            for rows in result.partitions(EXPORT_CHUNK_SIZE):
+                writer.writerows([_csv_value(value) for value in row] for row in rows)
+                exported += len(rows)
+            writer_stream.flush()
+            writer_stream.detach()
+        raw.flush()
+        os.fsync(raw.fileno())
+    result.close()
+
+    expected = conn.execute(text(f'SELECT count(*) FROM "{name}"')).scalar()
+    if expected != exported:
+        os.remove(tmp_path)
+        raise RuntimeError(f"分区 {name} 导出 {exported} 行，表中有 {expected} 行")
+
+    os.replace(tmp_path, path)
+    return path
+
+
+def archive_expired(conn: Connection, today: date, retention_months: int, archive_dir: str) -> List[str]:
+    """摘除早于保留期的按月分区，导出归档后删除，返回归档文件路径
+
+    摘除后的分区不再参与查询与写入；导出或删除失败时分区保持摘除状态，下次继续处理。
+    """
+    cutoff = add_months(month_start(today), -retention_months)
+
+    for name in attached_partitions(conn):
+        month = partition_month(name)
+        if month is not None and month < cutoff:
+            conn.execute(text(f'ALTER TABLE "{PARENT_TABLE}" DETACH PARTITION "{name}"'))
+            conn.commit()
+
+    archived = []
+    for name in detached_partitions(conn):
+        if partition_month(name) >= cutoff:
+            continue
+        path = export_partition(conn, name, archive_dir)
+        conn.execute(text(f'DROP TABLE "{name}"'))
+        conn.commit()
+        archived.append(path)
+        print(f"通知分区 {name} 已归档到 {path}")
+    return archived
+
+
+def run_maintenance(
+    engine: Engine,
+    months_ahead: int = 2,
+    retention_months: int = 6,
+    archive_dir: str = "data/notification_archive",
+    today: Optional[date] = None
+) -> dict:
+    """建后续分区并归档过期分区；其他实例正在执行时直接跳过"""
+    today = today or datetime.utcnow().date()
+    with engine.connect() as conn:
+        if not is_partitioned(conn):
+            raise PartitionSchemaError(f"{PARENT_TABLE} 表不是分区表，请先执行 init_database.py 升级表结构")
+        if not conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": MAINTENANCE_LOCK_ID}).scalar():
+            conn.commit()
+            return {"skipped": True, "created": [], "archived": []}
+        conn.commit()
+
+        try:
+            created = ensure_partitions(conn, today, months_ahead)
+            archived = archive_expired(conn, today, retention_months, archive_dir)
+        finally:
+            conn.rollback()
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MAINTENANCE_LOCK_ID})
+            conn.commit()
+
+    return {"skipped": False, "created": created, "archived": archived}
+
+
+def describe(engine: Engine) -> dict:
+    with engine.connect() as conn:
+        return {
+            "attached": attached_partitions(conn),
+            "detached": detached_partitions(conn),
+        }
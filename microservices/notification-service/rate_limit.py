@@ -0,0 +1,178 @@
+# 渠道服务商发送速率限制
+
+import asyncio
+import heapq
+import itertools
+import time
+from typing import List, Tuple
+
+from prometheus_client import Histogram
+from redis.exceptions import RedisError
+
+
+RATE_LIMIT_WAIT = Histogram(
+    'notification_rate_limit_wait_seconds', 'Time spent waiting for a provider send token', ['channel', 'lane'],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30)
+)
+
+# 共享令牌桶：按 Redis 服务器时间补充令牌，取至多 ARGV[3] 个，
+# 返回 {取到的个数, 下一个令牌还需等待的毫秒数}
+_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+
+local granted = math.min(requested, math.floor(tokens))
+tokens = tokens - granted
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 60)
+
+local wait = 0
+if granted < requested then
+    wait = math.ceil((1 - tokens) / rate * 1000)
+end
+return {granted, wait}
+"""
+
+
+class TokenBucket:
+    """令牌桶：按服务商速率补充令牌，最多积攒 burst 个
+
+    令牌不足时按优先级排队，补充的令牌先发给优先级高（rank 小）的等待者，
+    同一优先级先到先得；批量通知排满时紧急通知仍能先拿到下一个令牌。
+    令牌只在本进程内计数，多实例部署时用 RedisTokenBucket。
+    """
+
+    def __init__(self, name: str, rate: float, burst: float = 1):
+        self.name = name
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._dispatcher = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def _take(self, count: int) -> Tuple[int, float]:
+        """取至多 count 个令牌，返回 (取到的个数, 下一个令牌还需等待的秒数)"""
+        self._refill()
+        granted = min(count, int(self._tokens))
+        self._tokens -= granted
+        wait = (1 - self._tokens) / self.rate if granted < count else 0.0
+        return granted, wait
+
+    def _refund(self, count: int):
+        """归还取到但已无人使用的令牌"""
+        self._tokens = min(self.burst, self._tokens + count)
+
+    async def acquire(self, rank: int = 0, lane: str = ""):
+        """取一个令牌，rank 越小越优先"""
+        start = time.perf_counter()
+        granted = 0
+        if not self._waiters:
+            granted, _ = await self._take(1)
+        if not granted:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (rank, next(self._sequence), future))
+            if self._dispatcher is None or self._dispatcher.done():
+                self._dispatcher = asyncio.ensure_future(self._dispatch())
+            await future
+        RATE_LIMIT_WAIT.labels(channel=self.name, lane=lane).observe(time.perf_counter() - start)
+
+    def _pending(self) -> int:
+        """丢弃队首已取消的等待者，返回仍在等待的个数"""
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def _dispatch(self):
+        """按优先级把补充的令牌发给等待者，已取消的等待者直接跳过"""
+        while True:
+            waiting = self._pending()
+            if not waiting:
+                return
+            granted, wait = await self._take(waiting)
+            while granted and self._waiters:
+                _, _, future = heapq.heappop(self._waiters)
+                if not future.done():
+                    future.set_result(None)
+                    granted -= 1
+            if granted:
+                self._refund(granted)
+            if wait > 0 and self._pending():
+                await asyncio.sleep(wait)
+
+    def stats(self) -> dict:
+        self._refill()
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "tokens": round(self._tokens, 2),
+            "waiting": sum(1 for _, _, future in self._waiters if not future.done()),
+        }
+
+
+class RedisTokenBucket(TokenBucket):
+    """多个实例共享的令牌桶：令牌记在 Redis 中，所有实例合计不超过服务商速率
+
+    本实例的等待者仍按优先级排队，由一个协程一次向 Redis 取多个令牌再按优先级分发。
+    Redis 出错时退回进程内令牌桶，速率按 local_share（通常是 1/实例数）折算，
+    各实例合计仍不超过服务商速率。
+    """
+
+    def __init__(self, name: str, rate: float, burst: float, redis_client, local_share: float = 1.0,
+                 prefix: str = "notification_rate_limit"):
+        super().__init__(name, rate, burst)
+        self.redis = redis_client
+        self.key = f"{prefix}:{name}"
+        self._take_script = redis_client.register_script(_TAKE_SCRIPT)
+        self.local = TokenBucket(name, rate * local_share, burst * local_share)
+        self._redis_available = True
+
+    async def _take(self, count: int) -> Tuple[int, float]:
+        try:
+            granted, wait_ms = await self._take_script(keys=[self.key], args=[self.rate, self.burst, count])
+        except RedisError as e:
+            if self._redis_available:
+                print(f"限流令牌桶 {self.name} 读写Redis失败，按本实例份额限速: {e}")
+                self._redis_available = False
+            return await self.local._take(count)
+
+        if not self._redis_available:
+            print(f"限流令牌桶 {self.name} 已恢复使用Redis")
+            self._redis_available = True
+        return int(granted), int(wait_ms) / 1000
+
+    def _refund(self, count: int):
+        # 已从共享桶取出的令牌不再归还，最多少发 count 条
+        if not self._redis_available:
+            self.local._refund(count)
+
+    def stats(self) -> dict:
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "backend": "redis" if self._redis_available else "local",
+            "local_rate": round(self.local.rate, 3),
+            "waiting": sum(1 for _, _, future in self._waiters if not future.done()),
+        }
+
+
+def make_bucket(name: str, rate: float, burst: float, redis_client=None, replicas: int = 1) -> TokenBucket:
+    """有 Redis 时建共享令牌桶，否则把速率按实例数平分给每个实例"""
+    share = 1.0 / max(replicas, 1)
+    if redis_client is not None:
+        return RedisTokenBucket(name, rate, burst, redis_client, local_share=share)
+    return TokenBucket(name, rate * share, max(burst * share, 1))
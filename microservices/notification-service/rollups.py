@@ -0,0 +1,192 @@
+# 通知发送统计日汇总
+
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from shared.models.notification import Notification, NotificationStats
+from partitions import add_months, attached_partitions, partition_month
+
+
+# 最终状态：投递成功与进入死信
+FINAL_STATUSES = ("sent", "dead")
+
+# 统计中总是列出的渠道
+STATS_CHANNELS = ("email", "sms", "push", "all")
+
+# 汇总读写锁：重算整体改写日期范围内的汇总时独占，投递累加结果时共享
+STATS_LOCK_ID = 518306
+
+
+class StatsRangeError(Exception):
+    """重算范围内的通知已随分区归档，无法从通知表重新统计"""
+
+
+def day_start(value: datetime) -> datetime:
+    """所在日期的零点，作为汇总行的 date"""
+    return datetime.combine(value.date(), time.min)
+
+
+def _merge(outcomes: Iterable[Tuple[str, bool]]) -> Dict[str, list]:
+    """按渠道合并为 {渠道: [成功数, 失败数]}"""
+    deltas: Dict[str, list] = defaultdict(lambda: [0, 0])
+    for channel, success in outcomes:
+        deltas[channel][0 if success else 1] += 1
+    return deltas
+
+
+def record_outcomes(db: Session, outcomes: Iterable[Tuple[str, bool]], at: datetime):
+    """把一批投递的最终结果（渠道, 是否成功）累加到当天各渠道的汇总行
+
+    先按渠道合并，再用一条 INSERT ... ON CONFLICT DO UPDATE 累加；
+    按渠道排序写入，多个投递协程同时更新同一天的汇总时不会互相死锁。调用方负责提交事务。
+    共享持有汇总锁直到提交，与 rebuild 互斥。
+    """
+    deltas = _merge(outcomes)
+    if not deltas:
+        return
+
+    db.execute(select(func.pg_advisory_xact_lock_shared(STATS_LOCK_ID)))
+
+    day = day_start(at)
+    now = datetime.utcnow()
+    rows = [
+        {
+            "date": day,
+            "channel": channel,
+            "total_sent": success + failure,
+            "success_count": success,
+            "failure_count": failure,
+            "created_at": now,
+            "updated_at": now,
+        }
+        for channel, (success, failure) in sorted(deltas.items())
+    ]
+
+    stmt = insert(NotificationStats).values(rows)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[NotificationStats.date, NotificationStats.channel],
+        set_={
+            "total_sent": NotificationStats.total_sent + stmt.excluded.total_sent,
+            "success_count": NotificationStats.success_count + stmt.excluded.success_count,
+            "failure_count": NotificationStats.failure_count + stmt.excluded.failure_count,
+            "updated_at": stmt.excluded.updated_at,
+        }
+    ))
+
+
+def earliest_rebuild_date(db: Session) -> Optional[date]:
+    """最早可重算的日期：最早仍挂在通知表下的按月分区的下一个月
+
+    通知按创建时间分区、按完成时间汇总，分区所在月份的前几天完成的通知可能创建于上个月；
+    上个月已归档时这些通知不在表中，重算会把汇总改小。没有按月分区时返回 None。
+    """
+    months = [partition_month(name) for name in attached_partitions(db.connection())]
+    months = [month for month in months if month is not None]
+    return add_months(min(months), 1) if months else None
+
+
+def retract_outcomes(db: Session, outcomes: Iterable[Tuple[str, bool]], at: datetime):
+    """从 at 当天的汇总行中减去已累加的最终结果（死信重新入队时），再次投递的结果之后重新累加
+
+    与 rebuild 的统计口径一致：重新入队的通知只按最后一次的最终结果计一次。调用方负责提交事务。
+    """
+    deltas = _merge(outcomes)
+    if not deltas:
+        return
+
+    db.execute(select(func.pg_advisory_xact_lock_shared(STATS_LOCK_ID)))
+
+    day = day_start(at)
+    for channel, (success, failure) in sorted(deltas.items()):
+        db.query(NotificationStats).filter(
+            NotificationStats.date == day,
+            NotificationStats.channel == channel
+        ).update({
+            "total_sent": func.greatest(NotificationStats.total_sent - (success + failure), 0),
+            "success_count": func.greatest(NotificationStats.success_count - success, 0),
+            "failure_count": func.greatest(NotificationStats.failure_count - failure, 0),
+            "updated_at": datetime.utcnow(),
+        }, synchronize_session=False)
+
+
+def rebuild(db: Session, start_date: date, end_date: date) -> int:
+    """按通知表全量重算日期范围内的汇总（首次初始化与对账用），返回写入的行数
+
+    独占汇总锁：已累加结果的投递事务提交后才开始统计，统计结果包含这些投递；
+    之后的投递等重算提交后再累加，其状态变化也不在统计中，不会漏算或重复计算。
+    范围早于 earliest_rebuild_date 时抛出 StatsRangeError，已归档月份的汇总只保留累加结果。
+    """
+    earliest = earliest_rebuild_date(db)
+    if earliest is not None and start_date < earliest:
+        raise StatsRangeError(f"{earliest.isoformat()} 之前完成的通知可能已归档，不能重算")
+
+    db.execute(select(func.pg_advisory_xact_lock(STATS_LOCK_ID)))
+    start = datetime.combine(start_date, time.min)
+    end = datetime.combine(end_date + timedelta(days=1), time.min)
+
+    # 成功按发送时间、死信按最后更新时间归到当天
+    finished_at = func.coalesce(Notification.sent_at, Notification.updated_at)
+    day = func.date_trunc("day", finished_at).label("day")
+    rows = db.query(
+        day,
+        Notification.channel,
+        func.count(Notification.id).filter(Notification.status == "sent"),
+        func.count(Notification.id).filter(Notification.status == "dead")
+    ).filter(
+        Notification.status.in_(FINAL_STATUSES),
+        finished_at >= start,
+        finished_at < end
+    ).group_by(day, Notification.channel).all()
+
+    db.query(NotificationStats).filter(
+        NotificationStats.date >= start,
+        NotificationStats.date < end
+    ).delete(synchronize_session=False)
+
+    for day_value, channel, success, failure in rows:
+        db.add(NotificationStats(
+            date=day_value,
+            channel=channel,
+            total_sent=success + failure,
+            success_count=success,
+            failure_count=failure
+        ))
+    db.flush()
+    return len(rows)
+
+
+def summarize(db: Session, start_date: Optional[date] = None, end_date: Optional[date] = None) -> dict:
+    """从日汇总读取日期范围内的发送统计，查询量只与天数和渠道数有关"""
+    query = db.query(
+        NotificationStats.channel,
+        func.sum(NotificationStats.total_sent),
+        func.sum(NotificationStats.success_count),
+        func.sum(NotificationStats.failure_count)
+    )
+    if start_date is not None:
+        query = query.filter(NotificationStats.date >= datetime.combine(start_date, time.min))
+    if end_date is not None:
+        query = query.filter(NotificationStats.date < datetime.combine(end_date + timedelta(days=1), time.min))
+
+    channel_stats = {channel: {"sent": 0, "success": 0, "failure": 0} for channel in STATS_CHANNELS}
+    for channel, sent, success, failure in query.group_by(NotificationStats.channel).all():
+        channel_stats[channel] = {
+            "sent": int(sent or 0),
+            "success": int(success or 0),
+            "failure": int(failure or 0),
+        }
+
+    total_sent = sum(stats["sent"] for stats in channel_stats.values())
+    success_count = sum(stats["success"] for stats in channel_stats.values())
+    return {
+        "start_date": start_date,
+        "end_date": end_date,
+        "total_sent": total_sent,
+        "success_rate": round(success_count / total_sent, 4) if total_sent > 0 else 0,
+        "channel_stats": channel_stats,
+    }
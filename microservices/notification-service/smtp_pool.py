@@ -0,0 +1,269 @@
+# SMTP 连接池
+
+import asyncio
+import json
+import time
+from email.message import EmailMessage
+from typing import Callable, Dict, List, Optional
+
+import aiosmtplib
+from prometheus_client import Counter, Gauge, Histogram
+
+from rate_limit import TokenBucket
+
+
+SMTP_CONNECTIONS = Gauge('notification_smtp_connections', 'Open SMTP connections', ['provider'])
+SMTP_MESSAGES = Counter('notification_smtp_messages_total', 'Messages handed to SMTP providers', ['provider', 'outcome'])
+SMTP_SEND_SECONDS = Histogram('notification_smtp_send_seconds', 'Time spent sending one message over SMTP', ['provider'])
+
+# 连接层面的错误：复用的连接可能已被服务器关闭，换新连接重试
+CONNECTION_ERRORS = (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPConnectError, aiosmtplib.SMTPTimeoutError, OSError)
+
+# 服务器拒收这封邮件：连接与服务商都正常，换服务商也无济于事
+MESSAGE_ERRORS = (
+    aiosmtplib.SMTPRecipientsRefused,
+    aiosmtplib.SMTPRecipientRefused,
+    aiosmtplib.SMTPSenderRefused,
+    aiosmtplib.SMTPDataError
+)
+
+
+class SmtpUnavailable(Exception):
+    """所有服务商都不可用"""
+
+
+class SmtpProvider:
+    """一个 SMTP 服务商的连接参数、并发上限与每秒发送上限（0 表示不限）"""
+
+    def __init__(
+        self,
+        name: str,
+        hostname: str,
+        port: int = 587,
+        username: str = "",
+        password: str = "",
+        start_tls: bool = True,
+        use_tls: bool = False,
+        max_connections: int = 5,
+        timeout: float = 10,
+        max_messages_per_connection: int = 100,
+        idle_timeout: float = 60,
+        rate_limit: float = 0
+    ):
+        self.name = name
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.start_tls = start_tls
+        self.use_tls = use_tls
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_messages_per_connection = max_messages_per_connection
+        self.idle_timeout = idle_timeout
+        self.rate_limit = rate_limit
+
+
+def parse_providers(raw: str, defaults: dict) -> List[SmtpProvider]:
+    """解析 JSON 数组形式的服务商配置，未给出的字段取 defaults"""
+    return [SmtpProvider(**{**defaults, **item}) for item in json.loads(raw)]
+
+
+class _PooledConnection:
+    __slots__ = ("client", "messages", "last_used")
+
+    def __init__(self, client: aiosmtplib.SMTP):
+        self.client = client
+        self.messages = 0
+        self.last_used = time.monotonic()
+
+
+class SmtpConnectionPool:
+    """单个服务商的已认证长连接池
+
+    同时发送的邮件数不超过 max_connections，每封邮件独占一个连接；
+    空闲连接后进先出复用，空闲超过 health_check_interval 的连接取用前先 NOOP 检查，
+    发送数达到上限、空闲过久或出错的连接关闭，需要时再重新建立（含 STARTTLS 与登录）。
+    """
+
+    def __init__(self, provider: SmtpProvider, health_check_interval: float = 30):
+        self.provider = provider
+        self.health_check_interval = health_check_interval
+        self._idle: List[_PooledConnection] = []
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._open = 0
+        self._in_use = 0
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # 在事件循环中创建，避免绑定到导入时的循环
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.provider.max_connections)
+        return self._slots
+
+    async def _connect(self) -> _PooledConnection:
+        provider = self.provider
+        client = aiosmtplib.SMTP(
+            hostname=provider.hostname,
+            port=provider.port,
+            username=provider.username or None,
+            password=provider.password or None,
+            start_tls=provider.start_tls,
+            use_tls=provider.use_tls,
+            timeout=provider.timeout
+        )
+        # 提供用户名密码时 connect 会一并完成 STARTTLS 与登录
+        await client.connect()
+        self._open += 1
+        SMTP_CONNECTIONS.labels(provider=provider.name).set(self._open)
+        return _PooledConnection(client)
+
+    def _discard(self, connection: _PooledConnection):
+        """不发 QUIT 直接断开"""
+        self._open -= 1
+        SMTP_CONNECTIONS.labels(provider=self.provider.name).set(self._open)
+        connection.client.close()
+
+    async def _close(self, connection: _PooledConnection):
+        try:
+            if connection.client.is_connected:
+                await connection.client.quit()
+        except Exception:
+            pass
+        self._discard(connection)
+
+    async def _acquire(self) -> _PooledConnection:
+        while self._idle:
+            connection = self._idle.pop()
+            idle = time.monotonic() - connection.last_used
+            if idle > self.provider.idle_timeout or not connection.client.is_connected:
+                await self._close(connection)
+                continue
+            if idle > self.health_check_interval:
+                try:
+                    await connection.client.noop()
+                except (aiosmtplib.SMTPException, OSError):
+                    await self._close(connection)
+                    continue
+            return connection
+        return await self._connect()
+
+    async def _release(self, connection: _PooledConnection, healthy: bool):
+        if healthy and connection.messages < self.provider.max_messages_per_connection:
+            connection.last_used = time.monotonic()
+            self._idle.append(connection)
+        else:
+            await self._close(connection)
+
+    async def send(self, message: EmailMessage):
+        """占用一个连接发送邮件；复用的连接已被服务器断开时换新连接重试一次"""
+        async with self._semaphore():
+            self._in_use += 1
+            try:
+                for attempt in range(2):
+                    connection = await self._acquire()
+                    reused = connection.messages > 0
+                    start = time.perf_counter()
+                    try:
+                        await connection.client.send_message(message)
+                    except MESSAGE_ERRORS:
+                        # 先 RSET 清掉事务状态，连接放回池中
+                        try:
+                            await connection.client.rset()
+                            await self._release(connection, True)
+                        except (aiosmtplib.SMTPException, OSError):
+                            await self._release(connection, False)
+                        raise
+                    except BaseException as e:
+                        # 包括调用方超时取消：连接状态未知，直接断开
+                        self._discard(connection)
+                        if reused and attempt == 0 and isinstance(e, CONNECTION_ERRORS):
+                            continue
+                        raise
+                    connection.messages += 1
+                    SMTP_SEND_SECONDS.labels(provider=self.provider.name).observe(time.perf_counter() - start)
+                    await self._release(connection, True)
+                    return
+            finally:
+                self._in_use -= 1
+
+    async def close(self):
+        while self._idle:
+            await self._close(self._idle.pop())
+
+    def stats(self) -> dict:
+        return {
+            "provider": self.provider.name,
+            "max_connections": self.provider.max_connections,
+            "open": self._open,
+            "idle": len(self._idle),
+            "in_use": self._in_use,
+        }
+
+
+class EmailTransport:
+    """按顺序使用各服务商的连接池发送邮件
+
+    连接失败的服务商暂停 cooldown 秒，期间邮件交给下一个服务商；
+    服务器拒收（收件人无效等）不换服务商，直接抛给调用方。
+    每个服务商有自己的发送速率令牌桶，发送前按优先级取令牌，换服务商时取新服务商的令牌。
+    """
+
+    def __init__(
+        self,
+        providers: List[SmtpProvider],
+        health_check_interval: float = 30,
+        cooldown: float = 30,
+        limiter_factory: Optional[Callable[[SmtpProvider], TokenBucket]] = None
+    ):
+        self.pools = [SmtpConnectionPool(provider, health_check_interval) for provider in providers]
+        self.cooldown = cooldown
+        self._down_until: Dict[str, float] = {}
+        limiter_factory = limiter_factory or (
+            lambda provider: TokenBucket(f"email:{provider.name}", provider.rate_limit, provider.rate_limit)
+        )
+        self.limiters: Dict[str, TokenBucket] = {
+            provider.name: limiter_factory(provider) for provider in providers if provider.rate_limit > 0
+        }
+
+    async def send(self, message: EmailMessage, rank: int = 0, lane: str = "") -> str:
+        """发送一封邮件，返回实际使用的服务商名称；rank 越小越先拿到发送令牌"""
+        last_error = None
+        for pool in self.pools:
+            name = pool.provider.name
+            if self._down_until.get(name, 0) > time.monotonic():
+                continue
+            limiter = self.limiters.get(name)
+            if limiter is not None:
+                await limiter.acquire(rank, lane)
+            try:
+                await pool.send(message)
+            except MESSAGE_ERRORS:
+                SMTP_MESSAGES.labels(provider=name, outcome="rejected").inc()
+                raise
+            except (aiosmtplib.SMTPException, OSError) as e:
+                SMTP_MESSAGES.labels(provider=name, outcome="unavailable").inc()
+                self._down_until[name] = time.monotonic() + self.cooldown
+                print(f"SMTP服务商 {name} 不可用，暂停 {self.cooldown} 秒: {e}")
+                last_error = e
+                continue
+            SMTP_MESSAGES.labels(provider=name, outcome="sent").inc()
+            return name
+
+        # 所有服务商都试过（或都在暂停期）才失败
+        raise SmtpUnavailable(f"没有可用的SMTP服务商: {last_error}") from last_error
+
+    async def close(self):
+        for pool in self.pools:
+            await pool.close()
+
+    def stats(self) -> List[dict]:
+        now = time.monotonic()
+        return [
+            {
+                **pool.stats(),
+                "available": self._down_until.get(pool.provider.name, 0) <= now,
+                "rate_limit": self.limiters[pool.provider.name].stats()
+                if pool.provider.name in self.limiters else None,
+            }
+            for pool in self.pools
+        ]
@@ -0,0 +1,116 @@
+# 通知模板注册表
+
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from jinja2 import Template
+from jinja2.sandbox import SandboxedEnvironment
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from shared.models.notification import NotificationTemplate
+
+
+class TemplateNotFound(Exception):
+    """模板不存在或已停用"""
+
+
+class TemplateRenderError(Exception):
+    """模板渲染失败：沙箱拒绝、变量类型不符等，均由模板内容或数据引起"""
+
+
+class TemplateEntry:
+    """一个启用模板的只读快照"""
+
+    __slots__ = ("id", "name", "subject", "content", "channel", "variables", "version")
+
+    def __init__(self, template: NotificationTemplate):
+        self.id = template.id
+        self.name = template.name
+        self.subject = template.subject or ""
+        self.content = template.content
+        self.channel = template.channel
+        self.variables = list(template.variables or [])
+        self.version = template.version or 1
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class TemplateRegistry:
+    """启用模板的内存注册表与编译缓存
+
+    模板首次使用时从数据库整体加载，之后每隔 check_interval 秒用（行数, 最大更新时间）
+    判断其他实例是否改过模板，变了才重新加载；本实例的增删改调用 invalidate 立即生效。
+    编译结果按 (模板ID, 版本) 缓存，渲染只需一次字典查找加一次 render。
+    模板在沙箱环境中渲染，不能访问对象内部属性或调用不安全的方法。
+    """
+
+    def __init__(self, check_interval: float = 5):
+        self.env = SandboxedEnvironment()
+        self.check_interval = check_interval
+        self._entries: Dict[str, TemplateEntry] = {}
+        self._compiled: Dict[Tuple[str, int], Template] = {}
+        self._marker: Optional[tuple] = None
+        self._checked_at = 0.0
+        self.loaded = False
+
+    def refresh(self, db: Session, force: bool = False):
+        """距上次检查超过 check_interval 时对比变更标记，有变化才重新加载"""
+        now = time.monotonic()
+        if self.loaded and not force and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+
+        marker = tuple(db.query(
+            func.count(NotificationTemplate.id),
+            func.max(NotificationTemplate.updated_at)
+        ).one())
+        if self.loaded and not force and marker == self._marker:
+            return
+
+        templates = db.query(NotificationTemplate).filter(NotificationTemplate.is_active == True).all()
+        self._entries = {template.id: TemplateEntry(template) for template in templates}
+        # 只保留仍是当前版本的编译结果
+        current = {(entry.id, entry.version) for entry in self._entries.values()}
+        self._compiled = {key: compiled for key, compiled in self._compiled.items() if key in current}
+        self._marker = marker
+        self.loaded = True
+
+    def invalidate(self, db: Session):
+        """本实例修改模板后立即重新加载"""
+        self.refresh(db, force=True)
+
+    def list(self, db: Session) -> List[TemplateEntry]:
+        self.refresh(db)
+        return list(self._entries.values())
+
+    def get(self, db: Session, template_id: str) -> TemplateEntry:
+        self.refresh(db)
+        entry = self._entries.get(template_id)
+        if entry is None:
+            raise TemplateNotFound(f"模板 {template_id} 不存在")
+        return entry
+
+    def compile(self, content: str) -> Template:
+        """编译模板内容，语法错误时抛出 jinja2.TemplateSyntaxError"""
+        return self.env.from_string(content)
+
+    def render(self, db: Session, template_id: str, data: Dict[str, Any]) -> str:
+        """用缓存的编译结果渲染模板；模板不存在抛 TemplateNotFound，其余失败抛 TemplateRenderError"""
+        entry = self.get(db, template_id)
+        key = (entry.id, entry.version)
+        compiled = self._compiled.get(key)
+        try:
+            if compiled is None:
+                compiled = self._compiled[key] = self.compile(entry.content)
+            return compiled.render(**data)
+        except Exception as e:
+            raise TemplateRenderError(str(e)) from e
+
+    def stats(self) -> dict:
+        return {
+            "templates": len(self._entries),
+            "compiled": len(self._compiled),
+            "loaded": self.loaded,
+        }
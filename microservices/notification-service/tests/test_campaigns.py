@@ -0,0 +1,141 @@
+import asyncio
+
+from campaigns import CampaignRunner, ChannelThrottle
+from shared.models.notification import Notification, NotificationCampaign
+from templates import TemplateRenderError
+
+
+class StubTemplates:
+    """按模板数据拼出消息，name 为 None 时渲染失败"""
+
+    def render(self, db, template_id, data):
+        if data.get("name") is None:
+            raise TemplateRenderError("缺少 name")
+        return f"{template_id}:{data['name']}"
+
+
+def create_campaign(session_factory, size: int) -> int:
+    with session_factory() as db:
+        campaign = NotificationCampaign(
+            name="还款提醒",
+            template_id="repayment_reminder",
+            channel="email",
+            type="campaign",
+            source="list",
+            source_params={"recipients": [
+                {"user_id": user_id, "data": {"name": f"user{user_id}"}} for user_id in range(1, size + 1)
+            ]},
+            status="running",
+            resume_after=0
+        )
+        db.add(campaign)
+        db.commit()
+        return campaign.id
+
+
+def make_runner(session_factory) -> CampaignRunner:
+    return CampaignRunner(
+        session_factory,
+        StubTemplates(),
+        ChannelThrottle({"email": 1000}),
+        repayment_service_url="http://repayment-service",
+        chunk_size=2
+    )
+
+
+def stop_all(*runners):
+    async def stop():
+        for runner in runners:
+            await runner.stop()
+
+    asyncio.run(stop())
+
+
+def enqueued_user_ids(session_factory):
+    with session_factory() as db:
+        return sorted(row.user_id for row in db.query(Notification.user_id).all())
+
+
+def load_campaign(session_factory, campaign_id: int) -> NotificationCampaign:
+    with session_factory() as db:
+        campaign = db.get(NotificationCampaign, campaign_id)
+        db.expunge(campaign)
+        return campaign
+
+
+def test_resume_continues_from_cursor(session_factory):
+    campaign_id = create_campaign(session_factory, 5)
+    first = make_runner(session_factory)
+
+    # 第一个实例入队一块后停机
+    campaign = first._load(campaign_id)
+    recipients = campaign["source_params"]["recipients"][:2]
+    assert first._enqueue_chunk(campaign, recipients, 0, 2)
+
+    async def restart():
+        runner = make_runner(session_factory)
+        await runner.resume()
+        await asyncio.gather(*runner._tasks.values())
+        await runner.stop()
+        await first.stop()
+
+    asyncio.run(restart())
+
+    assert enqueued_user_ids(session_factory) == [1, 2, 3, 4, 5]
+    campaign = load_campaign(session_factory, campaign_id)
+    assert (campaign.status, campaign.resume_after, campaign.enqueued, campaign.total_recipients) == (
+        "completed", 5, 5, 5
+    )
+
+
+def test_stale_cursor_does_not_enqueue_chunk_twice(session_factory):
+    campaign_id = create_campaign(session_factory, 4)
+    first, second = make_runner(session_factory), make_runner(session_factory)
+
+    # 两个实例都从游标 0 继续，先提交的实例推进游标
+    campaign = first._load(campaign_id)
+    stale = second._load(campaign_id)
+    recipients = campaign["source_params"]["recipients"][:2]
+    assert first._enqueue_chunk(campaign, recipients, 0, 2)
+    assert not second._enqueue_chunk(stale, recipients, 0, 2)
+
+    stop_all(first, second)
+
+    assert enqueued_user_ids(session_factory) == [1, 2]
+    assert load_campaign(session_factory, campaign_id).enqueued == 2
+
+
+def test_replicas_resuming_together_enqueue_each_recipient_once(session_factory):
+    campaign_id = create_campaign(session_factory, 7)
+
+    async def resume_everywhere():
+        runners = [make_runner(session_factory) for _ in range(3)]
+        for runner in runners:
+            await runner.resume()
+        await asyncio.gather(*(task for runner in runners for task in list(runner._tasks.values())))
+        for runner in runners:
+            await runner.stop()
+
+    asyncio.run(resume_everywhere())
+
+    assert enqueued_user_ids(session_factory) == [1, 2, 3, 4, 5, 6, 7]
+    campaign = load_campaign(session_factory, campaign_id)
+    assert (campaign.status, campaign.enqueued) == ("completed", 7)
+
+
+def test_render_failures_are_counted_and_skipped(session_factory):
+    campaign_id = create_campaign(session_factory, 3)
+    runner = make_runner(session_factory)
+    campaign = runner._load(campaign_id)
+    recipients = [{"user_id": 1, "data": {"name": "a"}}, {"user_id": 2, "data": {}}]
+
+    assert runner._enqueue_chunk(campaign, recipients, 0, 2)
+    stop_all(runner)
+
+    with session_factory() as db:
+        notification = db.query(Notification).one()
+        assert (notification.user_id, notification.message, notification.priority) == (
+            1, "repayment_reminder:a", "bulk"
+        )
+    campaign = load_campaign(session_factory, campaign_id)
+    assert (campaign.enqueued, campaign.render_failed, campaign.resume_after) == (1, 1, 2)
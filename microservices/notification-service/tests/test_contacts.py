@@ -0,0 +1,114 @@
+import asyncio
+
+import fakeredis
+
+from contacts import Contact, ContactCache, ContactInvalidationSubscriber, ContactResolver, publish_invalidation
+from delivery import DeliveryWorkerPool
+
+
+CHANNEL = "test_contacts:invalidate"
+
+
+class RecordingResolver:
+    """记录 prefetch 调用的联系方式解析器"""
+
+    def __init__(self, log):
+        self.log = log
+
+    async def prefetch(self, user_ids):
+        self.log.append(("prefetch", sorted(user_ids)))
+
+
+class StubQueue:
+    """第一次认领返回一批通知，之后为空"""
+
+    def __init__(self, jobs):
+        self.batches = [jobs]
+        self.completed = []
+
+    def claim(self, limit, lane="normal"):
+        return self.batches.pop() if self.batches else []
+
+    def complete(self, results):
+        self.completed.extend(results)
+
+
+class Job:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.channel = "email"
+
+
+async def wait_until(predicate, timeout: float = 2):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+def cached_resolver(*user_ids) -> ContactResolver:
+    cache = ContactCache()
+    cache.put_many(Contact(user_id, f"user{user_id}@example.com") for user_id in user_ids)
+    return ContactResolver("http://user-service", cache)
+
+
+def test_invalidation_reaches_every_replica():
+    server = fakeredis.FakeServer()
+    replicas = [cached_resolver(1, 2), cached_resolver(1, 2)]
+
+    async def scenario():
+        subscribers = [
+            ContactInvalidationSubscriber(fakeredis.FakeAsyncRedis(server=server), CHANNEL, resolver)
+            for resolver in replicas
+        ]
+        # 订阅成功时清空缓存，之后重新填充
+        for subscriber in subscribers:
+            subscriber.start()
+        await wait_until(lambda: all(subscriber.subscribed for subscriber in subscribers))
+        for resolver in replicas:
+            resolver.cache.put_many([Contact(1, "old@example.com"), Contact(2, "keep@example.com")])
+
+        receivers = await publish_invalidation(fakeredis.FakeAsyncRedis(server=server), CHANNEL, [1])
+        await wait_until(lambda: all(resolver.cache.get(1) is None for resolver in replicas))
+        for subscriber in subscribers:
+            await subscriber.stop()
+        for resolver in replicas:
+            await resolver.close()
+        return receivers
+
+    assert asyncio.run(scenario()) == 2
+    assert all(resolver.cache.get(2).email == "keep@example.com" for resolver in replicas)
+
+
+def test_subscribing_clears_entries_cached_while_disconnected():
+    server = fakeredis.FakeServer()
+    resolver = cached_resolver(1)
+
+    async def scenario():
+        subscriber = ContactInvalidationSubscriber(fakeredis.FakeAsyncRedis(server=server), CHANNEL, resolver)
+        subscriber.start()
+        await wait_until(lambda: subscriber.subscribed)
+        await subscriber.stop()
+        await resolver.close()
+
+    asyncio.run(scenario())
+    assert len(resolver.cache) == 0
+
+
+def test_workers_resolve_contacts_for_each_claimed_batch():
+    log = []
+    queue = StubQueue([Job(3), Job(1), Job(2)])
+
+    async def deliver(job):
+        log.append(("deliver", job.user_id))
+        return {}
+
+    async def scenario():
+        pool = DeliveryWorkerPool(queue, deliver, workers=1, poll_interval=0.01, contacts=RecordingResolver(log))
+        pool.start()
+        await wait_until(lambda: len(queue.completed) == 3)
+        await pool.stop()
+
+    asyncio.run(scenario())
+    assert log[0] == ("prefetch", [1, 2, 3])
+    assert sorted(log[1:]) == [("deliver", 1), ("deliver", 2), ("deliver", 3)]
@@ -0,0 +1,104 @@
+import fakeredis
+import pytest
+
+import dedup
+from dedup import NotificationDeduplicator, dedup_key, digest_message
+
+
+class Clock:
+    """可手动推进的 time.monotonic"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(dedup.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def test_key_covers_user_type_and_content():
+    key = dedup_key(1, "repayment_reminder", "明天到期")
+    assert key == dedup_key(1, "repayment_reminder", "明天到期")
+    assert key != dedup_key(2, "repayment_reminder", "明天到期")
+    assert key != dedup_key(1, "repayment_overdue", "明天到期")
+    assert key != dedup_key(1, "repayment_reminder", "今天到期")
+
+
+def test_redis_claim_is_provisional_until_confirmed(redis_client):
+    deduplicator = NotificationDeduplicator(redis_client, window=600, claim_ttl=30)
+
+    assert deduplicator.claim("k", 1) is None
+    assert deduplicator.claim("k", 2) == 1
+    assert 0 < redis_client.ttl("k") <= 30
+
+    deduplicator.confirm("k", 1)
+    assert redis_client.ttl("k") > 30
+
+
+def test_redis_confirm_and_release_only_touch_own_claim(redis_client):
+    deduplicator = NotificationDeduplicator(redis_client, window=600, claim_ttl=30)
+    deduplicator.claim("k", 1)
+
+    deduplicator.confirm("k", 2)
+    assert redis_client.ttl("k") <= 30
+    deduplicator.release("k", 2)
+    assert redis_client.get("k") == "1"
+
+    deduplicator.release("k", 1)
+    assert deduplicator.claim("k", 3) is None
+
+
+def test_local_claim_expires_when_not_confirmed(clock):
+    deduplicator = NotificationDeduplicator(window=600, claim_ttl=30)
+
+    assert deduplicator.claim("crashed", 1) is None
+    assert deduplicator.claim("committed", 2) is None
+    deduplicator.confirm("committed", 2)
+
+    # 占位过期后重试的请求可以重新入队，已确认的仍在窗口内
+    clock.now += 31
+    assert deduplicator.claim("crashed", 3) is None
+    assert deduplicator.claim("committed", 4) == 2
+
+    clock.now += 600
+    assert deduplicator.claim("committed", 5) is None
+
+
+def test_local_store_is_bounded(clock):
+    deduplicator = NotificationDeduplicator(window=600)
+    deduplicator.local_store.max_size = 3
+
+    for notification_id in range(10):
+        deduplicator.claim(f"k{notification_id}", notification_id)
+
+    assert len(deduplicator.local_store._entries) <= 3
+    assert deduplicator.claim("k9", 100) == 9
+
+
+def test_falls_back_to_local_store_when_redis_fails(clock):
+    server = fakeredis.FakeServer()
+    server.connected = False
+    deduplicator = NotificationDeduplicator(fakeredis.FakeRedis(server=server), window=600, claim_ttl=30)
+
+    assert deduplicator.claim("k", 1) is None
+    assert deduplicator.claim("k", 2) == 1
+    deduplicator.confirm("k", 1)
+
+    clock.now += 31
+    assert deduplicator.claim("k", 3) == 1
+
+
+def test_digest_message():
+    assert digest_message(["a"]) == "a"
+    assert digest_message(["a", "b"]) == "您有 2 条新通知：\n1. a\n2. b"
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+from prometheus_client import REGISTRY
+
+import delivery
+from delivery import DeliveryQueue, DeliveryWorkerPool
+from lanes import WeightedLaneScheduler
+from shared.models.notification import Notification
+
+
+def add_notification(session_factory, status: str = "pending") -> int:
+    with session_factory() as db:
+        notification = Notification(
+            user_id=1,
+            message="hello",
+            type="general",
+            channel="email",
+            priority="normal",
+            status=status,
+            next_attempt_at=datetime.utcnow() - timedelta(seconds=1)
+        )
+        db.add(notification)
+        db.commit()
+        return notification.id
+
+
+def load(session_factory, notification_id: int) -> Notification:
+    with session_factory() as db:
+        return db.query(Notification).filter(Notification.id == notification_id).one()
+
+
+def stats_errors() -> float:
+    return REGISTRY.get_sample_value("notification_stats_update_errors_total") or 0
+
+
+def test_reserved_workers_only_claim_critical_lane():
+    pool = DeliveryWorkerPool(
+        None, None, workers=3,
+        scheduler=WeightedLaneScheduler({"critical": 1, "normal": 1, "bulk": 8}),
+        critical_workers=1
+    )
+
+    assert all(pool.lane_order(0) == ["critical"] for _ in range(10))
+    assert any(pool.lane_order(1)[0] == "bulk" for _ in range(10))
+
+
+def test_at_least_one_worker_claims_every_lane():
+    pool = DeliveryWorkerPool(None, None, workers=2, critical_workers=5)
+
+    assert pool.critical_workers == 1
+    assert set(pool.lane_order(1)) == {"critical", "normal", "bulk"}
+
+
+def test_stats_failure_does_not_undo_delivery_result(session_factory):
+    queue = DeliveryQueue(session_factory)
+    notification_id = add_notification(session_factory)
+    errors = stats_errors()
+
+    [job] = queue.claim(10)
+    # SQLite 没有 advisory 锁，日汇总更新失败
+    queue.complete([(job, True, None, False, {"email": {"status": "sent"}})])
+
+    notification = load(session_factory, notification_id)
+    assert notification.status == "sent"
+    assert notification.locked_until is None
+    assert stats_errors() == errors + 1
+
+
+def test_requeue_retracts_dead_outcome(session_factory, monkeypatch):
+    retracted = []
+    monkeypatch.setattr(delivery, "retract_outcomes", lambda db, outcomes, at: retracted.append((outcomes, at)))
+    queue = DeliveryQueue(session_factory)
+    dead_id = add_notification(session_factory, status="dead")
+    sent_id = add_notification(session_factory, status="sent")
+    dead_at = load(session_factory, dead_id).updated_at
+
+    assert queue.requeue(dead_id)
+    assert not queue.requeue(sent_id)
+
+    notification = load(session_factory, dead_id)
+    assert (notification.status, notification.attempts) == ("pending", 0)
+    assert retracted == [([("email", False)], dead_at)]
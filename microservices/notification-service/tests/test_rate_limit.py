@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+import fakeredis
+
+from rate_limit import RedisTokenBucket, TokenBucket, make_bucket
+
+
+async def drain(bucket: TokenBucket):
+    """取走桶里攒下的令牌"""
+    for _ in range(int(bucket.burst)):
+        await bucket.acquire()
+
+
+def test_refilled_tokens_go_to_higher_priority_waiters_first():
+    bucket = TokenBucket("priority", rate=20, burst=1)
+    order = []
+
+    async def waiter(name: str, rank: int):
+        await bucket.acquire(rank)
+        order.append(name)
+
+    async def scenario():
+        await drain(bucket)
+        bulk = [asyncio.ensure_future(waiter(f"bulk-{index}", 2)) for index in range(3)]
+        await asyncio.sleep(0)
+        critical = asyncio.ensure_future(waiter("critical", 0))
+        await asyncio.gather(critical, *bulk)
+
+    asyncio.run(scenario())
+    assert order == ["critical", "bulk-0", "bulk-1", "bulk-2"]
+
+
+def test_acquire_is_limited_to_rate():
+    bucket = TokenBucket("timing", rate=50, burst=1)
+
+    async def scenario():
+        start = time.monotonic()
+        await asyncio.gather(*(bucket.acquire() for _ in range(11)))
+        return time.monotonic() - start
+
+    # 首个令牌立即可用，其余 10 个按每秒 50 个补充
+    assert asyncio.run(scenario()) >= 0.18
+
+
+def test_cancelled_waiter_does_not_consume_token():
+    bucket = TokenBucket("cancel", rate=10, burst=1)
+
+    async def scenario():
+        await drain(bucket)
+        cancelled = asyncio.ensure_future(bucket.acquire(0))
+        waiting = asyncio.ensure_future(bucket.acquire(1))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        # 下一个令牌约 0.1 秒后补充，应发给仍在等待的协程
+        await asyncio.wait_for(waiting, 0.5)
+        return bucket.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["waiting"] == 0
+
+
+def test_redis_buckets_share_rate_across_instances():
+    client = fakeredis.FakeAsyncRedis()
+    first = RedisTokenBucket("shared", 20, 1, client, local_share=0.5, prefix="test_rate_limit")
+    second = RedisTokenBucket("shared", 20, 1, client, local_share=0.5, prefix="test_rate_limit")
+
+    async def scenario():
+        start = time.monotonic()
+        await asyncio.gather(*(bucket.acquire() for bucket in (first, second) for _ in range(5)))
+        return time.monotonic() - start
+
+    # 两个实例合计 10 个令牌，按共享的每秒 20 个补充
+    assert asyncio.run(scenario()) >= 0.4
+    assert first.stats()["backend"] == "redis"
+
+
+def test_redis_bucket_falls_back_to_local_share():
+    server = fakeredis.FakeServer()
+    server.connected = False
+    bucket = RedisTokenBucket("fallback", 20, 1, fakeredis.FakeAsyncRedis(server=server), local_share=0.5)
+
+    async def scenario():
+        start = time.monotonic()
+        await asyncio.gather(*(bucket.acquire() for _ in range(3)))
+        return time.monotonic() - start
+
+    # 本实例份额为每秒 10 个
+    assert asyncio.run(scenario()) >= 0.18
+    assert bucket.stats()["backend"] == "local"
+
+
+def test_make_bucket_splits_rate_between_replicas():
+    local = make_bucket("split", 40, 40, replicas=4)
+    assert type(local) is TokenBucket
+    assert (local.rate, local.burst) == (10, 10)
+
+    shared = make_bucket("split", 40, 40, redis_client=fakeredis.FakeAsyncRedis(), replicas=4)
+    assert isinstance(shared, RedisTokenBucket)
+    assert (shared.rate, shared.local.rate) == (40, 10)
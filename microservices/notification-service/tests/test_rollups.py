@@ -0,0 +1,36 @@
+from datetime import date
+
+import pytest
+
+import rollups
+
+
+class FakeSession:
+    def connection(self):
+        return None
+
+
+def attached(*names):
+    return lambda conn: list(names)
+
+
+def test_earliest_rebuild_date_skips_oldest_partition_month(monkeypatch):
+    monkeypatch.setattr(rollups, "attached_partitions", attached(
+        "notifications_default", "notifications_y2026m03", "notifications_y2025m12"
+    ))
+
+    assert rollups.earliest_rebuild_date(FakeSession()) == date(2026, 1, 1)
+
+
+def test_earliest_rebuild_date_without_monthly_partitions(monkeypatch):
+    monkeypatch.setattr(rollups, "attached_partitions", attached("notifications_default"))
+
+    assert rollups.earliest_rebuild_date(FakeSession()) is None
+
+
+def test_rebuild_rejects_archived_range(monkeypatch):
+    monkeypatch.setattr(rollups, "attached_partitions", attached("notifications_y2026m04"))
+
+    # 在改动汇总之前拒绝，FakeSession 没有 execute
+    with pytest.raises(rollups.StatsRangeError):
+        rollups.rebuild(FakeSession(), date(2026, 4, 20), date(2026, 5, 3))
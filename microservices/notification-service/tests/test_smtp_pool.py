@@ -0,0 +1,159 @@
+import asyncio
+import socket
+import time
+from email.message import EmailMessage
+
+import aiosmtplib
+import pytest
+from aiosmtpd.controller import Controller
+from prometheus_client import REGISTRY
+
+from rate_limit import TokenBucket
+from smtp_pool import EmailTransport, SmtpProvider, SmtpUnavailable
+
+
+class RecordingHandler:
+    """记录收到的邮件；reject 中的收件人返回 550"""
+
+    def __init__(self, reject=()):
+        self.reject = set(reject)
+        self.messages = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.reject:
+            return "550 mailbox unavailable"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope.rcpt_tos)
+        return "250 Message accepted"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    controllers = []
+
+    def start(reject=()):
+        handler = RecordingHandler(reject)
+        controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+        controller.start()
+        controllers.append(controller)
+        return handler, controller.port
+
+    yield start
+    for controller in controllers:
+        controller.stop()
+
+
+def provider(name: str, port: int, rate_limit: float = 0) -> SmtpProvider:
+    return SmtpProvider(name, "127.0.0.1", port, start_tls=False, timeout=2, rate_limit=rate_limit)
+
+
+def message(to: str = "user@example.com") -> EmailMessage:
+    msg = EmailMessage()
+    msg["From"] = "noreply@example.com"
+    msg["To"] = to
+    msg["Subject"] = "测试"
+    msg.set_content("hello")
+    return msg
+
+
+def sent_count(name: str, outcome: str) -> float:
+    return REGISTRY.get_sample_value(
+        "notification_smtp_messages_total", {"provider": name, "outcome": outcome}
+    ) or 0
+
+
+def test_fails_over_to_next_provider_and_skips_it_during_cooldown(smtp_server):
+    handler, port = smtp_server()
+    transport = EmailTransport([provider("failover-down", free_port()), provider("failover-up", port)])
+
+    async def scenario():
+        used = [await transport.send(message()) for _ in range(3)]
+        stats = transport.stats()
+        await transport.close()
+        return used, stats
+
+    used, stats = asyncio.run(scenario())
+
+    assert used == ["failover-up"] * 3
+    assert len(handler.messages) == 3
+    # 不可用的服务商只尝试一次，也不计入发送成功
+    assert sent_count("failover-down", "unavailable") == 1
+    assert sent_count("failover-down", "sent") == 0
+    assert [item["available"] for item in stats] == [False, True]
+    # 三封邮件复用同一个连接
+    assert stats[1]["open"] == 1
+
+
+def test_raises_when_every_provider_is_down():
+    transport = EmailTransport([provider("all-down-1", free_port()), provider("all-down-2", free_port())])
+
+    async def scenario():
+        with pytest.raises(SmtpUnavailable) as error:
+            await transport.send(message())
+        # 暂停期内不再连接，直接失败
+        with pytest.raises(SmtpUnavailable):
+            await transport.send(message())
+        return error.value
+
+    error = asyncio.run(scenario())
+
+    assert isinstance(error.__cause__, OSError)
+    assert sent_count("all-down-1", "sent") == 0
+    assert sent_count("all-down-2", "sent") == 0
+    assert sent_count("all-down-2", "unavailable") == 1
+
+
+def test_rejected_recipient_is_not_retried_on_another_provider(smtp_server):
+    first, first_port = smtp_server(reject=["bad@example.com"])
+    second, second_port = smtp_server()
+    transport = EmailTransport([provider("reject-1", first_port), provider("reject-2", second_port)])
+
+    async def scenario():
+        with pytest.raises(aiosmtplib.SMTPRecipientsRefused):
+            await transport.send(message("bad@example.com"))
+        # 拒收后连接放回池中，服务商仍可用
+        used = await transport.send(message())
+        stats = transport.stats()
+        await transport.close()
+        return used, stats
+
+    used, stats = asyncio.run(scenario())
+
+    assert used == "reject-1"
+    assert second.messages == []
+    assert [item["available"] for item in stats] == [True, True]
+    assert stats[0]["open"] == 1
+
+
+def test_each_provider_is_rate_limited_separately(smtp_server):
+    handler, port = smtp_server()
+    transport = EmailTransport(
+        [provider("limited-down", free_port(), rate_limit=1), provider("limited-up", port, rate_limit=20)],
+        limiter_factory=lambda item: TokenBucket(f"email:{item.name}", item.rate_limit)
+    )
+
+    async def scenario():
+        start = time.monotonic()
+        used = [await transport.send(message(), 2, "bulk") for _ in range(5)]
+        elapsed = time.monotonic() - start
+        stats = transport.stats()
+        await transport.close()
+        return used, elapsed, stats
+
+    used, elapsed, stats = asyncio.run(scenario())
+
+    # 不可用的服务商只取了一个令牌，之后暂停期内不再占用它的速率
+    assert used == ["limited-up"] * 5
+    assert len(handler.messages) == 5
+    assert elapsed >= 0.18
+    assert stats[0]["rate_limit"]["rate"] == 1
+    assert stats[1]["rate_limit"]["rate"] == 20
@@ -0,0 +1,118 @@
+import pytest
+
+import templates
+from shared.models.notification import NotificationTemplate
+from templates import TemplateNotFound, TemplateRegistry, TemplateRenderError
+
+
+def save_template(session_factory, template_id: str, content: str, is_active: bool = True):
+    """按管理接口的方式新建或修改模板：每次修改版本加一"""
+    with session_factory() as db:
+        record = db.get(NotificationTemplate, template_id)
+        if record is None:
+            record = NotificationTemplate(id=template_id, name=template_id, channel="all", version=1)
+            db.add(record)
+        else:
+            record.version += 1
+        record.content = content
+        record.is_active = is_active
+        db.commit()
+
+
+class CountingRegistry(TemplateRegistry):
+    """记录编译次数"""
+
+    def __init__(self, check_interval: float = 60):
+        super().__init__(check_interval)
+        self.compiled = []
+
+    def compile(self, content):
+        self.compiled.append(content)
+        return super().compile(content)
+
+
+def render(session_factory, registry: TemplateRegistry, template_id: str, **data) -> str:
+    with session_factory() as db:
+        return registry.render(db, template_id, data)
+
+
+def test_compiled_template_is_cached_per_version(session_factory):
+    save_template(session_factory, "welcome", "你好 {{ name }}")
+    registry = CountingRegistry()
+
+    assert render(session_factory, registry, "welcome", name="甲") == "你好 甲"
+    assert render(session_factory, registry, "welcome", name="乙") == "你好 乙"
+    assert registry.compiled == ["你好 {{ name }}"]
+
+    save_template(session_factory, "welcome", "欢迎 {{ name }}")
+    with session_factory() as db:
+        registry.invalidate(db)
+
+    assert render(session_factory, registry, "welcome", name="甲") == "欢迎 甲"
+    assert registry.compiled == ["你好 {{ name }}", "欢迎 {{ name }}"]
+    # 旧版本的编译结果已丢弃
+    assert registry.stats() == {"templates": 1, "compiled": 1, "loaded": True}
+
+
+def test_changes_from_other_instances_are_seen_after_check_interval(session_factory, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(templates.time, "monotonic", lambda: clock[0])
+    save_template(session_factory, "welcome", "你好 {{ name }}")
+    registry = TemplateRegistry(check_interval=5)
+    assert render(session_factory, registry, "welcome", name="甲") == "你好 甲"
+
+    # 另一个实例修改模板，没有调用本实例的 invalidate
+    save_template(session_factory, "welcome", "欢迎 {{ name }}")
+    clock[0] += 1
+    assert render(session_factory, registry, "welcome", name="甲") == "你好 甲"
+
+    clock[0] += 5
+    assert render(session_factory, registry, "welcome", name="甲") == "欢迎 甲"
+
+
+def test_invalidate_applies_create_update_and_delete_immediately(session_factory):
+    registry = TemplateRegistry(check_interval=3600)
+    with session_factory() as db:
+        assert registry.list(db) == []
+
+    save_template(session_factory, "reminder", "请于 {{ due_date }} 前还款")
+    with session_factory() as db:
+        registry.invalidate(db)
+        assert registry.get(db, "reminder").version == 1
+
+    save_template(session_factory, "reminder", "请在 {{ due_date }} 前还款")
+    with session_factory() as db:
+        registry.invalidate(db)
+        assert registry.get(db, "reminder").version == 2
+    assert render(session_factory, registry, "reminder", due_date="5月1日") == "请在 5月1日 前还款"
+
+    save_template(session_factory, "reminder", "请在 {{ due_date }} 前还款", is_active=False)
+    with session_factory() as db:
+        registry.invalidate(db)
+        with pytest.raises(TemplateNotFound):
+            registry.get(db, "reminder")
+    assert registry.stats()["compiled"] == 0
+
+
+def test_sandbox_rejects_unsafe_attribute_access(session_factory):
+    save_template(session_factory, "escape", "{{ name.__class__.__mro__ }}")
+    registry = TemplateRegistry()
+
+    with pytest.raises(TemplateRenderError):
+        render(session_factory, registry, "escape", name="甲")
+
+
+def test_missing_and_broken_templates_raise_distinct_errors(session_factory):
+    """接口把 TemplateNotFound 映射为 404，TemplateRenderError 映射为 422"""
+    save_template(session_factory, "amount", "应还 {{ amount + '元' }}")
+    save_template(session_factory, "retired", "已停用", is_active=False)
+    registry = TemplateRegistry()
+
+    with pytest.raises(TemplateNotFound):
+        render(session_factory, registry, "unknown")
+    with pytest.raises(TemplateNotFound):
+        render(session_factory, registry, "retired")
+    # 数据类型不符在渲染时抛 TypeError，同样按渲染失败处理
+    with pytest.raises(TemplateRenderError):
+        render(session_factory, registry, "amount", amount=5)
+    assert render(session_factory, registry, "amount", amount="5") == "应还 5元"
@@ -0,0 +1,198 @@
+# 逾期账龄汇总
+
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import Session
+
+from shared.models.loan import Repayment, OverdueAging
+
+
+# 账龄段：名称、最小逾期天数、最大逾期天数（None 表示不设限）
+AGING_BUCKETS = (
+    ("1-30", None, 30),
+    ("31-60", 31, 60),
+    ("61-90", 61, 90),
+    ("90+", 91, None),
+)
+
+BUCKET_NAMES = tuple(name for name, _, _ in AGING_BUCKETS)
+
+# 汇总读写锁：滚动与重算整体改写当天汇总时独占，还款与新增逾期增减汇总时共享
+AGING_LOCK_ID = 290731
+
+# 期次未还金额
+outstanding_amount = Repayment.due_amount - func.coalesce(Repayment.paid_amount, 0)
+
+
+def bucket_of(due_date: date, as_of: date) -> str:
+    """按 as_of 日期计算期次所在账龄段"""
+    days = (as_of - due_date).days
+    for name, _, high in AGING_BUCKETS:
+        if high is None or days <= high:
+            return name
+
+
+def bucket_expr(as_of: date):
+    """按 as_of 日期计算账龄段的SQL表达式"""
+    return case(
+        (Repayment.due_date >= as_of - timedelta(days=30), "1-30"),
+        (Repayment.due_date >= as_of - timedelta(days=60), "31-60"),
+        (Repayment.due_date >= as_of - timedelta(days=90), "61-90"),
+        else_="90+"
+    )
+
+
+def due_date_range(bucket: str, as_of: date) -> Tuple[Optional[date], Optional[date]]:
+    """账龄段对应的到期日范围（闭区间）"""
+    for name, low, high in AGING_BUCKETS:
+        if name == bucket:
+            earliest = as_of - timedelta(days=high) if high is not None else None
+            latest = as_of - timedelta(days=low) if low is not None else None
+            return earliest, latest
+    raise ValueError(f"未知账龄段: {bucket}")
+
+
+class OverdueAgingSummary:
+    """逾期账龄日汇总的增量维护
+
+    每日逾期扫描把前一天的汇总滚动到当天，只重新归类跨越账龄边界的期次并加入新逾期期次；
+    还款和人工标记逾期在各自事务内直接增减当天汇总。调用方负责提交事务。
+
+    改写汇总（rebuild / roll_forward）持有事务级排他 advisory 锁，增减汇总持有共享锁且在读取
+    汇总日期之前加锁：扫描进行中提交的还款会等扫描提交后再记到新的一天，不会丢失。
+    会锁定期次行的事务须先调用 lock 再锁行，与逾期扫描的加锁顺序一致，避免死锁。
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def lock(self, exclusive: bool = False):
+        """事务级 advisory 锁，事务结束时自动释放"""
+        if exclusive:
+            self.db.execute(select(func.pg_advisory_xact_lock(AGING_LOCK_ID)))
+        else:
+            self.db.execute(select(func.pg_advisory_xact_lock_shared(AGING_LOCK_ID)))
+
+    def latest_date(self) -> Optional[date]:
+        """最近一次汇总日期"""
+        return self.db.query(func.max(OverdueAging.as_of_date)).scalar()
+
+    def rebuild(self, as_of: date):
+        """全量重算 as_of 当天的汇总，用于首次初始化与对账"""
+        self.lock(exclusive=True)
+        bucket = bucket_expr(as_of).label("bucket")
+        rows = self.db.query(
+            bucket,
+            func.count(Repayment.id),
+            func.coalesce(func.sum(outstanding_amount), 0)
+        ).filter(
+            Repayment.status == "overdue"
+        ).group_by("bucket").all()
+
+        self._write(as_of, {name: [count, amount] for name, count, amount in rows})
+
+    def roll_forward(self, as_of: date):
+        """把最近一天的汇总滚动到 as_of"""
+        self.lock(exclusive=True)
+        last = self.latest_date()
+        if last is None:
+            self.rebuild(as_of)
+            return
+        if last >= as_of:
+            return
+
+        totals = {
+            row.bucket: [row.overdue_count, row.overdue_amount]
+            for row in self.db.query(OverdueAging).filter(OverdueAging.as_of_date == last).all()
+        }
+
+        # 只有到期日落在该窗口内的期次会在 last 与 as_of 之间跨越账龄边界
+        old_bucket = bucket_expr(last).label("old_bucket")
+        new_bucket = bucket_expr(as_of).label("new_bucket")
+        moved = self.db.query(
+            old_bucket,
+            new_bucket,
+            func.count(Repayment.id),
+            func.coalesce(func.sum(outstanding_amount), 0)
+        ).filter(
+            Repayment.status == "overdue",
+            Repayment.due_date > last - timedelta(days=91),
+            Repayment.due_date <= as_of - timedelta(days=31)
+        ).group_by("old_bucket", "new_bucket").all()
+
+        for old, new, count, amount in moved:
+            if old == new:
+                continue
+            totals.setdefault(old, [0, 0])
+            totals.setdefault(new, [0, 0])
+            totals[old][0] -= count
+            totals[old][1] -= amount
+            totals[new][0] += count
+            totals[new][1] += amount
+
+        self._write(as_of, totals)
+
+    def record_overdue(self, items: Iterable[Tuple[date, Decimal]]):
+        """新增逾期期次：items 为 (到期日, 未还金额)"""
+        self.lock(exclusive=False)
+        as_of = self.latest_date()
+        if as_of is None:
+            # 尚未初始化，下次扫描会全量重算
+            return
+
+        deltas = defaultdict(lambda: [0, Decimal("0")])
+        for due_date, amount in items:
+            delta = deltas[bucket_of(due_date, as_of)]
+            delta[0] += 1
+            delta[1] += Decimal(amount)
+
+        self._apply(as_of, deltas)
+
+    def record_payment(self, allocations):
+        """逾期期次还款：部分还款只扣金额，结清时同时扣笔数"""
+        if not any(allocation.previous_status == "overdue" for allocation in allocations):
+            return
+        self.lock(exclusive=False)
+        as_of = self.latest_date()
+        if as_of is None:
+            return
+
+        deltas = defaultdict(lambda: [0, Decimal("0")])
+        for allocation in allocations:
+            if allocation.previous_status != "overdue":
+                continue
+            delta = deltas[bucket_of(allocation.repayment.due_date, as_of)]
+            delta[0] -= 1 if allocation.settled else 0
+            delta[1] -= allocation.amount
+
+        self._apply(as_of, deltas)
+
+    def _apply(self, as_of: date, deltas: Dict[str, list]):
+        for bucket, (count, amount) in deltas.items():
+            self.db.query(OverdueAging).filter(
+                OverdueAging.as_of_date == as_of,
+                OverdueAging.bucket == bucket
+            ).update({
+                OverdueAging.overdue_count: OverdueAging.overdue_count + count,
+                OverdueAging.overdue_amount: OverdueAging.overdue_amount + amount
+            }, synchronize_session=False)
+
+    def _write(self, as_of: date, totals: Dict[str, list]):
+        self.db.query(OverdueAging).filter(
+            OverdueAging.as_of_date == as_of
+        ).delete(synchronize_session=False)
+
+        for name in BUCKET_NAMES:
+            count, amount = totals.get(name, (0, 0))
+            self.db.add(OverdueAging(
+                as_of_date=as_of,
+                bucket=name,
+                overdue_count=count,
+                overdue_amount=amount
+            ))
+
+        self.db.flush()
@@ -0,0 +1,177 @@
+# 还款账本
+
+import uuid
+from collections import namedtuple
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+from typing import List, Optional
+
+from sqlalchemy.orm import Session
+
+from shared.models.loan import Loan, Repayment, RepaymentEntry
+
+
+CENT = Decimal("0.01")
+
+OPEN_STATUSES = ("due", "overdue")
+
+class LedgerError(Exception):
+    """还款无法入账"""
+
+
+class LoanNotFound(LedgerError):
+    """贷款不存在或不属于该用户"""
+
+
+class PaymentRejected(LedgerError):
+    """还款金额或贷款状态不允许入账"""
+
+
+# 单期分配结果：期次、分配金额、分配前状态、是否已结清
+Allocation = namedtuple("Allocation", ["repayment", "amount", "previous_status", "settled"])
+
+# 还款结果：replayed 表示同一 payment_id 的重复提交，未再次入账
+PaymentResult = namedtuple("PaymentResult", ["loan", "allocations", "replayed"])
+
+
+def to_amount(value) -> Decimal:
+    """转换为两位小数的金额"""
+    return Decimal(str(value)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def outstanding_of(repayment: Repayment) -> Decimal:
+    """期次未还金额"""
+    return to_amount(repayment.due_amount) - to_amount(repayment.paid_amount or 0)
+
+
+def allocate_payment(installments: List[Repayment], amount: Decimal) -> List[Allocation]:
+    """按到期日先后把还款金额分配到各期次，不足一期的部分记为部分还款"""
+    allocations = []
+    remaining = amount
+
+    for repayment in installments:
+        if remaining <= 0:
+            break
+
+        outstanding = outstanding_of(repayment)
+        if outstanding <= 0:
+            continue
+
+        applied = min(remaining, outstanding)
+        remaining -= applied
+        allocations.append(Allocation(
+            repayment=repayment,
+            amount=applied,
+            previous_status=repayment.status,
+            settled=applied == outstanding
+        ))
+
+    return allocations
+
+
+class RepaymentLedger:
+    """还款入账：锁定贷款行后分配金额并追加流水
+
+    所有入账都先对贷款行加 FOR UPDATE 行锁，同一笔贷款的并发还款串行执行，
+    不同贷款之间互不阻塞。调用方负责提交事务。
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def apply_payment(
+        self,
+        loan_id: int,
+        user_id: int,
+        amount: float,
+        payment_method: str,
+        payment_id: Optional[str] = None
+    ) -> PaymentResult:
+        """入账一笔还款"""
+        amount = to_amount(amount)
+        if amount <= 0:
+            raise PaymentRejected("还款金额必须大于0")
+
+        loan = self.db.query(Loan).filter(
+            Loan.id == loan_id,
+            Loan.user_id == user_id
+        ).with_for_update().first()
+
+        if not loan:
+            raise LoanNotFound("贷款不存在")
+
+        # 持有贷款行锁后再判重，同一请求的并发重试只会入账一次
+        if payment_id:
+            replayed = self._replay(loan, payment_id)
+            if replayed:
+                return replayed
+        else:
+            payment_id = uuid.uuid4().hex
+
+        if loan.status != "approved":
+            raise PaymentRejected("贷款状态不允许还款")
+
+        installments = self.db.query(Repayment).filter(
+            Repayment.loan_id == loan.id,
+            Repayment.status.in_(OPEN_STATUSES)
+        ).order_by(Repayment.due_date, Repayment.id).with_for_update().all()
+
+        if not installments:
+            raise PaymentRejected("没有待还款记录")
+
+        total_outstanding = sum((outstanding_of(r) for r in installments), Decimal("0"))
+        if amount > total_outstanding:
+            raise PaymentRejected(f"还款金额超过待还总额 {total_outstanding} 元")
+
+        allocations = allocate_payment(installments, amount)
+        today = date.today()
+
+        for allocation in allocations:
+            repayment = allocation.repayment
+            repayment.paid_amount = to_amount(repayment.paid_amount or 0) + allocation.amount
+            repayment.paid_date = today
+            if allocation.settled:
+                repayment.status = "paid"
+
+            self.db.add(RepaymentEntry(
+                payment_id=payment_id,
+                loan_id=loan.id,
+                repayment_id=repayment.id,
+                user_id=user_id,
+                amount=allocation.amount,
+                payment_method=payment_method
+            ))
+
+        loan.remaining_amount = max(Decimal("0"), to_amount(loan.remaining_amount or 0) - amount)
+        if loan.remaining_amount <= 0:
+            loan.status = "settled"
+
+        return PaymentResult(loan=loan, allocations=allocations, replayed=False)
+
+    def _replay(self, loan: Loan, payment_id: str) -> Optional[PaymentResult]:
+        """查找已入账的同一笔还款"""
+        entries = self.db.query(RepaymentEntry).filter(
+            RepaymentEntry.payment_id == payment_id,
+            RepaymentEntry.loan_id == loan.id
+        ).order_by(RepaymentEntry.id).all()
+
+        if not entries:
+            return None
+
+        repayments = {
+            r.id: r for r in self.db.query(Repayment).filter(
+                Repayment.id.in_([e.repayment_id for e in entries])
+            ).all()
+        }
+
+        allocations = [
+            Allocation(
+                repayment=repayments[entry.repayment_id],
+                amount=to_amount(entry.amount),
+                previous_status=repayments[entry.repayment_id].status,
+                settled=repayments[entry.repayment_id].status == "paid"
+            )
+            for entry in entries
+        ]
+
+        return PaymentResult(loan=loan, allocations=allocations, replayed=True)
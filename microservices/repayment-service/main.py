@@ -1,11 +1,16 @@
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, case, update, tuple_
 from sqlalchemy.orm import Session
 from typing import List, Optional
 import sys
 import os
+import asyncio
 from datetime import datetime, timedelta, date
 import httpx
+import redis
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 
@@ -14,9 +19,13 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'shared'))
 
 from shared.config.settings import settings
 from shared.utils.database import get_db_session
-from shared.utils.auth import verify_token
-from shared.models.loan import Loan, Repayment
+from shared.utils.auth import verify_token, verify_internal_token
+from shared.models.loan import Loan, Repayment, OverdueAging
 from pydantic import BaseModel
+from plan_cache import RepaymentPlanCache
+from ledger import RepaymentLedger, LoanNotFound, PaymentRejected
+from aging import OverdueAgingSummary, BUCKET_NAMES, due_date_range
+from export_repayments import DATE_FIELDS, iter_repayment_chunks, csv_chunks, parquet_chunks
 
 app = FastAPI(
     title="还款服务",
@@ -26,6 +35,29 @@ app = FastAPI(
 
 security = HTTPBearer()
 
+# 待还状态
+OPEN_REPAYMENT_STATUSES = ("due", "overdue")
+
+# 分页上限
+MAX_PAGE_SIZE = 200
+
+# 内部接口分页上限
+MAX_INTERNAL_PAGE_SIZE = 5000
+
+# 导出格式
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# 还款计划缓存
+redis_client = redis.Redis.from_url(settings.redis_url, decode_responses=True)
+plan_cache = RepaymentPlanCache(
+    redis_client,
+    ttl=settings.repayment_plan_cache_ttl,
+    l1_size=settings.repayment_plan_l1_size
+)
+
 # 调度器
 scheduler = BackgroundScheduler()
 
@@ -35,6 +67,7 @@ class RepaymentCreate(BaseModel):
     loan_id: int
     amount: float
     payment_method: str = "alipay"
+    payment_id: Optional[str] = None  # 幂等键，客户端重试时保持不变
 
 
 class RepaymentResponse(BaseModel):
@@ -51,6 +84,27 @@ class RepaymentResponse(BaseModel):
         from_attributes = True
 
 
+class DueRepaymentResponse(BaseModel):
+    repayment_id: int
+    loan_id: int
+    user_id: int
+    due_date: date
+    amount: float
+
+
+class AgingBucketResponse(BaseModel):
+    bucket: str
+    count: int
+    amount: float
+
+
+class AgingSummaryResponse(BaseModel):
+    as_of_date: date
+    total_count: int
+    total_amount: float
+    buckets: List[AgingBucketResponse]
+
+
 class RepaymentPlanResponse(BaseModel):
     loan_id: int
     total_amount: float
@@ -137,26 +191,57 @@ def calculate_repayment_schedule(loan: Loan) -> List[Repayment]:
 def check_overdue_repayments(db: Session):
     """检查逾期还款"""
     today = date.today()
-    overdue_repayments = db.query(Repayment).filter(
-        Repayment.status == "due",
-        Repayment.due_date < today
+
+    # 先把账龄汇总滚动到今天，再计入本次新增的逾期期次
+    aging = OverdueAgingSummary(db)
+    aging.roll_forward(today)
+
+    # 单条UPDATE批量标记逾期，并取回受影响的期次
+    overdue_repayments = db.execute(
+        update(Repayment).where(
+            Repayment.status == "due",
+            Repayment.due_date < today
+        ).values(
+            status="overdue",
+            updated_at=datetime.utcnow()
+        ).returning(
+            Repayment.id,
+            Repayment.loan_id,
+            Repayment.due_date,
+            Repayment.due_amount,
+            Repayment.paid_amount
+        ).execution_options(synchronize_session=False)
     ).all()
-    
-    for repayment in overdue_repayments:
-        repayment.status = "overdue"
-        db.commit()
-        
-        # 发送逾期通知
-        # 这里需要获取用户ID，简化处理
-        loan = db.query(Loan).filter(Loan.id == repayment.loan_id).first()
-        if loan:
-            # 异步发送通知
-            import asyncio
-            asyncio.create_task(send_notification(
-                loan.user_id,
-                f"您的贷款还款已逾期，请尽快还款。逾期金额：{repayment.due_amount}元",
+    aging.record_overdue(
+        (row.due_date, row.due_amount - (row.paid_amount or 0))
+        for row in overdue_repayments
+    )
+    db.commit()
+
+    if not overdue_repayments:
+        return
+
+    loan_ids = {row.loan_id for row in overdue_repayments}
+    plan_cache.invalidate(loan_ids)
+
+    # 发送逾期通知
+    loan_users = dict(
+        db.query(Loan.id, Loan.user_id).filter(Loan.id.in_(loan_ids)).all()
+    )
+
+    async def notify_all():
+        await asyncio.gather(*[
+            send_notification(
+                loan_users[row.loan_id],
+                f"您的贷款还款已逾期，请尽快还款。逾期金额：{row.due_amount}元",
                 "repayment_overdue"
-            ))
+            )
+            for row in overdue_repayments
+            if row.loan_id in loan_users
+        ])
+
+    # 调度器运行在后台线程中，没有事件循环
+    asyncio.run(notify_all())
 
 
 # 定时任务
@@ -181,53 +266,46 @@ async def make_repayment(
     current_user_id: int = Depends(get_current_user_id),
     db: Session = Depends(lambda: next(get_db_session("repayment_service")))
 ):
-    """执行还款"""
-    # 获取贷款信息
-    loan = db.query(Loan).filter(
-        Loan.id == repayment_data.loan_id,
-        Loan.user_id == current_user_id
-    ).first()
-    
-    if not loan:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="贷款不存在"
+    """执行还款
+
+    金额按到期日先后分配到各期次，支持部分还款与一次结清多期；
+    传入相同 payment_id 的重复请求只会入账一次。
+    """
+    # 先取账龄汇总的共享锁再锁贷款与期次行，与逾期扫描的加锁顺序一致
+    OverdueAgingSummary(db).lock()
+    ledger = RepaymentLedger(db)
+    try:
+        result = ledger.apply_payment(
+            loan_id=repayment_data.loan_id,
+            user_id=current_user_id,
+            amount=repayment_data.amount,
+            payment_method=repayment_data.payment_method,
+            payment_id=repayment_data.payment_id
         )
-    
-    if loan.status != "approved":
+    except LoanNotFound as e:
+        # 及时释放贷款行锁
+        db.rollback()
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="贷款状态不允许还款"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
         )
-    
-    # 查找待还款记录
-    repayment = db.query(Repayment).filter(
-        Repayment.loan_id == repayment_data.loan_id,
-        Repayment.status.in_(["due", "overdue"])
-    ).order_by(Repayment.due_date).first()
-    
-    if not repayment:
+    except PaymentRejected as e:
+        db.rollback()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="没有待还款记录"
+            detail=str(e)
         )
-    
-    # 更新还款记录
-    repayment.paid_date = date.today()
-    repayment.paid_amount = repayment_data.amount
-    repayment.status = "paid"
-    
-    # 更新贷款剩余金额
-    loan.remaining_amount = max(0, float(loan.remaining_amount) - repayment_data.amount)
-    
-    # 检查是否全部还清
-    if loan.remaining_amount <= 0:
-        loan.status = "settled"
-        loan.remaining_amount = 0
-    
+
+    repayment = result.allocations[0].repayment
+    if result.replayed:
+        db.rollback()
+        return repayment
+
+    OverdueAgingSummary(db).record_payment(result.allocations)
     db.commit()
     db.refresh(repayment)
-    
+    plan_cache.invalidate([result.loan.id])
+
     # 发送还款成功通知
     await send_notification(
         current_user_id,
@@ -240,20 +318,69 @@ async def make_repayment(
 
 @app.get("/repayments", response_model=List[RepaymentResponse])
 async def get_user_repayments(
+    limit: int = 50,
+    before_id: Optional[int] = None,
     current_user_id: int = Depends(get_current_user_id),
     db: Session = Depends(lambda: next(get_db_session("repayment_service")))
 ):
-    """获取用户还款记录"""
-    # 获取用户的所有贷款ID
-    user_loans = db.query(Loan).filter(Loan.user_id == current_user_id).all()
-    loan_ids = [loan.id for loan in user_loans]
-    
-    # 获取还款记录
-    repayments = db.query(Repayment).filter(
-        Repayment.loan_id.in_(loan_ids)
-    ).order_by(Repayment.created_at.desc()).all()
-    
-    return repayments
+    """获取用户还款记录
+
+    按记录ID倒序做游标分页：下一页传入本页最后一条记录的 id 作为 before_id。
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    query = db.query(Repayment).join(
+        Loan, Loan.id == Repayment.loan_id
+    ).filter(Loan.user_id == current_user_id)
+
+    if before_id is not None:
+        query = query.filter(Repayment.id < before_id)
+
+    return query.order_by(Repayment.id.desc()).limit(limit).all()
+
+
+def load_repayment_plan(db: Session, loan_id: int, user_id: int) -> Optional[RepaymentPlanResponse]:
+    """单次查询加载还款计划，逾期金额与下次还款由SQL窗口函数计算"""
+    is_open = Repayment.status.in_(OPEN_REPAYMENT_STATUSES)
+
+    overdue_amount = func.coalesce(
+        func.sum(Repayment.due_amount).filter(Repayment.status == "overdue").over(),
+        0
+    )
+    next_payment_date = func.min(Repayment.due_date).filter(is_open).over()
+    # 未结清期次排在最前，取到期日最早的一期
+    next_payment_amount = func.first_value(Repayment.due_amount).over(
+        order_by=(case((is_open, 0), else_=1), Repayment.due_date, Repayment.id)
+    )
+
+    rows = db.query(
+        Loan.amount,
+        Loan.remaining_amount,
+        Repayment,
+        overdue_amount,
+        next_payment_date,
+        next_payment_amount
+    ).select_from(Loan).outerjoin(
+        Repayment, Repayment.loan_id == Loan.id
+    ).filter(
+        Loan.id == loan_id,
+        Loan.user_id == user_id
+    ).order_by(Repayment.due_date, Repayment.id).all()
+
+    if not rows:
+        return None
+
+    amount, remaining_amount, _, overdue, next_date, next_amount = rows[0]
+
+    return RepaymentPlanResponse(
+        loan_id=loan_id,
+        total_amount=float(amount),
+        remaining_amount=float(remaining_amount or 0),
+        next_payment_date=next_date,
+        next_payment_amount=float(next_amount) if next_date else 0,
+        overdue_amount=float(overdue or 0),
+        repayments=[row[2] for row in rows if row[2] is not None]
+    )
 
 
 @app.get("/repayment-plan/{loan_id}", response_model=RepaymentPlanResponse)
@@ -263,47 +390,19 @@ async def get_repayment_plan(
     db: Session = Depends(lambda: next(get_db_session("repayment_service")))
 ):
     """获取还款计划"""
-    # 获取贷款信息
-    loan = db.query(Loan).filter(
-        Loan.id == loan_id,
-        Loan.user_id == current_user_id
-    ).first()
-    
-    if not loan:
+    def loader():
+        plan = load_repayment_plan(db, loan_id, current_user_id)
+        return jsonable_encoder(plan) if plan is not None else None
+
+    plan = plan_cache.get_or_load(loan_id, current_user_id, loader)
+
+    if plan is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="贷款不存在"
         )
-    
-    # 获取还款记录
-    repayments = db.query(Repayment).filter(
-        Repayment.loan_id == loan_id
-    ).order_by(Repayment.due_date).all()
-    
-    # 计算逾期金额
-    overdue_amount = sum(
-        float(repayment.due_amount) for repayment in repayments 
-        if repayment.status == "overdue"
-    )
-    
-    # 计算下次还款
-    next_repayment = db.query(Repayment).filter(
-        Repayment.loan_id == loan_id,
-        Repayment.status.in_(["due", "overdue"])
-    ).order_by(Repayment.due_date).first()
-    
-    next_payment_date = next_repayment.due_date if next_repayment else None
-    next_payment_amount = float(next_repayment.due_amount) if next_repayment else 0
-    
-    return RepaymentPlanResponse(
-        loan_id=loan_id,
-        total_amount=float(loan.amount),
-        remaining_amount=float(loan.remaining_amount),
-        next_payment_date=next_payment_date,
-        next_payment_amount=next_payment_amount,
-        overdue_amount=overdue_amount,
-        repayments=repayments
-    )
+
+    return plan
 
 
 @app.post("/generate-plan/{loan_id}")
@@ -335,20 +434,191 @@ async def generate_repayment_plan(
         db.add(repayment)
     
     db.commit()
-    
+    plan_cache.invalidate([loan_id])
+
     return {"message": "还款计划生成成功", "count": len(repayments)}
 
 
-@app.get("/overdue")
+@app.get("/overdue/aging", response_model=List[AgingSummaryResponse])
+async def get_overdue_aging(
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    db: Session = Depends(lambda: next(get_db_session("repayment_service")))
+):
+    """获取逾期账龄汇总（管理员接口），默认返回最近一天"""
+    query = db.query(OverdueAging)
+
+    if start_date is None and end_date is None:
+        latest = OverdueAgingSummary(db).latest_date()
+        if latest is None:
+            return []
+        query = query.filter(OverdueAging.as_of_date == latest)
+    else:
+        if start_date is not None:
+            query = query.filter(OverdueAging.as_of_date >= start_date)
+        if end_date is not None:
+            query = query.filter(OverdueAging.as_of_date <= end_date)
+
+    days = {}
+    for row in query.order_by(OverdueAging.as_of_date, OverdueAging.bucket).all():
+        day = days.setdefault(row.as_of_date, AgingSummaryResponse(
+            as_of_date=row.as_of_date,
+            total_count=0,
+            total_amount=0,
+            buckets=[]
+        ))
+        day.buckets.append(AgingBucketResponse(
+            bucket=row.bucket,
+            count=row.overdue_count,
+            amount=float(row.overdue_amount)
+        ))
+        day.total_count += row.overdue_count
+        day.total_amount += float(row.overdue_amount)
+
+    for day in days.values():
+        day.buckets.sort(key=lambda b: BUCKET_NAMES.index(b.bucket))
+
+    return list(days.values())
+
+
+@app.post("/overdue/aging/rebuild")
+async def rebuild_overdue_aging(
+    db: Session = Depends(lambda: next(get_db_session("repayment_service")))
+):
+    """全量重算当天账龄汇总（管理员接口，用于对账）"""
+    OverdueAgingSummary(db).rebuild(date.today())
+    db.commit()
+
+    return {"message": "账龄汇总已重算"}
+
+
+@app.get("/overdue", response_model=List[RepaymentResponse])
 async def get_overdue_repayments(
+    bucket: Optional[str] = None,
+    limit: int = 100,
+    after_due_date: Optional[date] = None,
+    after_id: Optional[int] = None,
     db: Session = Depends(lambda: next(get_db_session("repayment_service")))
 ):
-    """获取逾期还款列表（管理员接口）"""
-    overdue_repayments = db.query(Repayment).filter(
-        Repayment.status == "overdue"
-    ).all()
-    
-    return overdue_repayments
+    """获取逾期还款明细（管理员接口）
+
+    可按账龄段过滤；按 (到期日, id) 游标分页，下一页传入本页最后一条的 due_date 与 id。
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    query = db.query(Repayment).filter(Repayment.status == "overdue")
+
+    if bucket is not None:
+        if bucket not in BUCKET_NAMES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"账龄段必须是 {', '.join(BUCKET_NAMES)} 之一"
+            )
+        earliest, latest = due_date_range(bucket, date.today())
+        if earliest is not None:
+            query = query.filter(Repayment.due_date >= earliest)
+        if latest is not None:
+            query = query.filter(Repayment.due_date <= latest)
+
+    if after_due_date is not None and after_id is not None:
+        query = query.filter(
+            tuple_(Repayment.due_date, Repayment.id) > tuple_(after_due_date, after_id)
+        )
+
+    return query.order_by(Repayment.due_date, Repayment.id).limit(limit).all()
+
+
+@app.get(
+    "/internal/due-repayments",
+    response_model=List[DueRepaymentResponse],
+    dependencies=[Depends(verify_internal_token)]
+)
+async def get_due_repayments(
+    due_date: Optional[date] = None,
+    after_id: int = 0,
+    limit: int = 1000,
+    db: Session = Depends(lambda: next(get_db_session("repayment_service")))
+):
+    """按到期日列出待还期次及借款人（内部接口，通知服务批量发送还款提醒用）
+
+    默认取明天到期的期次；按还款记录 id 游标分页，下一页传入本页最后一条的 repayment_id。
+    """
+    due_date = due_date or date.today() + timedelta(days=1)
+    limit = max(1, min(limit, MAX_INTERNAL_PAGE_SIZE))
+
+    rows = db.query(
+        Repayment.id,
+        Repayment.loan_id,
+        Loan.user_id,
+        Repayment.due_date,
+        Repayment.due_amount,
+        Repayment.paid_amount
+    ).join(Loan, Loan.id == Repayment.loan_id).filter(
+        Repayment.status == "due",
+        Repayment.due_date == due_date,
+        Repayment.id > after_id
+    ).order_by(Repayment.id).limit(limit).all()
+
+    return [
+        DueRepaymentResponse(
+            repayment_id=row.id,
+            loan_id=row.loan_id,
+            user_id=row.user_id,
+            due_date=row.due_date,
+            amount=float(row.due_amount - (row.paid_amount or 0))
+        )
+        for row in rows
+    ]
+
+
+@app.get("/export/repayments")
+async def export_repayments(
+    start_date: date,
+    end_date: date,
+    format: str = "csv",
+    date_field: str = "due_date",
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    db: Session = Depends(lambda: next(get_db_session("repayment_service")))
+):
+    """流式导出还款记录（财务对账接口）
+
+    按 id 递增输出，limit 限制本次最多导出的条数。
+    CSV 下载中断后把已收到的最后一个完整行的 id 作为 after_id 重新请求即可续传；
+    Parquet 文件尾在最后写出，截断的文件无法读取，应按 limit 分页下载：
+    每页是完整文件，以上一页最后的 id 作为下一页的 after_id，中断的页用同一 after_id 重下，
+    返回不足 limit 条即为最后一页。
+    """
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="导出格式必须是 csv 或 parquet"
+        )
+
+    if date_field not in DATE_FIELDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="日期字段必须是 due_date 或 paid_date"
+        )
+
+    if limit is not None and limit <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="limit 必须大于 0"
+        )
+
+    chunks = iter_repayment_chunks(db, start_date, end_date, date_field, after_id, limit=limit)
+    if format == "csv":
+        body = csv_chunks(chunks, header=after_id is None)
+    else:
+        body = parquet_chunks(chunks)
+
+    filename = f"repayments_{start_date}_{end_date}.{format}"
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
 
 
 @app.post("/repayments/{repayment_id}/mark-overdue")
@@ -365,9 +635,15 @@ async def mark_repayment_overdue(
             detail="还款记录不存在"
         )
     
+    if repayment.status == "due":
+        OverdueAgingSummary(db).record_overdue([
+            (repayment.due_date, repayment.due_amount - (repayment.paid_amount or 0))
+        ])
+
     repayment.status = "overdue"
     db.commit()
-    
+    plan_cache.invalidate([repayment.loan_id])
+
     return {"message": "已标记为逾期"}
 
 
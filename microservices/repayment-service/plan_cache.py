@@ -0,0 +1,124 @@
+# 还款计划缓存
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional
+
+from redis.exceptions import RedisError
+
+
+# 仅当版本号未被写入方推进时才写入快照，避免并发写之后回填旧数据
+_CAS_SET_SCRIPT = """
+local current = redis.call('GET', KEYS[1]) or '0'
+if current ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+
+class RepaymentPlanCache:
+    """按贷款缓存还款计划快照：Redis 共享快照 + 进程内 L1
+
+    每笔贷款有一个版本号，写操作提交后推进版本号即失效所有副本；
+    读取时快照版本与当前版本一致才视为命中。版本号只增不减、不设过期，
+    L1 条目另有与快照相同的有效期，Redis 数据丢失导致版本号归零时也不会一直返回旧计划。
+    """
+
+    def __init__(self, redis_client, ttl: int = 600, l1_size: int = 2048):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.l1_size = l1_size
+        self._l1 = OrderedDict()  # loan_id -> (version, user_id, plan, 过期时间)
+        self._lock = threading.Lock()
+        self._cas_set = redis_client.register_script(_CAS_SET_SCRIPT)
+
+    @staticmethod
+    def _version_key(loan_id: int) -> str:
+        return f"repayment_plan:version:{loan_id}"
+
+    @staticmethod
+    def _snapshot_key(loan_id: int) -> str:
+        return f"repayment_plan:snapshot:{loan_id}"
+
+    def get_or_load(self, loan_id: int, user_id: int, loader: Callable[[], Optional[dict]]) -> Optional[dict]:
+        """读取还款计划，未命中时调用 loader 从数据库加载并回填"""
+        try:
+            version, raw = self.redis.mget(
+                self._version_key(loan_id),
+                self._snapshot_key(loan_id)
+            )
+        except RedisError as e:
+            # Redis不可用时无法校验版本，直接读库
+            print(f"还款计划缓存读取失败: {e}")
+            return loader()
+
+        version = version or "0"
+
+        with self._lock:
+            entry = self._l1.get(loan_id)
+            if entry and entry[3] <= time.monotonic():
+                del self._l1[loan_id]
+                entry = None
+            if entry and entry[0] == version:
+                self._l1.move_to_end(loan_id)
+                return entry[2] if entry[1] == user_id else None
+
+        if raw:
+            snapshot = json.loads(raw)
+            if snapshot["version"] == version:
+                self._remember(loan_id, version, snapshot["user_id"], snapshot["plan"])
+                return snapshot["plan"] if snapshot["user_id"] == user_id else None
+
+        plan = loader()
+        if plan is None:
+            return None
+
+        payload = json.dumps(
+            {"version": version, "user_id": user_id, "plan": plan},
+            ensure_ascii=False
+        )
+        try:
+            stored = self._cas_set(
+                keys=[self._version_key(loan_id), self._snapshot_key(loan_id)],
+                args=[version, payload, self.ttl]
+            )
+        except RedisError as e:
+            print(f"还款计划缓存写入失败: {e}")
+            stored = 0
+
+        if stored:
+            self._remember(loan_id, version, user_id, plan)
+
+        return plan
+
+    def invalidate(self, loan_ids: Iterable[int]):
+        """推进版本号使快照失效，须在写事务提交之后调用"""
+        loan_ids = set(loan_ids)
+        if not loan_ids:
+            return
+
+        with self._lock:
+            for loan_id in loan_ids:
+                self._l1.pop(loan_id, None)
+
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for loan_id in loan_ids:
+                pipe.incr(self._version_key(loan_id))
+                # 版本号不过期：过期归零后再推进会与其他进程 L1 里的旧版本号重合
+                pipe.persist(self._version_key(loan_id))
+                pipe.delete(self._snapshot_key(loan_id))
+            pipe.execute()
+        except RedisError as e:
+            print(f"还款计划缓存失效失败: {e}")
+
+    def _remember(self, loan_id: int, version: str, user_id: int, plan: dict):
+        with self._lock:
+            self._l1[loan_id] = (version, user_id, plan, time.monotonic() + self.ttl)
+            self._l1.move_to_end(loan_id)
+            while len(self._l1) > self.l1_size:
+                self._l1.popitem(last=False)
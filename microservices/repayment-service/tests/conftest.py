@@ -0,0 +1,37 @@
+import os
+import sys
+
+# 与服务运行时一致：服务目录下的模块按文件名导入，shared 包从 microservices 目录导入
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(SERVICE_DIR))
+sys.path.insert(0, SERVICE_DIR)
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from shared.models.loan import Base
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """设置 TEST_DATABASE_URL 时在 PostgreSQL 上测试（真实行锁）；
+    否则用 SQLite 文件库，每个事务以 BEGIN IMMEDIATE 开始，写事务整体串行"""
+    url = os.getenv("TEST_DATABASE_URL")
+    if url:
+        engine = create_engine(url)
+    else:
+        engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"timeout": 30})
+
+        @event.listens_for(engine, "connect")
+        def disable_pysqlite_transactions(dbapi_connection, connection_record):
+            dbapi_connection.isolation_level = None
+
+        @event.listens_for(engine, "begin")
+        def begin_immediate(connection):
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+    Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine)
+    Base.metadata.drop_all(engine)
+    engine.dispose()
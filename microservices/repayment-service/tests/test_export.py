@@ -0,0 +1,151 @@
+import csv
+import io
+import os
+from argparse import Namespace
+from datetime import date, timedelta
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import export_repayments
+from export_repayments import (
+    EXPORT_FIELDS, csv_chunks, export_csv, export_parquet, iter_repayment_chunks, parquet_chunks
+)
+from shared.models.loan import Repayment
+
+
+START = date(2024, 1, 1)
+
+
+class Crash(Exception):
+    """模拟导出进程中断"""
+
+
+def create_repayments(session_factory, count: int):
+    with session_factory() as db:
+        for index in range(count):
+            db.add(Repayment(
+                loan_id=index % 3 + 1,
+                due_date=START + timedelta(days=index % 28),
+                due_amount=100 + index,
+                paid_amount=0,
+                status="due"
+            ))
+        db.commit()
+
+
+def export_args(output, chunk_size=3, rows_per_file=4):
+    return Namespace(
+        start=START, end=date(2024, 1, 31), date_field="due_date",
+        output=str(output), chunk_size=chunk_size, rows_per_file=rows_per_file
+    )
+
+
+def csv_ids(path) -> list:
+    with open(path, newline="") as f:
+        rows = list(csv.reader(f))
+    assert tuple(rows[0]) == EXPORT_FIELDS
+    return [int(row[0]) for row in rows[1:]]
+
+
+def parquet_ids(directory) -> list:
+    parts = sorted(name for name in os.listdir(directory) if name.endswith(".parquet"))
+    return [
+        value
+        for name in parts
+        for value in pq.read_table(os.path.join(directory, name), columns=["id"])["id"].to_pylist()
+    ]
+
+
+def test_chunks_follow_id_order_and_resume_after_id(session_factory):
+    create_repayments(session_factory, 7)
+
+    with session_factory() as db:
+        chunks = list(iter_repayment_chunks(db, START, date(2024, 1, 31), chunk_size=3))
+        resumed = list(iter_repayment_chunks(db, START, date(2024, 1, 31), after_id=5, chunk_size=3))
+        page = list(iter_repayment_chunks(db, START, date(2024, 1, 31), after_id=2, chunk_size=3, limit=4))
+
+    assert [[row[0] for row in rows] for rows in chunks] == [[1, 2, 3], [4, 5, 6], [7]]
+    assert [row[0] for rows in resumed for row in rows] == [6, 7]
+    assert [row[0] for rows in page for row in rows] == [3, 4, 5, 6]
+
+
+def test_csv_stream_has_one_header(session_factory):
+    create_repayments(session_factory, 5)
+
+    with session_factory() as db:
+        body = b"".join(csv_chunks(iter_repayment_chunks(db, START, date(2024, 1, 31), chunk_size=2)))
+
+    rows = list(csv.reader(io.StringIO(body.decode("utf-8"))))
+    assert tuple(rows[0]) == EXPORT_FIELDS
+    assert [int(row[0]) for row in rows[1:]] == [1, 2, 3, 4, 5]
+
+
+def test_parquet_stream_is_one_readable_file(session_factory):
+    create_repayments(session_factory, 5)
+
+    with session_factory() as db:
+        body = b"".join(parquet_chunks(iter_repayment_chunks(db, START, date(2024, 1, 31), chunk_size=2)))
+
+    table = pq.read_table(pa.BufferReader(body))
+    assert table["id"].to_pylist() == [1, 2, 3, 4, 5]
+    assert pq.ParquetFile(pa.BufferReader(body)).metadata.num_row_groups == 3
+
+
+def test_csv_resume_discards_partial_chunk(session_factory, tmp_path):
+    create_repayments(session_factory, 5)
+    output = tmp_path / "repayments.csv"
+
+    with session_factory() as db:
+        export_csv(db, export_args(output))
+    # 模拟中断：断点之后写了一半的数据块
+    with open(output, "ab") as f:
+        f.write(b"6,1,2024-01-0")
+
+    create_repayments(session_factory, 2)
+    with session_factory() as db:
+        exported = export_csv(db, export_args(output))
+
+    assert exported == 2
+    assert csv_ids(output) == [1, 2, 3, 4, 5, 6, 7]
+
+
+def test_parquet_export_splits_parts(session_factory, tmp_path):
+    create_repayments(session_factory, 10)
+    output = tmp_path / "export"
+
+    with session_factory() as db:
+        exported = export_parquet(db, export_args(output, chunk_size=2))
+
+    assert exported == 10
+    assert sorted(os.listdir(output)) == ["part-00000.parquet", "part-00001.parquet", "part-00002.parquet"]
+    assert parquet_ids(output) == list(range(1, 11))
+
+
+def test_parquet_resume_starts_after_last_complete_part(session_factory, tmp_path, monkeypatch):
+    create_repayments(session_factory, 10)
+    output = tmp_path / "export"
+    replace = os.replace
+
+    def crash_after_first_part(src, dst):
+        replace(src, dst)
+        if dst.endswith("part-00000.parquet"):
+            raise Crash
+
+    monkeypatch.setattr(export_repayments.os, "replace", crash_after_first_part)
+    with session_factory() as db:
+        try:
+            export_parquet(db, export_args(output, rows_per_file=6))
+        except Crash:
+            pass
+    monkeypatch.setattr(export_repayments.os, "replace", replace)
+
+    # 第一个分片已改名，之后中断也不会重复导出其中的行
+    with open(output / "part-00001.parquet.tmp", "wb") as f:
+        f.write(b"PAR1")
+    with session_factory() as db:
+        exported = export_parquet(db, export_args(output, rows_per_file=6))
+
+    assert exported == 4
+    assert sorted(os.listdir(output)) == ["part-00000.parquet", "part-00001.parquet"]
+    assert parquet_ids(output) == list(range(1, 11))
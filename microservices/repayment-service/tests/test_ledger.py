@@ -0,0 +1,161 @@
+import threading
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+
+from ledger import RepaymentLedger, LoanNotFound, PaymentRejected
+from shared.models.loan import Loan, Repayment, RepaymentEntry
+
+
+def create_loan(session_factory, installments=(100, 100, 100), user_id=7) -> int:
+    with session_factory() as db:
+        loan = Loan(
+            loan_id="L1",
+            user_id=user_id,
+            amount=sum(installments),
+            term_months=len(installments),
+            status="approved",
+            remaining_amount=sum(installments)
+        )
+        db.add(loan)
+        db.flush()
+        for month, amount in enumerate(installments, 1):
+            db.add(Repayment(
+                loan_id=loan.id,
+                due_date=date.today() + timedelta(days=30 * month),
+                due_amount=amount,
+                paid_amount=0,
+                status="due"
+            ))
+        db.commit()
+        return loan.id
+
+
+def pay(session_factory, loan_id, amount, payment_id=None, user_id=7):
+    with session_factory() as db:
+        try:
+            result = RepaymentLedger(db).apply_payment(loan_id, user_id, amount, "bank_card", payment_id)
+        except Exception:
+            db.rollback()
+            raise
+        db.commit()
+        return result.replayed
+
+
+def run_concurrently(*calls):
+    """同时开始执行，返回每个调用的结果或异常"""
+    barrier = threading.Barrier(len(calls))
+    outcomes = [None] * len(calls)
+
+    def run(index, call):
+        barrier.wait()
+        try:
+            outcomes[index] = call()
+        except Exception as e:
+            outcomes[index] = e
+
+    threads = [threading.Thread(target=run, args=(i, call)) for i, call in enumerate(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+def ledger_state(session_factory, loan_id):
+    with session_factory() as db:
+        loan = db.query(Loan).filter(Loan.id == loan_id).one()
+        repayments = db.query(Repayment).filter(Repayment.loan_id == loan_id).order_by(Repayment.id).all()
+        entries = db.query(RepaymentEntry).filter(RepaymentEntry.loan_id == loan_id).all()
+        return (
+            Decimal(str(loan.remaining_amount)),
+            [(Decimal(str(r.paid_amount)), r.status) for r in repayments],
+            sum((Decimal(str(e.amount)) for e in entries), Decimal("0")),
+        )
+
+
+def test_payment_is_allocated_oldest_installment_first(session_factory):
+    loan_id = create_loan(session_factory)
+
+    pay(session_factory, loan_id, 150)
+
+    remaining, repayments, entered = ledger_state(session_factory, loan_id)
+    assert remaining == Decimal("150")
+    assert repayments == [(Decimal("100"), "paid"), (Decimal("50"), "due"), (Decimal("0"), "due")]
+    assert entered == Decimal("150")
+
+
+def test_duplicate_payment_id_is_entered_once(session_factory):
+    loan_id = create_loan(session_factory)
+
+    assert pay(session_factory, loan_id, 120, payment_id="p-1") is False
+    assert pay(session_factory, loan_id, 120, payment_id="p-1") is True
+
+    remaining, _, entered = ledger_state(session_factory, loan_id)
+    assert remaining == Decimal("180")
+    assert entered == Decimal("120")
+
+
+def test_concurrent_retries_of_one_payment_are_entered_once(session_factory):
+    loan_id = create_loan(session_factory)
+
+    outcomes = run_concurrently(*[lambda: pay(session_factory, loan_id, 120, payment_id="p-1")] * 4)
+
+    assert sorted(outcomes) == [False, True, True, True]
+    remaining, _, entered = ledger_state(session_factory, loan_id)
+    assert remaining == Decimal("180")
+    assert entered == Decimal("120")
+
+
+def test_racing_payments_on_one_loan_are_both_applied(session_factory):
+    loan_id = create_loan(session_factory)
+
+    outcomes = run_concurrently(
+        lambda: pay(session_factory, loan_id, 130),
+        lambda: pay(session_factory, loan_id, 90)
+    )
+
+    assert outcomes == [False, False]
+    remaining, repayments, entered = ledger_state(session_factory, loan_id)
+    assert remaining == Decimal("80")
+    assert entered == Decimal("220")
+    assert sum(paid for paid, _ in repayments) == Decimal("220")
+    assert [status for _, status in repayments] == ["paid", "paid", "due"]
+
+
+def test_racing_payments_cannot_overpay(session_factory):
+    loan_id = create_loan(session_factory)
+
+    outcomes = run_concurrently(
+        lambda: pay(session_factory, loan_id, 200),
+        lambda: pay(session_factory, loan_id, 200)
+    )
+
+    assert sum(1 for outcome in outcomes if outcome is False) == 1
+    assert sum(1 for outcome in outcomes if isinstance(outcome, PaymentRejected)) == 1
+    remaining, _, entered = ledger_state(session_factory, loan_id)
+    assert remaining == Decimal("100")
+    assert entered == Decimal("200")
+
+
+def test_settling_the_last_installment_settles_the_loan(session_factory):
+    loan_id = create_loan(session_factory)
+
+    pay(session_factory, loan_id, 300)
+
+    with session_factory() as db:
+        assert db.query(Loan).filter(Loan.id == loan_id).one().status == "settled"
+    with pytest.raises(PaymentRejected):
+        pay(session_factory, loan_id, 10)
+
+
+def test_domain_errors(session_factory):
+    loan_id = create_loan(session_factory)
+
+    with pytest.raises(LoanNotFound):
+        pay(session_factory, loan_id, 10, user_id=8)
+    with pytest.raises(PaymentRejected):
+        pay(session_factory, loan_id, 0)
+    with pytest.raises(PaymentRejected):
+        pay(session_factory, loan_id, 301)
@@ -0,0 +1,50 @@
+import time
+
+import fakeredis
+
+import plan_cache
+from plan_cache import RepaymentPlanCache
+
+
+def make_cache(redis_client, ttl=600):
+    return RepaymentPlanCache(redis_client, ttl=ttl)
+
+
+def test_invalidate_in_other_process_is_seen():
+    redis_client = fakeredis.FakeRedis(decode_responses=True)
+    reader, writer = make_cache(redis_client), make_cache(redis_client)
+
+    assert reader.get_or_load(1, 7, lambda: {"plan": "v1"}) == {"plan": "v1"}
+    writer.invalidate([1])
+    assert reader.get_or_load(1, 7, lambda: {"plan": "v2"}) == {"plan": "v2"}
+
+
+def test_version_counter_never_expires():
+    redis_client = fakeredis.FakeRedis(decode_responses=True)
+    cache = make_cache(redis_client)
+
+    cache.invalidate([1])
+    assert redis_client.ttl(cache._version_key(1)) == -1
+
+
+def test_version_reset_does_not_revive_stale_l1_entry(monkeypatch):
+    """Redis 丢失版本号后重新计数到同一个值，旧的 L1 条目过了有效期不再命中"""
+    redis_client = fakeredis.FakeRedis(decode_responses=True)
+    reader, writer = make_cache(redis_client), make_cache(redis_client)
+
+    writer.invalidate([1])
+    assert reader.get_or_load(1, 7, lambda: {"plan": "old"}) == {"plan": "old"}
+
+    redis_client.flushall()
+    writer.invalidate([1])
+    now = time.monotonic()
+    monkeypatch.setattr(plan_cache.time, "monotonic", lambda: now + 601)
+    assert reader.get_or_load(1, 7, lambda: {"plan": "new"}) == {"plan": "new"}
+
+
+def test_other_users_plan_is_not_returned():
+    redis_client = fakeredis.FakeRedis(decode_responses=True)
+    cache = make_cache(redis_client)
+
+    cache.get_or_load(1, 7, lambda: {"plan": "v1"})
+    assert cache.get_or_load(1, 8, lambda: {"plan": "v1"}) is None
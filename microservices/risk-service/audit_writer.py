@@ -0,0 +1,207 @@
+# 风控审计记录异步批量写入
+
+import asyncio
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from prometheus_client import Counter, Gauge
+from sqlalchemy import insert
+
+
+AUDIT_BUFFERED = Gauge('risk_audit_buffered_rows', 'Audit rows waiting to be written')
+AUDIT_WRITTEN = Counter('risk_audit_written_rows_total', 'Audit rows written to the database', ['table'])
+AUDIT_SPILLED = Counter('risk_audit_spilled_rows_total', 'Audit rows written to the spill file', ['table'])
+
+# 溢出文件中以字符串保存、回放时需要还原的时间列
+DATETIME_FIELDS = ("created_at", "event_time")
+
+
+class AuditWriter:
+    """缓冲风险评估 / 反欺诈记录，按条数或时间间隔批量多行插入
+
+    请求线程只把行追加到内存缓冲区；后台任务在线程池中写库。
+    写库失败、缓冲区溢出或停机时未能写库的行追加到本地溢出文件（JSONL，fsync），
+    下次启动时先回放溢出文件。
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        models: list,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        max_buffer: int = 50000,
+        spill_path: str = "data/risk_audit_spill.jsonl"
+    ):
+        self.session_factory = session_factory
+        self.models = {model.__tablename__: model for model in models}
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.spill_path = spill_path
+        self._buffers: Dict[str, List[dict]] = {table: [] for table in self.models}
+        self._buffered = 0
+        self._spill_lock = threading.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def submit(self, model, row: dict):
+        self.submit_many(model, [row])
+
+    def submit_many(self, model, rows: List[dict]):
+        """追加待写入的行，不等待写库"""
+        if not rows:
+            return
+
+        table = model.__tablename__
+        if self._buffered + len(rows) > self.max_buffer:
+            # 数据库长时间写不进去时不再占用内存，直接落盘
+            self._spill({table: rows})
+            return
+
+        self._buffers[table].extend(rows)
+        self._buffered += len(rows)
+        AUDIT_BUFFERED.set(self._buffered)
+
+        if self._buffered >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(self):
+        """回放上次遗留的溢出文件并启动后台写入任务"""
+        self._wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.replay_spill)
+        except Exception as e:
+            print(f"回放审计溢出文件失败: {e}")
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """停止后台任务，最后写一次库；仍未写入的行落盘"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        batch = self._take()
+        if batch:
+            await asyncio.get_running_loop().run_in_executor(None, self._write_or_spill, batch)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            batch = self._take()
+            if batch:
+                await loop.run_in_executor(None, self._write_or_spill, batch)
+
+    def _take(self) -> Dict[str, List[dict]]:
+        """取出当前缓冲区的全部行（只在事件循环线程调用）"""
+        batch = {table: rows for table, rows in self._buffers.items() if rows}
+        self._buffers = {table: [] for table in self.models}
+        self._buffered = 0
+        AUDIT_BUFFERED.set(0)
+        return batch
+
+    def _chunks(self, rows: List[dict]):
+        """按列集合分组后切块：多行 VALUES 要求每行的列相同"""
+        groups: Dict[tuple, List[dict]] = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        for group in groups.values():
+            for start in range(0, len(group), self.batch_size):
+                yield group[start:start + self.batch_size]
+
+    def _write(self, batch: Dict[str, List[dict]]):
+        """一个事务内按表多行插入
+
+        每块渲染成一条 INSERT ... VALUES (...), (...)，一次往返写入整块；
+        传参列表给 execute 会退化成驱动的 executemany，逐行往返。
+        """
+        with self.session_factory() as db:
+            for table, rows in batch.items():
+                model = self.models[table]
+                for chunk in self._chunks(rows):
+                    db.execute(insert(model).values(chunk))
+            db.commit()
+
+        for table, rows in batch.items():
+            AUDIT_WRITTEN.labels(table=table).inc(len(rows))
+
+    def _write_or_spill(self, batch: Dict[str, List[dict]]):
+        try:
+            self._write(batch)
+        except Exception as e:
+            print(f"审计记录写库失败，写入溢出文件: {e}")
+            self._spill(batch)
+
+    def _spill(self, batch: Dict[str, List[dict]]):
+        """追加到溢出文件并落盘"""
+        directory = os.path.dirname(self.spill_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._spill_lock:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                for table, rows in batch.items():
+                    for row in rows:
+                        f.write(json.dumps({"table": table, "row": row}, ensure_ascii=False, default=str) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+        for table, rows in batch.items():
+            AUDIT_SPILLED.labels(table=table).inc(len(rows))
+
+    def replay_spill(self) -> int:
+        """把溢出文件中的行写入数据库，成功后删除文件，返回回放的行数"""
+        replay_path = self.spill_path + ".replay"
+        with self._spill_lock:
+            # 先移到回放文件，回放期间新溢出的行写入新文件；上次回放中断留下的回放文件一并处理
+            if os.path.exists(self.spill_path):
+                if os.path.exists(replay_path):
+                    with open(self.spill_path, encoding="utf-8") as src, open(replay_path, "a", encoding="utf-8") as dst:
+                        dst.write(src.read())
+                        dst.flush()
+                        os.fsync(dst.fileno())
+                    os.remove(self.spill_path)
+                else:
+                    os.replace(self.spill_path, replay_path)
+            elif not os.path.exists(replay_path):
+                return 0
+
+        batch: Dict[str, List[dict]] = {}
+        with open(replay_path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                row = record["row"]
+                for field in DATETIME_FIELDS:
+                    if row.get(field):
+                        row[field] = datetime.fromisoformat(row[field])
+                batch.setdefault(record["table"], []).append(row)
+
+        try:
+            self._write(batch)
+        except Exception:
+            # 放回去等下次启动
+            self._spill(batch)
+            os.remove(replay_path)
+            raise
+
+        os.remove(replay_path)
+        replayed = sum(len(rows) for rows in batch.values())
+        if replayed:
+            print(f"已回放 {replayed} 条审计溢出记录")
+        return replayed
@@ -0,0 +1,24 @@
+# 后台周期任务
+
+import threading
+from typing import Callable
+
+
+class PeriodicTask(threading.Thread):
+    """后台线程，按固定间隔执行同步任务；任务异常只打印，不中断后续执行"""
+
+    def __init__(self, name: str, interval: float, task: Callable[[], None]):
+        super().__init__(name=name, daemon=True)
+        self.interval = interval
+        self.task = task
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.task()
+            except Exception as e:
+                print(f"后台任务 {self.name} 执行失败: {e}")
+
+    def stop(self):
+        self._stop_event.set()
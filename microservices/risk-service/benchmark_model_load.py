@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+风控模型加载基准
+对比普通加载与内存映射加载的耗时，以及多个 worker 同时加载后每个进程的内存占用
+
+sklearn 树模型反序列化时会把节点数组复制到 Tree 对象自己分配的内存里，
+内存映射加载的页面在复制后不再被引用，两种方式下每个 worker 的私有内存都约等于模型大小。
+按「私有」一列估算推理进程池的内存：workers × 私有内存。
+
+用法:
+    python benchmark_model_load.py --estimators 300 --workers 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+
+from model_store import FEATURE_NAMES, save_model_artifact, load_model_artifact
+
+
+def read_memory_kb() -> dict:
+    """读取当前进程的 RSS / PSS / 私有内存（KB）"""
+    fields = {"Rss": 0, "Pss": 0, "Private_Clean": 0, "Private_Dirty": 0}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in fields:
+                fields[name] = int(value.split()[0])
+    return {
+        "rss": fields["Rss"],
+        "pss": fields["Pss"],
+        "private": fields["Private_Clean"] + fields["Private_Dirty"],
+    }
+
+
+def worker(model_dir, version, mmap_mode, sample, barrier, results):
+    baseline = read_memory_kb()
+
+    start = time.perf_counter()
+    bundle = load_model_artifact(model_dir, version, mmap_mode=mmap_mode)
+    load_seconds = time.perf_counter() - start
+
+    # 做一次预测，确保模型页已被实际访问
+    bundle.predict_proba(sample)
+
+    # 所有 worker 都加载完成后再统计，PSS 反映真正被共享的部分（解释器与依赖库）
+    barrier.wait()
+    memory = read_memory_kb()
+    results.put({
+        "load_ms": load_seconds * 1000,
+        "rss_mb": (memory["rss"] - baseline["rss"]) / 1024,
+        "pss_mb": (memory["pss"] - baseline["pss"]) / 1024,
+        "private_mb": (memory["private"] - baseline["private"]) / 1024,
+    })
+    barrier.wait()
+
+
+def run(model_dir, version, mmap_mode, workers, sample) -> list:
+    barrier = multiprocessing.Barrier(workers)
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=worker,
+            args=(model_dir, version, mmap_mode, sample, barrier, results)
+        )
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return collected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="风控模型加载与内存基准")
+    parser.add_argument("--estimators", type=int, default=300, help="随机森林树数量")
+    parser.add_argument("--rows", type=int, default=50000, help="训练样本数")
+    parser.add_argument("--workers", type=int, default=4, help="并发 worker 进程数")
+    args = parser.parse_args()
+
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        print("❌ 需要 Linux /proc/self/smaps_rollup 统计内存")
+        sys.exit(1)
+
+    rng = np.random.default_rng(42)
+    features = rng.normal(size=(args.rows, len(FEATURE_NAMES)))
+    labels = (features[:, 0] + rng.normal(size=args.rows) > 0).astype(int)
+
+    print(f"🚀 训练随机森林（{args.estimators} 棵树，{args.rows} 条样本）...")
+    model = RandomForestClassifier(n_estimators=args.estimators, random_state=42, n_jobs=-1)
+    model.fit(features, labels)
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        version_dir = save_model_artifact(model, model_dir, "benchmark")
+        size_mb = os.path.getsize(os.path.join(version_dir, "model.joblib")) / 1024 / 1024
+        print(f"📦 模型工件大小: {size_mb:.1f} MB")
+
+        sample = features[:100]
+        for label, mmap_mode in (("普通加载", None), ("内存映射", "r")):
+            results = run(model_dir, "benchmark", mmap_mode, args.workers, sample)
+            average = {
+                key: sum(r[key] for r in results) / len(results)
+                for key in results[0]
+            }
+            print(
+                f"{label}: 加载 {average['load_ms']:.0f} ms/worker, "
+                f"RSS {average['rss_mb']:.1f} MB, "
+                f"PSS {average['pss_mb']:.1f} MB, "
+                f"私有 {average['private_mb']:.1f} MB"
+            )
+        print(f"💡 推理进程池预计占用模型内存: {args.workers} × 私有内存（每个 worker 各一份模型副本）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# 黑名单内存索引
+
+import heapq
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from shared.models.risk import Blacklist
+
+
+class BlacklistIndex:
+    """进程内的有效黑名单：user_id -> {条目ID: 过期时间}
+
+    启动时全量加载有效条目，之后按 updated_at 增量同步；
+    查询只读内存，过期条目在查询时判定，并由过期堆定期清理。
+    """
+
+    def __init__(self, sync_overlap: float = 5.0):
+        # 各实例写入 updated_at 的时钟可能有偏差，增量同步多回看一段时间
+        self.sync_overlap = timedelta(seconds=sync_overlap)
+        self._users: Dict[int, Dict[int, Optional[datetime]]] = {}
+        self._entry_users: Dict[int, int] = {}
+        self._expiry_heap: List[tuple] = []
+        self._watermark: Optional[datetime] = None
+        self._lock = threading.Lock()
+        self.ready = False
+        self.synced_at: Optional[datetime] = None
+
+    def contains(self, user_id: int, now: Optional[datetime] = None) -> bool:
+        """用户是否在有效黑名单中"""
+        entries = self._users.get(user_id)
+        if not entries:
+            return False
+        now = now or datetime.utcnow()
+        return any(expires_at is None or expires_at > now for expires_at in entries.values())
+
+    def blacklisted_among(self, user_ids: Iterable[int]) -> Set[int]:
+        """给定用户中在有效黑名单内的用户ID"""
+        now = datetime.utcnow()
+        return {user_id for user_id in user_ids if self.contains(user_id, now)}
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def apply(self, entry: Blacklist, now: Optional[datetime] = None):
+        """按一条黑名单记录的当前状态更新索引（重复应用无副作用）"""
+        now = now or datetime.utcnow()
+        with self._lock:
+            if entry.is_active and (entry.expires_at is None or entry.expires_at > now):
+                self._put(entry.id, entry.user_id, entry.expires_at)
+            else:
+                self._discard(entry.id)
+
+    def rebuild(self, db: Session):
+        """全量加载有效黑名单"""
+        now = datetime.utcnow()
+        watermark = db.query(func.max(Blacklist.updated_at)).scalar()
+        entries = db.query(Blacklist).filter(
+            Blacklist.is_active == True,
+            (Blacklist.expires_at.is_(None)) | (Blacklist.expires_at > now)
+        ).all()
+
+        with self._lock:
+            self._users = {}
+            self._entry_users = {}
+            self._expiry_heap = []
+            for entry in entries:
+                self._put(entry.id, entry.user_id, entry.expires_at)
+            self._watermark = watermark
+            self.ready = True
+            self.synced_at = now
+
+    def sync(self, db: Session) -> int:
+        """增量同步上次同步以来变更的条目，返回处理的条目数"""
+        if not self.ready:
+            self.rebuild(db)
+            return len(self._entry_users)
+
+        now = datetime.utcnow()
+        query = db.query(Blacklist)
+        if self._watermark is not None:
+            query = query.filter(Blacklist.updated_at >= self._watermark - self.sync_overlap)
+        entries = query.order_by(Blacklist.updated_at).all()
+
+        for entry in entries:
+            self.apply(entry, now)
+
+        with self._lock:
+            if entries and entries[-1].updated_at is not None:
+                self._watermark = max(self._watermark or entries[-1].updated_at, entries[-1].updated_at)
+            self._prune_expired(now)
+            self.synced_at = now
+
+        return len(entries)
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "users": len(self._users),
+            "entries": len(self._entry_users),
+            "watermark": self._watermark.isoformat() if self._watermark else None,
+            "synced_at": self.synced_at.isoformat() if self.synced_at else None,
+        }
+
+    def _put(self, entry_id: int, user_id: int, expires_at: Optional[datetime]):
+        # 条目所属用户变化时先移除旧映射
+        previous_user = self._entry_users.get(entry_id)
+        if previous_user is not None and previous_user != user_id:
+            self._discard(entry_id)
+
+        # 读路径不加锁，内层字典整体替换而不是原地修改
+        entries = dict(self._users.get(user_id, {}))
+        entries[entry_id] = expires_at
+        self._users[user_id] = entries
+        self._entry_users[entry_id] = user_id
+
+        if expires_at is not None:
+            heapq.heappush(self._expiry_heap, (expires_at, entry_id))
+
+    def _discard(self, entry_id: int):
+        user_id = self._entry_users.pop(entry_id, None)
+        if user_id is None:
+            return
+
+        entries = dict(self._users.get(user_id, {}))
+        entries.pop(entry_id, None)
+        if entries:
+            self._users[user_id] = entries
+        else:
+            self._users.pop(user_id, None)
+
+    def _prune_expired(self, now: datetime):
+        """从过期堆中移除已过期的条目"""
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            expires_at, entry_id = heapq.heappop(heap)
+            user_id = self._entry_users.get(entry_id)
+            # 堆中可能是条目更新前的旧过期时间
+            if user_id is not None and self._users[user_id].get(entry_id) == expires_at:
+                self._discard(entry_id)
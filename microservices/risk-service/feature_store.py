@@ -0,0 +1,154 @@
+# 用户特征存储
+
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from shared.models.risk import UserFeatureEvent
+from model_store import FEATURE_NAMES
+
+
+# 按用户缓存的特征，评估时再拼上本次贷款金额
+USER_FEATURES = tuple(name for name in FEATURE_NAMES if name != "loan_amount")
+
+# 来源服务未提供的特征取默认值
+FEATURE_DEFAULTS = {
+    "credit_score": 700.0,
+    "monthly_income": 0.0,
+    "total_borrowed": 0.0,
+    "pending_repay": 0.0,
+}
+
+# 每个特征只有一个来源：用户服务的 total_borrowed 等列无人维护，借款汇总只认贷款服务
+FEATURE_SOURCES = {
+    "user_service": ("credit_score", "monthly_income"),
+    "loan_service": ("total_borrowed", "pending_repay"),
+}
+
+
+class FeatureUnavailable(Exception):
+    """回源后仍缺少某个来源维护的特征"""
+
+
+def owned_features(source: str, features: Dict[str, Optional[float]]) -> Dict[str, Optional[float]]:
+    """只保留由该来源维护的特征，未知来源的事件不更新任何特征"""
+    owned = FEATURE_SOURCES.get(source, ())
+    return {name: value for name, value in features.items() if name in owned}
+
+
+def features_from_response(source: str, payload: dict) -> Dict[str, float]:
+    """从来源服务的回源响应提取它维护的特征，缺失的取默认值"""
+    return {
+        name: float(payload.get(name) if payload.get(name) is not None else FEATURE_DEFAULTS[name])
+        for name in FEATURE_SOURCES[source]
+    }
+
+
+def fold_events(events: Iterable[Tuple[datetime, dict]]) -> Tuple[Dict[str, float], Optional[datetime]]:
+    """按时间顺序合并事件中的特征，后发生的覆盖先发生的"""
+    features = dict(FEATURE_DEFAULTS)
+    as_of = None
+    for event_time, values in sorted(events, key=lambda event: event[0]):
+        for name, value in values.items():
+            if name in features and value is not None:
+                features[name] = float(value)
+        as_of = event_time
+    return features, as_of
+
+
+class FeatureStore:
+    """用户特征向量缓存：一个 float64 矩阵按行存放各用户的特征
+
+    user_id -> 行号 的映射放在字典里，容量不足时矩阵按倍数扩容。
+    每个特征单独记录最后一次更新的事件时间，不同来源的事件互不覆盖、各自按时间排序；
+    最旧的特征超过 max_age 时整行视为过期，由调用方重新加载；有特征从未收到过的行也不可用。
+    """
+
+    def __init__(self, capacity: int = 65536):
+        self._rows: Dict[int, int] = {}
+        self._values = np.zeros((capacity, len(USER_FEATURES)), dtype=np.float64)
+        # 0 表示该特征尚未收到过
+        self._updated_at = np.zeros((capacity, len(USER_FEATURES)), dtype=np.float64)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _row_for(self, user_id: int) -> int:
+        row = self._rows.get(user_id)
+        if row is not None:
+            return row
+
+        row = len(self._rows)
+        if row >= len(self._values):
+            size = len(self._values) * 2
+            values = np.zeros((size, len(USER_FEATURES)), dtype=np.float64)
+            values[:row] = self._values[:row]
+            updated_at = np.zeros((size, len(USER_FEATURES)), dtype=np.float64)
+            updated_at[:row] = self._updated_at[:row]
+            self._values, self._updated_at = values, updated_at
+
+        self._values[row] = [FEATURE_DEFAULTS[name] for name in USER_FEATURES]
+        self._rows[user_id] = row
+        return row
+
+    def update(self, user_id: int, features: Dict[str, float], event_time: Optional[float] = None) -> bool:
+        """写入一个用户的部分或全部特征；每个特征只接受不早于其当前值的事件，返回是否有特征写入"""
+        event_time = event_time or time.time()
+        applied = False
+        with self._lock:
+            row = self._row_for(user_id)
+            for name, value in features.items():
+                if name not in USER_FEATURES or value is None:
+                    continue
+                column = USER_FEATURES.index(name)
+                if event_time < self._updated_at[row, column]:
+                    continue
+                self._values[row, column] = float(value)
+                self._updated_at[row, column] = event_time
+                applied = True
+        return applied
+
+    def get(self, user_id: int, max_age: float) -> Optional[np.ndarray]:
+        """未过期时返回该用户的特征向量副本"""
+        matrix, fresh = self.get_many([user_id], max_age)
+        return matrix[0] if fresh[0] else None
+
+    def get_many(self, user_ids: List[int], max_age: float) -> Tuple[np.ndarray, np.ndarray]:
+        """批量读取特征矩阵与每行是否新鲜的掩码"""
+        now = time.time()
+        with self._lock:
+            rows = np.array([self._rows.get(user_id, -1) for user_id in user_ids], dtype=np.int64)
+            present = rows >= 0
+            safe_rows = np.where(present, rows, 0)
+            matrix = self._values[safe_rows].copy()
+            oldest = self._updated_at[safe_rows].min(axis=1)
+            fresh = present & (oldest > 0) & (now - oldest <= max_age)
+        return matrix, fresh
+
+    def age(self, user_id: int) -> Optional[float]:
+        """该用户最旧的特征距其最后更新的秒数"""
+        with self._lock:
+            row = self._rows.get(user_id)
+            return None if row is None else time.time() - float(self._updated_at[row].min())
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._rows),
+            "capacity": len(self._values),
+            "features": list(USER_FEATURES),
+            "memory_bytes": int(self._values.nbytes + self._updated_at.nbytes),
+        }
+
+
+def features_as_of(db: Session, user_id: int, as_of: datetime) -> Tuple[Dict[str, float], Optional[datetime]]:
+    """按事件日志重建用户在某一时刻的特征（离线分析用）"""
+    events = db.query(UserFeatureEvent.event_time, UserFeatureEvent.features).filter(
+        UserFeatureEvent.user_id == user_id,
+        UserFeatureEvent.event_time <= as_of
+    ).order_by(UserFeatureEvent.event_time).all()
+    return fold_events((event.event_time, event.features) for event in events)
@@ -0,0 +1,186 @@
+# 风控推理调度
+
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+import numpy as np
+from prometheus_client import Counter, Gauge, Histogram
+
+from model_store import load_model_artifact
+
+
+# Prometheus指标
+INFERENCE_QUEUE_DEPTH = Gauge('risk_inference_queue_depth', 'In-flight model inference tasks')
+INFERENCE_SECONDS = Histogram('risk_inference_seconds', 'Model inference latency including queueing')
+INFERENCE_BATCH_SIZE = Histogram(
+    'risk_inference_batch_size', 'Rows per model inference call',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+)
+INFERENCE_REJECTED = Counter('risk_inference_rejected_total', 'Rejected model inference tasks', ['reason'])
+
+
+class MicroBatcher:
+    """把短时间窗口内的并发单条评分请求合并成一次向量化推理
+
+    第一条请求到达后最多等待 window 秒，或攒满 max_batch_size 条立即推理。
+    """
+
+    def __init__(
+        self,
+        score_batch: Callable[[np.ndarray], Awaitable[np.ndarray]],
+        window: float = 0.005,
+        max_batch_size: int = 256
+    ):
+        self.score_batch = score_batch
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._pending: List[Tuple[np.ndarray, asyncio.Future]] = []
+        self._timer = None
+
+    async def score(self, row: np.ndarray) -> float:
+        """提交一行特征，返回该行评分"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((row, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[np.ndarray, asyncio.Future]]):
+        try:
+            scores = await self.score_batch(np.vstack([row for row, _ in batch]))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), score in zip(batch, scores):
+            if not future.done():
+                future.set_result(float(score))
+
+
+# 工作进程内缓存的模型（冠军与挑战者），按版本号懒加载；
+# 每个工作进程各持有一份模型副本，内存按 workers × 模型大小估算
+_WORKER_CACHE_SIZE = 4
+_worker_bundles = OrderedDict()
+
+
+def _worker_bundle(model_dir: str, version: str):
+    bundle = _worker_bundles.get(version)
+    if bundle is None:
+        bundle = load_model_artifact(model_dir, version)
+        _worker_bundles[version] = bundle
+        while len(_worker_bundles) > _WORKER_CACHE_SIZE:
+            _worker_bundles.popitem(last=False)
+    else:
+        _worker_bundles.move_to_end(version)
+    return bundle
+
+
+def _score_in_worker(model_dir: str, version: str, features: np.ndarray) -> np.ndarray:
+    return _worker_bundle(model_dir, version).predict_proba(features)
+
+
+def _warm_up_worker(model_dir: str, version: str):
+    _worker_bundle(model_dir, version)
+
+
+def _lower_priority(increment: int):
+    os.nice(increment)
+
+
+class InferenceOverloaded(Exception):
+    """推理队列已满"""
+
+
+class InferenceExecutor:
+    """在工作进程池中执行模型推理，避免阻塞事件循环
+
+    同时在途的推理任务数有上限，超过上限立即拒绝；每个任务有截止时间，
+    超时后未开始的任务会被取消。
+    """
+
+    def __init__(self, model_dir: str, workers: int = 2, max_pending: int = 64, nice: int = 0):
+        self.model_dir = model_dir
+        self.workers = workers
+        self.max_pending = max_pending
+        # 工作进程的调度优先级增量，影子评分等后台推理用正值让出CPU
+        self.nice = nice
+        self._pool = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def start(self, version: Optional[str] = None):
+        """启动进程池，并在每个工作进程中预加载当前模型"""
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_lower_priority if self.nice > 0 else None,
+            initargs=(self.nice,) if self.nice > 0 else ()
+        )
+        if version:
+            self.warm_up(version)
+
+    def warm_up(self, version: str):
+        """在工作进程中预加载指定版本的模型"""
+        for _ in range(self.workers):
+            self._pool.submit(_warm_up_worker, self.model_dir, version)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def score(self, version: str, features: np.ndarray, timeout: Optional[float] = None) -> np.ndarray:
+        """在工作进程中用指定版本的模型评分"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                INFERENCE_REJECTED.labels(reason="overloaded").inc()
+                raise InferenceOverloaded(f"推理队列已满（{self._pending}）")
+            self._pending += 1
+            INFERENCE_QUEUE_DEPTH.set(self._pending)
+
+        start = time.perf_counter()
+        future = self._pool.submit(_score_in_worker, self.model_dir, version, features)
+        # 任务真正结束（包括超时后仍在执行的）才释放名额
+        future.add_done_callback(self._release)
+
+        try:
+            scores = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            INFERENCE_REJECTED.labels(reason="timeout").inc()
+            raise
+
+        INFERENCE_SECONDS.observe(time.perf_counter() - start)
+        INFERENCE_BATCH_SIZE.observe(len(features))
+        return scores
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+            INFERENCE_QUEUE_DEPTH.set(self._pending)
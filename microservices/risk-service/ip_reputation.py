@@ -0,0 +1,236 @@
+# IP信誉库
+
+import csv
+import ipaddress
+import os
+import threading
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from shared.models.risk import IpReputation
+
+
+class IpRange:
+    """一个网段的信誉信息"""
+
+    __slots__ = ("network", "score", "category", "asn", "source")
+
+    def __init__(self, network: str, score: float, category: Optional[str] = None,
+                 asn: Optional[int] = None, source: Optional[str] = None):
+        self.network = network
+        self.score = score
+        self.category = category
+        self.asn = asn
+        self.source = source
+
+    def info(self) -> dict:
+        return {
+            "network": self.network,
+            "score": self.score,
+            "category": self.category,
+            "asn": self.asn,
+            "source": self.source,
+        }
+
+
+class _Node:
+    __slots__ = ("key", "length", "entry", "children")
+
+    def __init__(self, key: int, length: int, entry: Optional[IpRange] = None):
+        self.key = key
+        self.length = length
+        self.entry = entry
+        self.children = [None, None]
+
+
+class PrefixTrie:
+    """路径压缩的二进制前缀树，做最长前缀匹配
+
+    每个节点保存从根开始的完整前缀（左对齐的整数 + 位数），只有分叉点和
+    带数据的网段才有节点，查找深度不超过分叉点数量。
+    """
+
+    def __init__(self, width: int):
+        self.width = width
+        self.root = _Node(0, 0)
+        self.size = 0
+
+    def _bit(self, key: int, index: int) -> int:
+        return (key >> (self.width - 1 - index)) & 1
+
+    def _mask(self, key: int, length: int) -> int:
+        return key & ~((1 << (self.width - length)) - 1)
+
+    def _common_length(self, a: int, b: int, limit: int) -> int:
+        diff = a ^ b
+        if diff == 0:
+            return limit
+        return min(self.width - diff.bit_length(), limit)
+
+    def insert(self, key: int, length: int, entry: IpRange):
+        """插入网段，相同网段后插入的覆盖先插入的"""
+        key = self._mask(key, length)
+        node = self.root
+
+        while True:
+            if node.length == length:
+                if node.entry is None:
+                    self.size += 1
+                node.entry = entry
+                return
+
+            branch = self._bit(key, node.length)
+            child = node.children[branch]
+            if child is None:
+                node.children[branch] = _Node(key, length, entry)
+                self.size += 1
+                return
+
+            common = self._common_length(key, child.key, min(length, child.length))
+            if common == child.length:
+                node = child
+                continue
+
+            # 在分歧位置拆出中间节点
+            middle = _Node(self._mask(key, common), common)
+            node.children[branch] = middle
+            middle.children[self._bit(child.key, common)] = child
+            if common == length:
+                middle.entry = entry
+            else:
+                middle.children[self._bit(key, common)] = _Node(key, length, entry)
+            self.size += 1
+            return
+
+    def lookup(self, address: int) -> Optional[IpRange]:
+        """返回包含该地址的最长网段"""
+        width = self.width
+        node = self.root
+        best = node.entry
+
+        while node.length < width:
+            child = node.children[(address >> (width - 1 - node.length)) & 1]
+            if child is None or (address ^ child.key) >> (width - child.length):
+                break
+            node = child
+            if node.entry is not None:
+                best = node.entry
+
+        return best
+
+
+def parse_address(ip_address: str) -> Optional[Tuple[int, int]]:
+    """解析IP地址为 (版本, 整数)，IPv4映射的IPv6地址按IPv4处理；非法地址返回None"""
+    try:
+        address = ipaddress.ip_address(ip_address.strip())
+    except (AttributeError, ValueError):
+        return None
+
+    if address.version == 6 and address.ipv4_mapped is not None:
+        address = address.ipv4_mapped
+    return address.version, int(address)
+
+
+class IpReputationTable:
+    """构建完成后只读的IPv4/IPv6信誉前缀树"""
+
+    def __init__(self, ranges: Iterable[IpRange], source: str):
+        self.tries = {4: PrefixTrie(32), 6: PrefixTrie(128)}
+        for item in ranges:
+            network = ipaddress.ip_network(item.network, strict=False)
+            item.network = str(network)
+            self.tries[network.version].insert(int(network.network_address), network.prefixlen, item)
+        self.source = source
+        self.loaded_at = datetime.utcnow()
+
+    def lookup(self, ip_address: str) -> Optional[IpRange]:
+        parsed = parse_address(ip_address)
+        if parsed is None:
+            return None
+        version, address = parsed
+        return self.tries[version].lookup(address)
+
+    def lookup_many(self, ip_addresses: Iterable[str]) -> List[Optional[IpRange]]:
+        return [self.lookup(ip_address) for ip_address in ip_addresses]
+
+    def stats(self) -> dict:
+        return {
+            "source": self.source,
+            "ipv4_ranges": self.tries[4].size,
+            "ipv6_ranges": self.tries[6].size,
+            "loaded_at": self.loaded_at.isoformat(),
+        }
+
+
+def load_ranges_from_file(path: str) -> List[IpRange]:
+    """读取CSV信誉文件
+
+    每行: network,score[,category[,asn]]，# 开头为注释，可带表头行
+    """
+    ranges = []
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith("#") or row[0].strip() == "network":
+                continue
+            network, score = row[0].strip(), float(row[1])
+            category = (row[2].strip() or None) if len(row) > 2 else None
+            asn = int(row[3]) if len(row) > 3 and row[3].strip() else None
+            ranges.append(IpRange(network, score, category, asn, source="file"))
+    return ranges
+
+
+def load_ranges_from_db(db: Session) -> List[IpRange]:
+    """读取数据库中启用的信誉网段"""
+    rows = db.query(IpReputation).filter(IpReputation.is_active == True).all()
+    return [
+        IpRange(row.network, float(row.score), row.category, row.asn, source=row.source or "database")
+        for row in rows
+    ]
+
+
+class IpReputationService:
+    """持有当前信誉表；文件或数据库变化时后台重建，构建成功后整体替换引用"""
+
+    def __init__(self, file_path: str = ""):
+        self.file_path = file_path
+        self.table = IpReputationTable([], source="empty")
+        self._change_marker = None
+        self._lock = threading.Lock()
+
+    def lookup(self, ip_address: str) -> Optional[IpRange]:
+        return self.table.lookup(ip_address)
+
+    def lookup_many(self, ip_addresses: Iterable[str]) -> List[Optional[IpRange]]:
+        return self.table.lookup_many(ip_addresses)
+
+    def _file_marker(self):
+        if not self.file_path or not os.path.exists(self.file_path):
+            return None
+        stat = os.stat(self.file_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def reload(self, db: Session, force: bool = False) -> bool:
+        """文件或数据库有变化时重建信誉表，返回是否重建"""
+        marker = (
+            self._file_marker(),
+            tuple(db.query(func.count(IpReputation.id), func.max(IpReputation.updated_at)).one())
+        )
+
+        with self._lock:
+            if not force and marker == self._change_marker:
+                return False
+
+            ranges, sources = [], []
+            if marker[0] is not None:
+                ranges.extend(load_ranges_from_file(self.file_path))
+                sources.append(self.file_path)
+            # 数据库中的网段覆盖文件中的同一网段
+            ranges.extend(load_ranges_from_db(db))
+            sources.append("database")
+
+            self.table = IpReputationTable(ranges, source="+".join(sources))
+            self._change_marker = marker
+            return True
@@ -1,26 +1,40 @@
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import Response
 from sqlalchemy.orm import Session
 from typing import List, Optional, Dict, Any
 import sys
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import httpx
+import redis.asyncio
 import pandas as pd
 import numpy as np
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.preprocessing import StandardScaler
-import joblib
+import threading
+import asyncio
 import json
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 
 # 添加共享模块路径
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'shared'))
 
 from shared.config.settings import settings
-from shared.utils.database import get_db_session
-from shared.utils.auth import verify_token
-from shared.models.risk import Blacklist, RiskAssessment, FraudDetection, RiskRule, RiskEvent
+from shared.utils.database import get_db_session, get_database_url, create_database_engine, create_session_factory
+from shared.utils.auth import internal_headers, verify_token
+from shared.models.risk import Blacklist, RiskAssessment, FraudDetection, RiskRule, RiskEvent, UserFeatureEvent, ShadowScore
 from pydantic import BaseModel
+from inference import MicroBatcher, InferenceExecutor, InferenceOverloaded
+from model_store import ModelBundle, current_model_version, load_model_artifact, list_model_versions
+from background import PeriodicTask
+from rule_engine import RuleEngine, compile_rules
+from blacklist_index import BlacklistIndex
+from ip_reputation import IpReputationService
+from velocity import VelocityCounter
+from audit_writer import AuditWriter
+from shadow import ShadowScorer
+from feature_store import (
+    FeatureStore, FeatureUnavailable, USER_FEATURES, features_as_of, features_from_response, owned_features
+)
 
 app = FastAPI(
     title="风控服务",
@@ -46,6 +60,68 @@ class RiskAssessmentResponse(BaseModel):
     recommendations: List[str]
 
 
+class BatchAssessmentItem(BaseModel):
+    user_id: int
+    loan_amount: float
+
+
+class BatchAssessmentRequest(BaseModel):
+    applications: List[BatchAssessmentItem]
+
+
+class BatchAssessmentResult(BaseModel):
+    user_id: int
+    approved: Optional[bool] = None
+    risk_score: Optional[float] = None
+    risk_level: Optional[str] = None
+    reasons: List[str] = []
+    recommendations: List[str] = []
+    error: Optional[str] = None
+
+
+class RiskRuleRequest(BaseModel):
+    rule_name: str
+    rule_type: str
+    rule_config: Dict[str, Any]
+    priority: int = 0
+    is_active: bool = True
+
+
+class ChallengerRequest(BaseModel):
+    version: str
+    sample_rate: float = settings.risk_challenger_sample_rate
+    latency_budget_ms: float = settings.risk_challenger_latency_budget_ms
+
+
+class FeatureEvent(BaseModel):
+    user_id: int
+    features: Dict[str, Optional[float]]
+    event_time: Optional[datetime] = None
+    source: str = "unknown"
+
+
+class FeatureEventsRequest(BaseModel):
+    events: List[FeatureEvent]
+
+
+class IpLookupRequest(BaseModel):
+    ip_addresses: List[str]
+
+
+class IpLookupResult(BaseModel):
+    ip_address: str
+    matched: bool
+    network: Optional[str] = None
+    score: Optional[float] = None
+    category: Optional[str] = None
+    asn: Optional[int] = None
+    source: Optional[str] = None
+
+
+class BlacklistCheckRequest(BaseModel):
+    user_ids: List[int]
+
+
 class BlacklistEntry(BaseModel):
     user_id: int
     reason: str
@@ -77,71 +153,75 @@ def get_current_user_id(credentials: HTTPAuthorizationCredentials = Depends(secu
 
 # 风控模型
 class RiskAssessmentModel:
-    def __init__(self):
-        self.model = None
-        self.scaler = StandardScaler()
+    def __init__(self, model_dir: str = settings.risk_model_dir):
+        self.model_dir = model_dir
+        self.bundle: Optional[ModelBundle] = None
+        self._reload_lock = threading.Lock()
         self.load_model()
     
-    def load_model(self):
-        """加载预训练的风控模型"""
-        try:
-            # 这里应该加载实际的训练好的模型
-            # 为了演示，我们创建一个简单的随机森林模型
-            self.model = RandomForestClassifier(n_estimators=100, random_state=42)
-            # 在实际应用中，这里应该加载真实的模型文件
-        except Exception as e:
-            print(f"模型加载失败: {e}")
-            self.model = None
+    @property
+    def model(self):
+        bundle = self.bundle
+        return bundle.model if bundle else None
+    
+    @property
+    def version(self) -> str:
+        """当前冠军模型版本，未加载模型时为规则引擎"""
+        bundle = self.bundle
+        return bundle.version if bundle else "rules"
+    
+    def load_model(self, version: Optional[str] = None) -> bool:
+        """加载预训练的风控模型工件（默认为当前版本）
+
+        新版本加载并校验成功后才替换引用，失败时继续使用原模型；
+        正在处理的请求持有旧版本引用，不受切换影响。
+        """
+        with self._reload_lock:
+            version = version or current_model_version(self.model_dir)
+            if not version:
+                print(f"未找到模型工件 {self.model_dir}，使用规则引擎")
+                return False
+            
+            if self.bundle and self.bundle.version == version:
+                return True
+            
+            try:
+                bundle = load_model_artifact(self.model_dir, version)
+            except Exception as e:
+                print(f"模型加载失败: {e}")
+                return False
+            
+            self.bundle = bundle
+            print(f"模型版本 {version} 已加载")
+            return True
     
     def predict_risk(self, features: np.ndarray) -> tuple:
         """预测风险"""
-        if self.model is None:
+        risk_score = float(self.score_batch(features)[0])
+        return risk_score, self.get_risk_level(risk_score)
+    
+    def score_batch(self, features: np.ndarray) -> np.ndarray:
+        """对特征矩阵（每行一个申请）做一次向量化评分"""
+        bundle = self.bundle
+        if bundle is None:
             # 如果没有模型，使用规则引擎
-            return self.rule_based_assessment(features)
+            return self.rule_based_scores(features)
         
         try:
             # 使用机器学习模型预测
-            risk_score = self.model.predict_proba(features)[0][1]
-            return risk_score, self.get_risk_level(risk_score)
-        except Exception:
-            return self.rule_based_assessment(features)
+            return bundle.predict_proba(features)
+        except Exception as e:
+            print(f"模型预测失败: {e}")
+            return self.rule_based_scores(features)
     
     def rule_based_assessment(self, features: np.ndarray) -> tuple:
         """基于规则的评估"""
-        # 简化的规则引擎
-        risk_score = 0.0
-        reasons = []
-        
-        # 贷款金额风险
-        loan_amount = features[0] if len(features) > 0 else 0
-        if loan_amount > 100000:
-            risk_score += 0.3
-            reasons.append("贷款金额过高")
-        elif loan_amount > 50000:
-            risk_score += 0.1
-            reasons.append("贷款金额较高")
-        
-        # 信用分风险
-        credit_score = features[1] if len(features) > 1 else 700
-        if credit_score < 550:
-            risk_score += 0.4
-            reasons.append("信用分过低")
-        elif credit_score < 650:
-            risk_score += 0.2
-            reasons.append("信用分偏低")
-        
-        # 收入风险
-        monthly_income = features[2] if len(features) > 2 else 0
-        if monthly_income > 0 and loan_amount > 0:
-            debt_to_income = loan_amount / (monthly_income * 12)
-            if debt_to_income > 0.5:
-                risk_score += 0.3
-                reasons.append("负债收入比过高")
-            elif debt_to_income > 0.3:
-                risk_score += 0.1
-                reasons.append("负债收入比偏高")
-        
-        return min(risk_score, 1.0), self.get_risk_level(risk_score)
+        risk_score = float(self.rule_based_scores(features)[0])
+        return risk_score, self.get_risk_level(risk_score)
+    
+    def rule_based_scores(self, features: np.ndarray) -> np.ndarray:
+        """基于规则的向量化评分（规则来自 RiskRule 表）"""
+        return rule_engine.evaluate(features).scores
     
     def get_risk_level(self, risk_score: float) -> str:
         """获取风险等级"""
@@ -167,15 +247,16 @@ class FraudDetectionModel:
             "behavior_anomaly": 0.5,  # 行为异常
         }
     
-    def detect_fraud(self, request: FraudDetectionRequest) -> FraudDetectionResponse:
+    async def detect_fraud(self, request: FraudDetectionRequest) -> FraudDetectionResponse:
         """检测欺诈"""
         fraud_score = 0.0
         risk_factors = []
         
-        # 检查IP地址
-        if self.is_suspicious_ip(request.ip_address):
-            fraud_score += self.suspicious_patterns["unusual_ip"]
-            risk_factors.append("异常IP地址")
+        # 检查IP地址：按命中网段的信誉分加权
+        ip_range = ip_reputation.lookup(request.ip_address)
+        if ip_range and ip_range.score >= settings.risk_ip_suspicious_score:
+            fraud_score += self.suspicious_patterns["unusual_ip"] * ip_range.score
+            risk_factors.append(f"异常IP地址（{ip_range.category}）" if ip_range.category else "异常IP地址")
         
         # 检查设备指纹
         if self.is_device_suspicious(request.device_fingerprint):
@@ -189,7 +270,7 @@ class FraudDetectionModel:
             risk_factors.append("行为模式异常")
         
         # 检查申请频率
-        if self.check_application_frequency(request.user_id):
+        if await self.check_application_frequency(request.user_id, request.device_fingerprint, request.ip_address):
             fraud_score += self.suspicious_patterns["rapid_applications"]
             risk_factors.append("申请频率过高")
         
@@ -204,10 +285,9 @@ class FraudDetectionModel:
         )
     
     def is_suspicious_ip(self, ip_address: str) -> bool:
-        """检查IP是否可疑"""
-        # 简化的IP检查逻辑
-        suspicious_ips = ["192.168.1.100", "10.0.0.1"]  # 示例
-        return ip_address in suspicious_ips
+        """检查IP是否可疑（最长前缀匹配IP信誉库）"""
+        ip_range = ip_reputation.lookup(ip_address)
+        return ip_range is not None and ip_range.score >= settings.risk_ip_suspicious_score
     
     def is_device_suspicious(self, device_fingerprint: str) -> bool:
         """检查设备是否可疑"""
@@ -232,11 +312,17 @@ class FraudDetectionModel:
         
         return min(score, 1.0)
     
-    def check_application_frequency(self, user_id: int) -> bool:
-        """检查申请频率"""
-        # 这里应该查询数据库检查用户的申请频率
-        # 简化处理，返回False
-        return False
+    async def check_application_frequency(
+        self,
+        user_id: int,
+        device_fingerprint: Optional[str] = None,
+        ip_address: Optional[str] = None
+    ) -> bool:
+        """记录本次申请并检查用户、设备、IP在1分钟/1小时/24小时内的申请次数"""
+        counts = await velocity_counter.record(
+            VelocityCounter.subjects(user_id, device_fingerprint, ip_address)
+        )
+        return bool(velocity_counter.exceeded(counts))
 
 
 # 黑名单管理
@@ -266,11 +352,15 @@ class BlacklistManager:
         self.db.add(blacklist_entry)
         self.db.commit()
         self.db.refresh(blacklist_entry)
+        blacklist_index.apply(blacklist_entry)
         
         return blacklist_entry
     
     def is_blacklisted(self, user_id: int) -> bool:
-        """检查是否在黑名单中"""
+        """检查是否在黑名单中（内存索引就绪时不查库）"""
+        if blacklist_index.ready:
+            return blacklist_index.contains(user_id)
+        
         now = datetime.utcnow()
         blacklist_entry = self.db.query(Blacklist).filter(
             Blacklist.user_id == user_id,
@@ -280,6 +370,23 @@ class BlacklistManager:
         
         return blacklist_entry is not None
     
+    def blacklisted_among(self, user_ids: List[int]) -> set:
+        """返回给定用户中在黑名单内的用户ID"""
+        if not user_ids:
+            return set()
+        
+        if blacklist_index.ready:
+            return blacklist_index.blacklisted_among(user_ids)
+        
+        now = datetime.utcnow()
+        rows = self.db.query(Blacklist.user_id).filter(
+            Blacklist.user_id.in_(user_ids),
+            Blacklist.is_active == True,
+            (Blacklist.expires_at.is_(None)) | (Blacklist.expires_at > now)
+        ).distinct().all()
+        
+        return {row.user_id for row in rows}
+    
     def remove_from_blacklist(self, user_id: int):
         """从黑名单移除"""
         blacklist_entries = self.db.query(Blacklist).filter(
@@ -291,6 +398,8 @@ class BlacklistManager:
             entry.is_active = False
         
         self.db.commit()
+        for entry in blacklist_entries:
+            blacklist_index.apply(entry)
     
     def get_blacklist_entries(self, limit: int = 100, offset: int = 0):
         """获取黑名单条目"""
@@ -299,9 +408,178 @@ class BlacklistManager:
         ).offset(offset).limit(limit).all()
 
 
+# 申请速度计数：Redis按桶计数，Redis不可用时退回进程内计数
+redis_client = (
+    redis.asyncio.Redis.from_url(settings.redis_url, decode_responses=True)
+    if settings.risk_velocity_backend == "redis" else None
+)
+velocity_counter = VelocityCounter(redis_client)
+
+# 后台线程（规则、黑名单同步）使用的独立连接池
+background_session_factory = create_session_factory(
+    create_database_engine(get_database_url("risk_service"))
+)
+
+# 风险评估 / 反欺诈记录的异步批量写入
+audit_writer = AuditWriter(
+    background_session_factory,
+    [RiskAssessment, FraudDetection, UserFeatureEvent, ShadowScore],
+    batch_size=settings.risk_audit_batch_size,
+    flush_interval=settings.risk_audit_flush_interval_ms / 1000,
+    max_buffer=settings.risk_audit_max_buffer,
+    spill_path=settings.risk_audit_spill_path
+)
+
+# 规则引擎：规则表变化时重新编译
+rule_engine = RuleEngine()
+
+
+def refresh_rules(force: bool = False) -> bool:
+    """规则表有变化时重新编译规则"""
+    with background_session_factory() as db:
+        return rule_engine.refresh(db, force)
+
+
+rule_watcher = PeriodicTask("rule-watcher", settings.risk_rule_poll_interval, refresh_rules)
+
+# 黑名单内存索引：后台线程按 updated_at 增量同步
+blacklist_index = BlacklistIndex()
+
+
+def sync_blacklist():
+    with background_session_factory() as db:
+        blacklist_index.sync(db)
+
+
+blacklist_syncer = PeriodicTask("blacklist-sync", settings.risk_blacklist_sync_interval, sync_blacklist)
+
+# IP信誉库：文件或数据库变化时重建前缀树
+ip_reputation = IpReputationService(settings.risk_ip_reputation_file)
+
+
+def reload_ip_reputation(force: bool = False) -> bool:
+    with background_session_factory() as db:
+        return ip_reputation.reload(db, force)
+
+
+ip_reputation_watcher = PeriodicTask(
+    "ip-reputation-watcher",
+    settings.risk_ip_reputation_poll_interval,
+    reload_ip_reputation
+)
+
 # 初始化模型
 risk_model = RiskAssessmentModel()
 fraud_model = FraudDetectionModel()
+# 轮询当前版本指针，变化时热加载
+model_watcher = PeriodicTask(
+    "model-watcher",
+    settings.risk_model_poll_interval,
+    risk_model.load_model
+)
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    """启动审计写入、规则与模型热加载、黑名单与IP信誉同步、推理进程池"""
+    await audit_writer.start()
+    try:
+        refresh_rules(force=True)
+    except Exception as e:
+        print(f"加载风控规则失败，使用默认规则: {e}")
+    rule_watcher.start()
+    try:
+        sync_blacklist()
+    except Exception as e:
+        print(f"加载黑名单索引失败，暂时直接查库: {e}")
+    blacklist_syncer.start()
+    try:
+        reload_ip_reputation(force=True)
+    except Exception as e:
+        print(f"加载IP信誉库失败: {e}")
+    ip_reputation_watcher.start()
+    model_watcher.start()
+    bundle = risk_model.bundle
+    inference_executor.start(bundle.version if bundle else None)
+    shadow_executor.start()
+    shadow_scorer.start()
+    
+    available = list_model_versions(risk_model.model_dir)
+    for version in filter(None, (v.strip() for v in settings.risk_challenger_versions.split(","))):
+        if version in available:
+            shadow_scorer.add(version, settings.risk_challenger_sample_rate, settings.risk_challenger_latency_budget_ms)
+            shadow_executor.warm_up(version)
+        else:
+            print(f"挑战者模型 {version} 不存在，跳过")
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    await audit_writer.stop()
+    rule_watcher.stop()
+    blacklist_syncer.stop()
+    ip_reputation_watcher.stop()
+    model_watcher.stop()
+    await shadow_scorer.stop()
+    if redis_client is not None:
+        await redis_client.aclose()
+    inference_executor.shutdown()
+    shadow_executor.shutdown()
+
+
+# 用户特征缓存：由用户/贷款服务推送的特征事件刷新
+feature_store = FeatureStore(settings.risk_feature_store_capacity)
+
+
+def to_utc_naive(value: Optional[datetime]) -> datetime:
+    """统一为不带时区的UTC时间"""
+    if value is None:
+        return datetime.utcnow()
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def record_feature_event(user_id: int, features: Dict[str, Optional[float]], event_time: datetime, source: str) -> bool:
+    """更新特征缓存并记录特征事件（供按时间点重建）；只采用该来源维护的特征"""
+    features = owned_features(source, features)
+    if not features:
+        return False
+    applied = feature_store.update(
+        user_id, features, event_time.replace(tzinfo=timezone.utc).timestamp()
+    )
+    audit_writer.submit(UserFeatureEvent, {
+        "user_id": user_id,
+        "source": source,
+        "features": features,
+        "event_time": event_time,
+        "created_at": datetime.utcnow()
+    })
+    return applied
+
+
+async def load_user_features(user_id: int) -> Optional[dict]:
+    """读取用户特征：缓存命中且未过期时不调用下游服务，否则分别回源用户服务与贷款服务
+
+    用户不存在时返回 None；贷款服务不可用时沿用缓存中的借款汇总，从未加载过则抛出 FeatureUnavailable。
+    """
+    row = feature_store.get(user_id, settings.risk_feature_max_age)
+    if row is not None:
+        return dict(zip(USER_FEATURES, row.tolist()))
+    
+    user_info, loan_summary = await asyncio.gather(get_user_info(user_id), get_loan_summary(user_id))
+    if not user_info:
+        return None
+    
+    fetched_at = datetime.utcnow()
+    record_feature_event(user_id, features_from_response("user_service", user_info), fetched_at, "user_service")
+    if loan_summary is not None:
+        record_feature_event(user_id, features_from_response("loan_service", loan_summary), fetched_at, "loan_service")
+    
+    row = feature_store.get(user_id, float("inf"))
+    if row is None:
+        raise FeatureUnavailable(f"用户 {user_id} 的借款汇总暂不可用")
+    return dict(zip(USER_FEATURES, row.tolist()))
 
 
 async def get_user_info(user_id: int) -> dict:
@@ -316,6 +594,146 @@ async def get_user_info(user_id: int) -> dict:
             return None
 
 
+async def get_loan_summary(user_id: int) -> Optional[dict]:
+    """从贷款服务获取用户的借款汇总，失败时返回 None"""
+    async with httpx.AsyncClient() as client:
+        try:
+            response = await client.get(
+                f"{settings.loan_service_url}/internal/users/{user_id}/loan-summary",
+                headers=internal_headers()
+            )
+            if response.status_code == 200:
+                return response.json()
+            return None
+        except Exception:
+            return None
+
+
+def build_features(loan_amount: float, user_info: dict) -> list:
+    """构造一行评估特征，列顺序与 FEATURE_NAMES 一致"""
+    return [
+        loan_amount,
+        user_info.get("credit_score", 700),
+        user_info.get("monthly_income", 0),
+        user_info.get("total_borrowed", 0),
+        user_info.get("pending_repay", 0)
+    ]
+
+
+def make_decision(risk_score: float) -> tuple:
+    """根据评分生成审批结论、原因与建议"""
+    reasons = []
+    recommendations = []
+    
+    if risk_score > 0.7:
+        reasons.append("综合风险评分过高")
+        recommendations.append("建议降低贷款金额或提供更多担保")
+    elif risk_score > 0.5:
+        reasons.append("风险评分较高")
+        recommendations.append("建议谨慎审批")
+    else:
+        reasons.append("风险评分在可接受范围内")
+        recommendations.append("可以正常审批")
+    
+    approved = risk_score < 0.6
+    return approved, reasons, recommendations
+
+
+def assessment_row(
+    user_id: int,
+    loan_amount: float,
+    user_info: dict,
+    risk_score: float,
+    risk_level: str,
+    approved: bool,
+    reasons: List[str],
+    recommendations: List[str]
+) -> dict:
+    """风险评估记录的列值"""
+    return {
+        "user_id": user_id,
+        "loan_amount": loan_amount,
+        "risk_score": risk_score,
+        "risk_level": risk_level,
+        "approved": approved,
+        "reasons": reasons,
+        "recommendations": recommendations,
+        "assessment_data": {
+            "credit_score": user_info.get("credit_score", 700),
+            "monthly_income": user_info.get("monthly_income", 0),
+            "total_borrowed": user_info.get("total_borrowed", 0),
+            "pending_repay": user_info.get("pending_repay", 0)
+        },
+        "created_at": datetime.utcnow()
+    }
+
+
+inference_executor = InferenceExecutor(
+    settings.risk_model_dir,
+    workers=settings.risk_inference_workers,
+    max_pending=settings.risk_inference_max_pending
+)
+
+
+async def score_matrix(features: np.ndarray) -> np.ndarray:
+    """对特征矩阵评分：有模型时在工作进程池中推理，否则使用规则引擎"""
+    bundle = risk_model.bundle
+    if bundle is None:
+        return risk_model.rule_based_scores(features)
+    
+    try:
+        return await inference_executor.score(
+            bundle.version,
+            features,
+            timeout=settings.risk_inference_timeout_ms / 1000
+        )
+    except (InferenceOverloaded, asyncio.TimeoutError):
+        raise
+    except Exception as e:
+        print(f"模型预测失败: {e}")
+        return risk_model.rule_based_scores(features)
+
+
+async def score_or_503(score) -> Any:
+    """推理过载或超时时快速返回503"""
+    try:
+        return await score
+    except InferenceOverloaded:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="风控服务繁忙，请稍后再试"
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="风险评估超时，请稍后再试"
+        )
+
+
+# 挑战者模型：抽样的请求在后台用独立进程池评分，结果写入 shadow_scores
+shadow_executor = InferenceExecutor(
+    settings.risk_model_dir,
+    workers=settings.risk_shadow_inference_workers,
+    max_pending=settings.risk_shadow_inference_max_pending,
+    nice=settings.risk_shadow_inference_nice
+)
+shadow_scorer = ShadowScorer(
+    shadow_executor,
+    inference_executor,
+    lambda rows: audit_writer.submit_many(ShadowScore, rows),
+    queue_size=settings.risk_shadow_queue_size,
+    busy_pending=settings.risk_shadow_busy_pending,
+    concurrency=settings.risk_shadow_inference_workers
+)
+
+
+micro_batcher = MicroBatcher(
+    score_matrix,
+    window=settings.risk_micro_batch_window_ms / 1000,
+    max_batch_size=settings.risk_micro_batch_max_size
+)
+
+
 # API路由
 @app.post("/assess", response_model=RiskAssessmentResponse)
 async def assess_risk(
@@ -323,8 +741,14 @@ async def assess_risk(
     db: Session = Depends(lambda: next(get_db_session("risk_service")))
 ):
     """风险评估"""
-    # 获取用户信息
-    user_info = await get_user_info(request.user_id)
+    # 获取用户特征
+    try:
+        user_info = await load_user_features(request.user_id)
+    except FeatureUnavailable as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e)
+        )
     if not user_info:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -342,53 +766,20 @@ async def assess_risk(
             recommendations=["联系客服了解详情"]
         )
     
-    # 准备特征数据
-    features = np.array([
-        request.loan_amount,
-        user_info.get("credit_score", 700),
-        user_info.get("monthly_income", 0),
-        user_info.get("total_borrowed", 0),
-        user_info.get("pending_repay", 0)
-    ]).reshape(1, -1)
-    
-    # 风险评估
-    risk_score, risk_level = risk_model.predict_risk(features)
+    # 风险评估：与同一时间窗口内的其他请求合并推理
+    features = np.array(build_features(request.loan_amount, user_info), dtype=float)
+    risk_score = await score_or_503(micro_batcher.score(features))
+    risk_level = risk_model.get_risk_level(risk_score)
+    shadow_scorer.submit([request.user_id], features[None, :], risk_model.version, np.array([risk_score]))
     
     # 生成建议
-    reasons = []
-    recommendations = []
-    
-    if risk_score > 0.7:
-        reasons.append("综合风险评分过高")
-        recommendations.append("建议降低贷款金额或提供更多担保")
-    elif risk_score > 0.5:
-        reasons.append("风险评分较高")
-        recommendations.append("建议谨慎审批")
-    else:
-        reasons.append("风险评分在可接受范围内")
-        recommendations.append("可以正常审批")
-    
-    approved = risk_score < 0.6
+    approved, reasons, recommendations = make_decision(risk_score)
     
-    # 保存风险评估记录到数据库
-    assessment_record = RiskAssessment(
-        user_id=request.user_id,
-        loan_amount=request.loan_amount,
-        risk_score=risk_score,
-        risk_level=risk_level,
-        approved=approved,
-        reasons=json.dumps(reasons, ensure_ascii=False),
-        recommendations=json.dumps(recommendations, ensure_ascii=False),
-        assessment_data=json.dumps({
-            "credit_score": user_info.get("credit_score", 700),
-            "monthly_income": user_info.get("monthly_income", 0),
-            "total_borrowed": user_info.get("total_borrowed", 0),
-            "pending_repay": user_info.get("pending_repay", 0)
-        }, ensure_ascii=False)
-    )
-    
-    db.add(assessment_record)
-    db.commit()
+    # 风险评估记录异步批量写库，不阻塞响应
+    audit_writer.submit(RiskAssessment, assessment_row(
+        request.user_id, request.loan_amount, user_info,
+        risk_score, risk_level, approved, reasons, recommendations
+    ))
     
     return RiskAssessmentResponse(
         approved=approved,
@@ -399,32 +790,214 @@ async def assess_risk(
     )
 
 
-@app.post("/fraud-detect", response_model=FraudDetectionResponse)
-async def detect_fraud(
-    request: FraudDetectionRequest,
+@app.post("/assess/batch", response_model=List[BatchAssessmentResult])
+async def assess_risk_batch(
+    request: BatchAssessmentRequest,
     db: Session = Depends(lambda: next(get_db_session("risk_service")))
 ):
+    """批量风险评估：一次构造特征矩阵、一次推理、一次批量写入"""
+    applications = request.applications
+    if len(applications) > settings.risk_batch_max_size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"单次最多评估 {settings.risk_batch_max_size} 笔申请"
+        )
+    
+    user_ids = sorted({application.user_id for application in applications})
+    
+    # 并发获取用户特征，缓存未命中时限制同时回源的请求数
+    semaphore = asyncio.Semaphore(settings.risk_batch_fetch_concurrency)
+    unavailable = set()
+    
+    async def fetch(user_id: int):
+        async with semaphore:
+            try:
+                return user_id, await load_user_features(user_id)
+            except FeatureUnavailable:
+                unavailable.add(user_id)
+                return user_id, None
+    
+    users = dict(await asyncio.gather(*[fetch(user_id) for user_id in user_ids]))
+    blacklisted = BlacklistManager(db).blacklisted_among(user_ids)
+    
+    results: List[Optional[BatchAssessmentResult]] = [None] * len(applications)
+    scored = []
+    for index, application in enumerate(applications):
+        if application.user_id in unavailable:
+            results[index] = BatchAssessmentResult(
+                user_id=application.user_id,
+                error="借款汇总暂不可用"
+            )
+        elif not users.get(application.user_id):
+            results[index] = BatchAssessmentResult(
+                user_id=application.user_id,
+                error="用户不存在"
+            )
+        elif application.user_id in blacklisted:
+            results[index] = BatchAssessmentResult(
+                user_id=application.user_id,
+                approved=False,
+                risk_score=1.0,
+                risk_level="高风险",
+                reasons=["用户在黑名单中"],
+                recommendations=["联系客服了解详情"]
+            )
+        else:
+            scored.append(index)
+    
+    rows = []
+    if scored:
+        features = np.array([
+            build_features(applications[i].loan_amount, users[applications[i].user_id])
+            for i in scored
+        ], dtype=float)
+        scores = await score_or_503(score_matrix(features))
+        shadow_scorer.submit(
+            [applications[i].user_id for i in scored], features, risk_model.version, np.asarray(scores)
+        )
+        
+        for index, risk_score in zip(scored, scores):
+            application = applications[index]
+            risk_score = float(risk_score)
+            risk_level = risk_model.get_risk_level(risk_score)
+            approved, reasons, recommendations = make_decision(risk_score)
+            
+            results[index] = BatchAssessmentResult(
+                user_id=application.user_id,
+                approved=approved,
+                risk_score=risk_score,
+                risk_level=risk_level,
+                reasons=reasons,
+                recommendations=recommendations
+            )
+            rows.append(assessment_row(
+                application.user_id, application.loan_amount, users[application.user_id],
+                risk_score, risk_level, approved, reasons, recommendations
+            ))
+    
+    # 评估记录交给审计写入器批量多行插入
+    audit_writer.submit_many(RiskAssessment, rows)
+    
+    return results
+
+
+@app.post("/fraud-detect", response_model=FraudDetectionResponse)
+async def detect_fraud(request: FraudDetectionRequest):
     """反欺诈检测"""
-    result = fraud_model.detect_fraud(request)
-    
-    # 保存反欺诈检测记录到数据库
-    fraud_record = FraudDetection(
-        user_id=request.user_id,
-        ip_address=request.ip_address,
-        device_fingerprint=request.device_fingerprint,
-        behavior_data=json.dumps(request.behavior_data, ensure_ascii=False),
-        is_fraud=result.is_fraud,
-        fraud_score=result.fraud_score,
-        risk_factors=json.dumps(result.risk_factors, ensure_ascii=False),
-        confidence=result.confidence
-    )
+    result = await fraud_model.detect_fraud(request)
     
-    db.add(fraud_record)
-    db.commit()
+    # 反欺诈检测记录异步批量写库
+    audit_writer.submit(FraudDetection, {
+        "user_id": request.user_id,
+        "ip_address": request.ip_address,
+        "device_fingerprint": request.device_fingerprint,
+        "behavior_data": request.behavior_data,
+        "is_fraud": result.is_fraud,
+        "fraud_score": result.fraud_score,
+        "risk_factors": result.risk_factors,
+        "confidence": result.confidence,
+        "created_at": datetime.utcnow()
+    })
     
     return result
 
 
+@app.post("/features/events")
+async def ingest_feature_events(request: FeatureEventsRequest):
+    """接收用户/贷款服务推送的特征变更事件"""
+    applied = 0
+    for event in request.events:
+        if record_feature_event(event.user_id, event.features, to_utc_naive(event.event_time), event.source):
+            applied += 1
+    
+    return {"received": len(request.events), "applied": applied}
+
+
+@app.get("/features")
+async def get_feature_store_info():
+    """特征缓存状态"""
+    return {**feature_store.stats(), "max_age": settings.risk_feature_max_age}
+
+
+@app.get("/features/{user_id}")
+async def get_user_features(
+    user_id: int,
+    as_of: Optional[datetime] = None,
+    db: Session = Depends(lambda: next(get_db_session("risk_service")))
+):
+    """查询用户特征；指定 as_of 时按特征事件重建该时刻的特征"""
+    if as_of is not None:
+        features, event_time = features_as_of(db, user_id, to_utc_naive(as_of))
+        return {"user_id": user_id, "as_of": as_of, "features": features, "last_event_time": event_time}
+    
+    row = feature_store.get(user_id, float("inf"))
+    if row is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="特征缓存中没有该用户"
+        )
+    
+    age = feature_store.age(user_id)
+    return {
+        "user_id": user_id,
+        "features": dict(zip(USER_FEATURES, row.tolist())),
+        "age_seconds": age,
+        "stale": age > settings.risk_feature_max_age
+    }
+
+
+@app.get("/velocity")
+async def get_velocity(
+    user_id: int,
+    device_fingerprint: Optional[str] = None,
+    ip_address: Optional[str] = None
+):
+    """查询申请速度计数（不计入本次）"""
+    counts = await velocity_counter.read(
+        VelocityCounter.subjects(user_id, device_fingerprint, ip_address)
+    )
+    return {
+        "counts": {f"{dimension}:{value}": windows for (dimension, value), windows in counts.items()},
+        "exceeded": velocity_counter.exceeded(counts)
+    }
+
+
+@app.post("/ip-reputation/lookup", response_model=List[IpLookupResult])
+async def lookup_ip_reputation(request: IpLookupRequest):
+    """批量查询IP信誉（离线分析用），结果与输入顺序一致"""
+    if len(request.ip_addresses) > settings.risk_ip_lookup_max_size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"单次最多查询 {settings.risk_ip_lookup_max_size} 个IP"
+        )
+    
+    ip_ranges = ip_reputation.lookup_many(request.ip_addresses)
+    return [
+        IpLookupResult(ip_address=ip_address, matched=True, **ip_range.info())
+        if ip_range else IpLookupResult(ip_address=ip_address, matched=False)
+        for ip_address, ip_range in zip(request.ip_addresses, ip_ranges)
+    ]
+
+
+@app.get("/ip-reputation")
+async def get_ip_reputation_info():
+    """IP信誉库状态"""
+    return ip_reputation.table.stats()
+
+
+@app.post("/ip-reputation/reload")
+async def reload_ip_reputation_table():
+    """重建IP信誉库（管理员接口）"""
+    try:
+        reload_ip_reputation(force=True)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"IP信誉库加载失败，继续使用原数据: {e}"
+        )
+    return {"message": "IP信誉库已重新加载", **ip_reputation.table.stats()}
+
+
 @app.post("/blacklist/add")
 async def add_to_blacklist(
     entry: BlacklistEntry,
@@ -453,6 +1026,30 @@ async def check_blacklist(
     return {"is_blacklisted": is_blacklisted}
 
 
+@app.post("/blacklist/check")
+async def check_blacklist_batch(
+    request: BlacklistCheckRequest,
+    db: Session = Depends(lambda: next(get_db_session("risk_service")))
+):
+    """批量检查黑名单状态"""
+    if len(request.user_ids) > settings.risk_batch_max_size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"单次最多检查 {settings.risk_batch_max_size} 个用户"
+        )
+    
+    blacklist_manager = BlacklistManager(db)
+    blacklisted = blacklist_manager.blacklisted_among(request.user_ids)
+    
+    return {"blacklisted": sorted(blacklisted)}
+
+
+@app.get("/blacklist/index")
+async def get_blacklist_index():
+    """黑名单内存索引状态"""
+    return blacklist_index.stats()
+
+
 @app.delete("/blacklist/remove/{user_id}")
 async def remove_from_blacklist(
     user_id: int,
@@ -467,30 +1064,179 @@ async def remove_from_blacklist(
 
 @app.get("/risk-rules")
 async def get_risk_rules():
-    """获取风控规则"""
-    rules = {
-        "credit_score_rules": {
-            "excellent": {"min": 700, "max": 750, "risk_multiplier": 0.5},
-            "good": {"min": 650, "max": 699, "risk_multiplier": 0.7},
-            "fair": {"min": 600, "max": 649, "risk_multiplier": 0.9},
-            "poor": {"min": 550, "max": 599, "risk_multiplier": 1.2},
-            "bad": {"min": 0, "max": 549, "risk_multiplier": 1.5}
-        },
-        "loan_amount_rules": {
-            "low": {"min": 0, "max": 10000, "risk_multiplier": 0.8},
-            "medium": {"min": 10001, "max": 50000, "risk_multiplier": 1.0},
-            "high": {"min": 50001, "max": 100000, "risk_multiplier": 1.2},
-            "very_high": {"min": 100001, "max": 999999, "risk_multiplier": 1.5}
-        },
-        "debt_to_income_rules": {
-            "low": {"min": 0, "max": 0.2, "risk_multiplier": 0.8},
-            "medium": {"min": 0.21, "max": 0.4, "risk_multiplier": 1.0},
-            "high": {"min": 0.41, "max": 0.6, "risk_multiplier": 1.3},
-            "very_high": {"min": 0.61, "max": 1.0, "risk_multiplier": 1.8}
-        }
+    """获取当前生效的风控规则"""
+    return rule_engine.rule_set.describe()
+
+
+def validate_rule(request: RiskRuleRequest):
+    """规则配置必须能编译"""
+    try:
+        compile_rules([request.dict()], source="validation")
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"规则配置无效: {e}"
+        )
+
+
+@app.post("/risk-rules")
+async def create_risk_rule(
+    request: RiskRuleRequest,
+    db: Session = Depends(lambda: next(get_db_session("risk_service")))
+):
+    """新增风控规则（管理员接口），立即生效"""
+    validate_rule(request)
+    if db.query(RiskRule).filter(RiskRule.rule_name == request.rule_name).first():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="规则名称已存在"
+        )
+    
+    rule = RiskRule(
+        rule_name=request.rule_name,
+        rule_type=request.rule_type,
+        rule_config=json.dumps(request.rule_config, ensure_ascii=False),
+        priority=request.priority,
+        is_active=request.is_active,
+        created_by="admin"
+    )
+    db.add(rule)
+    db.commit()
+    
+    rule_engine.refresh(db)
+    return {"message": "规则已创建", "rule_id": rule.id}
+
+
+@app.put("/risk-rules/{rule_id}")
+async def update_risk_rule(
+    rule_id: int,
+    request: RiskRuleRequest,
+    db: Session = Depends(lambda: next(get_db_session("risk_service")))
+):
+    """修改风控规则（管理员接口），立即生效"""
+    validate_rule(request)
+    rule = db.query(RiskRule).filter(RiskRule.id == rule_id).first()
+    if not rule:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="规则不存在"
+        )
+    
+    rule.rule_name = request.rule_name
+    rule.rule_type = request.rule_type
+    rule.rule_config = json.dumps(request.rule_config, ensure_ascii=False)
+    rule.priority = request.priority
+    rule.is_active = request.is_active
+    db.commit()
+    
+    rule_engine.refresh(db)
+    return {"message": "规则已更新"}
+
+
+@app.delete("/risk-rules/{rule_id}")
+async def deactivate_risk_rule(
+    rule_id: int,
+    db: Session = Depends(lambda: next(get_db_session("risk_service")))
+):
+    """停用风控规则（管理员接口），立即生效"""
+    rule = db.query(RiskRule).filter(RiskRule.id == rule_id).first()
+    if not rule:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="规则不存在"
+        )
+    
+    rule.is_active = False
+    db.commit()
+    
+    rule_engine.refresh(db)
+    return {"message": "规则已停用"}
+
+
+@app.post("/risk-rules/reload")
+async def reload_risk_rules():
+    """重新编译风控规则（管理员接口）"""
+    try:
+        refresh_rules(force=True)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"规则编译失败，继续使用原规则: {e}"
+        )
+    return {"message": "规则已重新加载", **rule_engine.rule_set.describe()}
+
+
+@app.get("/model")
+async def get_model_info():
+    """获取当前模型版本"""
+    bundle = risk_model.bundle
+    versions = list_model_versions(risk_model.model_dir)
+    if bundle is None:
+        return {"version": None, "mode": "rule_based", "available_versions": versions}
+    return {**bundle.info(), "mode": "model", "available_versions": versions}
+
+
+@app.post("/model/reload")
+async def reload_model(version: Optional[str] = None):
+    """加载指定或当前版本的模型（管理员接口）"""
+    if not risk_model.load_model(version):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="模型加载失败，继续使用原模型"
+        )
+    return {"message": "模型已加载", **risk_model.bundle.info()}
+
+
+@app.get("/model/challengers")
+async def get_challengers():
+    """挑战者模型状态"""
+    return {
+        "champion": risk_model.version,
+        "challengers": [challenger.info() for challenger in shadow_scorer.challengers.values()],
+        "queue": shadow_scorer.stats()
     }
+
+
+@app.post("/model/challengers")
+async def add_challenger(request: ChallengerRequest):
+    """添加或重新启用挑战者模型（管理员接口）"""
+    if not 0 < request.sample_rate <= 1:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="抽样比例必须在 (0, 1] 之间"
+        )
     
-    return rules
+    # 先在线程中加载一次，确认工件可用
+    try:
+        await asyncio.get_running_loop().run_in_executor(
+            None, load_model_artifact, risk_model.model_dir, request.version
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"挑战者模型加载失败: {e}"
+        )
+    
+    challenger = shadow_scorer.add(request.version, request.sample_rate, request.latency_budget_ms)
+    shadow_executor.warm_up(request.version)
+    return {"message": "挑战者模型已启用", **challenger.info()}
+
+
+@app.delete("/model/challengers/{version}")
+async def remove_challenger(version: str):
+    """移除挑战者模型（管理员接口）"""
+    if not shadow_scorer.remove(version):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="挑战者模型不存在"
+        )
+    return {"message": "挑战者模型已移除"}
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus指标"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 
 @app.get("/health")
@@ -0,0 +1,169 @@
+# 风控模型工件管理
+
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime
+from typing import List, Optional, Sequence
+
+import joblib
+import numpy as np
+
+
+# 评估接口构造的特征列，模型工件声明的特征必须是其子集
+FEATURE_NAMES = (
+    "loan_amount",
+    "credit_score",
+    "monthly_income",
+    "total_borrowed",
+    "pending_repay",
+)
+
+MODEL_FILENAME = "model.joblib"
+MANIFEST_FILENAME = "manifest.json"
+CURRENT_POINTER = "current"
+
+
+class ModelBundle:
+    """一个已加载的模型版本：模型对象、清单与特征列映射"""
+
+    def __init__(self, version: str, model, manifest: dict):
+        self.version = version
+        self.model = model
+        self.manifest = manifest
+        self.features = list(manifest["features"])
+        # 评估特征矩阵 -> 模型输入列
+        self.columns = [FEATURE_NAMES.index(name) for name in self.features]
+        self.loaded_at = datetime.utcnow()
+
+    def predict_proba(self, features: np.ndarray) -> np.ndarray:
+        """返回每行的违约概率"""
+        return self.model.predict_proba(features[:, self.columns])[:, 1]
+
+    def info(self) -> dict:
+        return {
+            "version": self.version,
+            "model_type": self.manifest.get("model_type"),
+            "features": self.features,
+            "created_at": self.manifest.get("created_at"),
+            "loaded_at": self.loaded_at.isoformat(),
+        }
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_atomic(path: str, content: str):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def save_model_artifact(
+    model,
+    model_dir: str,
+    version: str,
+    features: Sequence[str] = FEATURE_NAMES,
+    metadata: Optional[dict] = None,
+    activate: bool = True
+) -> str:
+    """保存模型工件并（可选）切换为当前版本
+
+    模型不压缩存储，加载只需反序列化、不必解压。
+    注意：sklearn 树模型反序列化时会把节点数组复制到自己分配的内存里，
+    即使以内存映射方式加载，每个 worker 仍各自持有一份模型副本。
+    """
+    unknown = [name for name in features if name not in FEATURE_NAMES]
+    if unknown:
+        raise ValueError(f"未知特征: {unknown}")
+
+    version_dir = os.path.join(model_dir, version)
+    if os.path.exists(version_dir):
+        raise ValueError(f"模型版本 {version} 已存在")
+
+    tmp_dir = version_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    model_path = os.path.join(tmp_dir, MODEL_FILENAME)
+    joblib.dump(model, model_path, compress=0)
+
+    manifest = {
+        "version": version,
+        "model_type": type(model).__name__,
+        "features": list(features),
+        "sha256": _sha256(model_path),
+        "created_at": datetime.utcnow().isoformat(),
+        **(metadata or {}),
+    }
+    _write_atomic(
+        os.path.join(tmp_dir, MANIFEST_FILENAME),
+        json.dumps(manifest, ensure_ascii=False, indent=2)
+    )
+
+    os.rename(tmp_dir, version_dir)
+
+    if activate:
+        activate_model_version(model_dir, version)
+
+    return version_dir
+
+
+def activate_model_version(model_dir: str, version: str):
+    """把当前版本指针切换到 version"""
+    if not os.path.isdir(os.path.join(model_dir, version)):
+        raise ValueError(f"模型版本 {version} 不存在")
+    _write_atomic(os.path.join(model_dir, CURRENT_POINTER), version)
+
+
+def current_model_version(model_dir: str) -> Optional[str]:
+    """读取当前版本指针"""
+    try:
+        with open(os.path.join(model_dir, CURRENT_POINTER)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def load_model_artifact(model_dir: str, version: str, mmap_mode: Optional[str] = None) -> ModelBundle:
+    """加载指定版本的模型工件，校验清单、校验和与特征列"""
+    version_dir = os.path.join(model_dir, version)
+
+    with open(os.path.join(version_dir, MANIFEST_FILENAME)) as f:
+        manifest = json.load(f)
+
+    if manifest.get("version") != version:
+        raise ValueError(f"清单版本 {manifest.get('version')} 与目录 {version} 不一致")
+
+    unknown = [name for name in manifest.get("features", []) if name not in FEATURE_NAMES]
+    if not manifest.get("features") or unknown:
+        raise ValueError(f"模型特征与评估特征不兼容: {unknown or '未声明特征'}")
+
+    model_path = os.path.join(version_dir, MODEL_FILENAME)
+    if manifest.get("sha256") and _sha256(model_path) != manifest["sha256"]:
+        raise ValueError(f"模型文件校验失败: {model_path}")
+
+    model = joblib.load(model_path, mmap_mode=mmap_mode)
+    if not hasattr(model, "predict_proba"):
+        raise ValueError(f"模型 {type(model).__name__} 不支持 predict_proba")
+
+    return ModelBundle(version, model, manifest)
+
+
+def list_model_versions(model_dir: str) -> List[str]:
+    """列出已发布的模型版本"""
+    if not os.path.isdir(model_dir):
+        return []
+    return sorted(
+        name for name in os.listdir(model_dir)
+        if os.path.isfile(os.path.join(model_dir, name, MANIFEST_FILENAME))
+    )
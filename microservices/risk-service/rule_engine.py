@@ -0,0 +1,245 @@
+# 风控规则引擎
+
+import hashlib
+import json
+import threading
+from datetime import datetime
+from typing import List
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from shared.models.risk import RiskRule
+from model_store import FEATURE_NAMES
+
+
+# 派生特征：由基础特征计算，无法计算的行为 NaN，不参与该规则评分
+def _debt_to_income(features: np.ndarray) -> np.ndarray:
+    loan_amount = features[:, FEATURE_NAMES.index("loan_amount")]
+    monthly_income = features[:, FEATURE_NAMES.index("monthly_income")]
+    valid = (monthly_income > 0) & (loan_amount > 0)
+    return np.divide(
+        loan_amount,
+        monthly_income * 12,
+        out=np.full(len(features), np.nan),
+        where=valid
+    )
+
+
+DERIVED_FEATURES = {
+    "debt_to_income": _debt_to_income,
+}
+
+# 规则类型默认作用的特征
+RULE_TYPE_FEATURES = {
+    "credit_score": "credit_score",
+    "loan_amount": "loan_amount",
+    "debt_to_income": "debt_to_income",
+}
+
+# 表中没有启用规则时使用的默认规则
+DEFAULT_RULES = [
+    {
+        "rule_name": "credit_score_default",
+        "rule_type": "credit_score",
+        "priority": 10,
+        "rule_config": {
+            "thresholds": [550, 650],
+            "scores": [0.4, 0.2, 0.0],
+            "reasons": ["信用分过低", "信用分偏低", None],
+            "inclusive": "lower",
+        },
+    },
+    {
+        "rule_name": "loan_amount_default",
+        "rule_type": "loan_amount",
+        "priority": 20,
+        "rule_config": {
+            "thresholds": [50000, 100000],
+            "scores": [0.0, 0.1, 0.3],
+            "reasons": [None, "贷款金额较高", "贷款金额过高"],
+            "inclusive": "upper",
+        },
+    },
+    {
+        "rule_name": "debt_to_income_default",
+        "rule_type": "debt_to_income",
+        "priority": 30,
+        "rule_config": {
+            "thresholds": [0.3, 0.5],
+            "scores": [0.0, 0.1, 0.3],
+            "reasons": [None, "负债收入比偏高", "负债收入比过高"],
+            "inclusive": "upper",
+        },
+    },
+]
+
+
+class CompiledRule:
+    """编译后的分段规则：升序阈值表 + 每个区间的分值与原因
+
+    rule_config 格式:
+        thresholds: 升序阈值，n 个阈值划分 n+1 个区间
+        scores:     每个区间的风险分值
+        reasons:    每个区间的风险原因（可为 null）
+        inclusive:  lower 表示区间为 [a, b)，upper 表示区间为 (a, b]
+        feature:    作用的特征，缺省时按规则类型确定
+    """
+
+    def __init__(self, rule_name: str, rule_type: str, priority: int, config: dict):
+        self.rule_name = rule_name
+        self.rule_type = rule_type
+        self.priority = priority
+        self.feature = config.get("feature") or RULE_TYPE_FEATURES.get(rule_type)
+
+        if self.feature not in FEATURE_NAMES and self.feature not in DERIVED_FEATURES:
+            raise ValueError(f"规则 {rule_name} 的特征 {self.feature} 不存在")
+
+        self.thresholds = np.asarray(config["thresholds"], dtype=float)
+        self.scores = np.asarray(config["scores"], dtype=float)
+        self.reasons = list(config.get("reasons") or [None] * len(self.scores))
+
+        if np.any(np.diff(self.thresholds) <= 0):
+            raise ValueError(f"规则 {rule_name} 的阈值必须严格递增")
+        if len(self.scores) != len(self.thresholds) + 1 or len(self.reasons) != len(self.scores):
+            raise ValueError(f"规则 {rule_name} 的分值与原因数量必须比阈值多一个")
+
+        inclusive = config.get("inclusive", "lower")
+        if inclusive not in ("lower", "upper"):
+            raise ValueError(f"规则 {rule_name} 的 inclusive 必须是 lower 或 upper")
+        # [a, b) 区间用 right 查找，(a, b] 区间用 left 查找
+        self.side = "right" if inclusive == "lower" else "left"
+
+    def bins(self, values: np.ndarray) -> np.ndarray:
+        """每行落入的区间下标，NaN 为 -1"""
+        bins = np.searchsorted(self.thresholds, values, side=self.side)
+        return np.where(np.isnan(values), -1, bins)
+
+    def describe(self) -> dict:
+        return {
+            "rule_name": self.rule_name,
+            "rule_type": self.rule_type,
+            "priority": self.priority,
+            "feature": self.feature,
+            "thresholds": self.thresholds.tolist(),
+            "scores": self.scores.tolist(),
+            "reasons": self.reasons,
+        }
+
+
+class RuleEvaluation:
+    """一批申请的规则评估结果"""
+
+    def __init__(self, rules: List[CompiledRule], scores: np.ndarray, bins: List[np.ndarray]):
+        self.rules = rules
+        self.scores = scores
+        self.bins = bins
+
+    def reasons(self, row: int) -> List[str]:
+        """第 row 行命中的风险原因，按规则优先级排列"""
+        reasons = []
+        for rule, bins in zip(self.rules, self.bins):
+            index = bins[row]
+            if index >= 0 and rule.reasons[index]:
+                reasons.append(rule.reasons[index])
+        return reasons
+
+
+class CompiledRuleSet:
+    """按优先级排列的已编译规则集合"""
+
+    def __init__(self, rules: List[CompiledRule], fingerprint: str, source: str):
+        self.rules = rules
+        self.fingerprint = fingerprint
+        self.source = source
+        self.compiled_at = datetime.utcnow()
+
+    def evaluate(self, features: np.ndarray) -> RuleEvaluation:
+        """对特征矩阵做一次向量化规则评估，总分封顶为 1"""
+        columns = {}
+        scores = np.zeros(len(features))
+        all_bins = []
+
+        for rule in self.rules:
+            values = columns.get(rule.feature)
+            if values is None:
+                if rule.feature in DERIVED_FEATURES:
+                    values = DERIVED_FEATURES[rule.feature](features)
+                else:
+                    values = features[:, FEATURE_NAMES.index(rule.feature)].astype(float)
+                columns[rule.feature] = values
+
+            bins = rule.bins(values)
+            scores += np.where(bins >= 0, rule.scores[np.maximum(bins, 0)], 0.0)
+            all_bins.append(bins)
+
+        return RuleEvaluation(self.rules, np.minimum(scores, 1.0), all_bins)
+
+    def describe(self) -> dict:
+        return {
+            "source": self.source,
+            "fingerprint": self.fingerprint,
+            "compiled_at": self.compiled_at.isoformat(),
+            "rules": [rule.describe() for rule in self.rules],
+        }
+
+
+def compile_rules(rows: List[dict], source: str) -> CompiledRuleSet:
+    """编译规则定义，任一规则不合法则整体失败"""
+    rows = sorted(rows, key=lambda row: (row["priority"] or 0, row["rule_name"]))
+    rules = [
+        CompiledRule(row["rule_name"], row["rule_type"], row["priority"] or 0, row["rule_config"])
+        for row in rows
+    ]
+    fingerprint = hashlib.sha1(
+        json.dumps(rows, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    ).hexdigest()
+    return CompiledRuleSet(rules, fingerprint, source)
+
+
+def parse_rule_config(rule_config) -> dict:
+    """RiskRule.rule_config 存储为JSON文本"""
+    return json.loads(rule_config) if isinstance(rule_config, str) else rule_config
+
+
+class RuleEngine:
+    """从 RiskRule 表加载启用的规则，编译后原子替换；表变化时重新编译"""
+
+    def __init__(self):
+        self.rule_set = compile_rules(DEFAULT_RULES, source="default")
+        self._change_marker = None
+        self._lock = threading.Lock()
+
+    def evaluate(self, features: np.ndarray) -> RuleEvaluation:
+        return self.rule_set.evaluate(features)
+
+    def refresh(self, db: Session, force: bool = False) -> bool:
+        """规则表有变化时重新编译，返回是否重新编译"""
+        # 规则的增删改与启停都会改变条数或最近更新时间
+        marker = tuple(db.query(func.count(RiskRule.id), func.max(RiskRule.updated_at)).one())
+
+        with self._lock:
+            if not force and marker == self._change_marker:
+                return False
+
+            rules = db.query(RiskRule).filter(
+                RiskRule.is_active == True
+            ).order_by(RiskRule.priority, RiskRule.id).all()
+
+            if rules:
+                rule_set = compile_rules([
+                    {
+                        "rule_name": rule.rule_name,
+                        "rule_type": rule.rule_type,
+                        "priority": rule.priority,
+                        "rule_config": parse_rule_config(rule.rule_config),
+                    }
+                    for rule in rules
+                ], source="database")
+            else:
+                rule_set = compile_rules(DEFAULT_RULES, source="default")
+
+            self.rule_set = rule_set
+            self._change_marker = marker
+            return True
@@ -0,0 +1,239 @@
+# 挑战者模型影子评分
+
+import asyncio
+import random
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+from prometheus_client import Counter, Histogram
+
+from inference import InferenceExecutor, InferenceOverloaded
+
+
+SHADOW_SECONDS = Histogram('risk_shadow_inference_seconds', 'Challenger inference latency', ['version'])
+SHADOW_SAMPLED = Counter('risk_shadow_sampled_total', 'Rows sampled for challenger scoring', ['version'])
+SHADOW_SKIPPED = Counter('risk_shadow_skipped_total', 'Sampled rows not scored by the challenger', ['version', 'reason'])
+
+
+class Challenger:
+    """一个挑战者模型：抽样比例、延迟预算与最近的延迟样本"""
+
+    def __init__(
+        self,
+        version: str,
+        sample_rate: float,
+        latency_budget_ms: float,
+        window: int = 200,
+        min_samples: int = 20
+    ):
+        self.version = version
+        self.sample_rate = sample_rate
+        self.latency_budget_ms = latency_budget_ms
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        self.enabled = True
+        self.disabled_reason: Optional[str] = None
+        self.sampled = 0
+        self.scored = 0
+        self.skipped: Dict[str, int] = defaultdict(int)
+        self.errors = 0
+        self.created_at = datetime.utcnow()
+
+    def p95_ms(self) -> Optional[float]:
+        if not self.latencies:
+            return None
+        return float(np.percentile(self.latencies, 95))
+
+    def observe(self, latency_ms: float):
+        """记录一次推理延迟，最近样本的 P95 超出预算时自动停用"""
+        self.latencies.append(latency_ms)
+        if len(self.latencies) < self.min_samples:
+            return
+
+        p95 = self.p95_ms()
+        if p95 > self.latency_budget_ms:
+            self.disable(f"P95延迟 {p95:.1f}ms 超过预算 {self.latency_budget_ms}ms")
+
+    def skip(self, reason: str, count: int):
+        """记录抽样后未评分的行数"""
+        self.skipped[reason] += count
+        SHADOW_SKIPPED.labels(version=self.version, reason=reason).inc(count)
+
+    def skip_rate(self) -> float:
+        return round(sum(self.skipped.values()) / self.sampled, 4) if self.sampled else 0.0
+
+    def disable(self, reason: str):
+        if self.enabled:
+            self.enabled = False
+            self.disabled_reason = reason
+            print(f"挑战者模型 {self.version} 已停用: {reason}")
+
+    def info(self) -> dict:
+        return {
+            "version": self.version,
+            "enabled": self.enabled,
+            "disabled_reason": self.disabled_reason,
+            "sample_rate": self.sample_rate,
+            "latency_budget_ms": self.latency_budget_ms,
+            "p95_ms": self.p95_ms(),
+            "sampled": self.sampled,
+            "scored": self.scored,
+            "skipped": dict(self.skipped),
+            "skip_rate": self.skip_rate(),
+            "errors": self.errors,
+            "created_at": self.created_at.isoformat(),
+        }
+
+
+class ShadowScorer:
+    """按抽样比例在请求路径之外用挑战者模型评分，评分结果交给记录回调
+
+    抽样的批次进入有界队列，由后台协程在独立的推理进程池中评分，不占用冠军模型的工作进程与在途名额；
+    冠军模型在途推理达到 busy_pending 时暂停取队列，负载回落后继续，繁忙时段的样本同样会被评分。
+    只有队列积压满时才丢弃新样本，丢弃、超时与失败都按行计入挑战者的跳过率。
+    超时按超出预算计入延迟样本，连续错误过多时停用。
+    """
+
+    def __init__(
+        self,
+        executor: InferenceExecutor,
+        champion: InferenceExecutor,
+        record,
+        max_errors: int = 10,
+        queue_size: int = 1000,
+        busy_pending: int = 32,
+        concurrency: int = 1,
+        busy_wait: float = 0.05
+    ):
+        self.executor = executor
+        self.champion = champion
+        self.record = record
+        self.max_errors = max_errors
+        self.queue_size = queue_size
+        self.busy_pending = busy_pending
+        self.concurrency = concurrency
+        self.busy_wait = busy_wait
+        self.challengers: Dict[str, Challenger] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.ensure_future(self._consume()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def join(self):
+        """等待已入队的批次全部处理完"""
+        await self._queue.join()
+
+    def add(self, version: str, sample_rate: float, latency_budget_ms: float) -> Challenger:
+        challenger = Challenger(version, sample_rate, latency_budget_ms)
+        self.challengers[version] = challenger
+        return challenger
+
+    def remove(self, version: str) -> bool:
+        return self.challengers.pop(version, None) is not None
+
+    def submit(self, user_ids: List[int], features: np.ndarray, champion_version: str, champion_scores: np.ndarray):
+        """为每个启用的挑战者抽样并放入评分队列，立即返回"""
+        for challenger in list(self.challengers.values()):
+            if not challenger.enabled:
+                continue
+
+            picked = [i for i in range(len(user_ids)) if random.random() < challenger.sample_rate]
+            if not picked:
+                continue
+
+            challenger.sampled += len(picked)
+            SHADOW_SAMPLED.labels(version=challenger.version).inc(len(picked))
+            if self._queue is None or self._queue.full():
+                challenger.skip("queue_full", len(picked))
+                continue
+            self._queue.put_nowait((
+                challenger,
+                [user_ids[i] for i in picked],
+                features[picked],
+                champion_version,
+                champion_scores[picked]
+            ))
+
+    async def _consume(self):
+        while True:
+            item = await self._queue.get()
+            try:
+                while self.champion.pending >= self.busy_pending:
+                    await asyncio.sleep(self.busy_wait)
+                await self._run(*item)
+            except Exception as e:
+                print(f"影子评分失败: {e}")
+            finally:
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "queue_size": self.queue_size,
+            "busy_pending": self.busy_pending,
+            "champion_pending": self.champion.pending,
+        }
+
+    async def _run(
+        self,
+        challenger: Challenger,
+        user_ids: List[int],
+        features: np.ndarray,
+        champion_version: str,
+        champion_scores: np.ndarray
+    ):
+        if not challenger.enabled:
+            challenger.skip("disabled", len(user_ids))
+            return
+
+        start = time.perf_counter()
+        try:
+            # 超过预算数倍仍未完成的不再等待
+            scores = await self.executor.score(
+                challenger.version,
+                features,
+                timeout=challenger.latency_budget_ms * 4 / 1000
+            )
+        except InferenceOverloaded:
+            challenger.skip("overloaded", len(user_ids))
+            return
+        except asyncio.TimeoutError:
+            challenger.skip("timeout", len(user_ids))
+            challenger.observe((time.perf_counter() - start) * 1000)
+            return
+        except Exception as e:
+            challenger.skip("error", len(user_ids))
+            challenger.errors += 1
+            print(f"挑战者模型 {challenger.version} 评分失败: {e}")
+            if challenger.errors >= self.max_errors:
+                challenger.disable(f"评分失败 {challenger.errors} 次")
+            return
+
+        latency = time.perf_counter() - start
+        SHADOW_SECONDS.labels(version=challenger.version).observe(latency)
+        challenger.observe(latency * 1000)
+        challenger.scored += len(user_ids)
+
+        self.record([
+            {
+                "user_id": user_id,
+                "champion_version": champion_version,
+                "champion_score": float(champion_score),
+                "challenger_version": challenger.version,
+                "challenger_score": float(score),
+                "latency_ms": latency * 1000,
+                "created_at": datetime.utcnow(),
+            }
+            for user_id, champion_score, score in zip(user_ids, champion_scores, scores)
+        ])
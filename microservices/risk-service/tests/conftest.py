@@ -0,0 +1,7 @@
+import os
+import sys
+
+# 与服务运行时一致：服务目录下的模块按文件名导入，shared 包从 microservices 目录导入
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(SERVICE_DIR))
+sys.path.insert(0, SERVICE_DIR)
@@ -0,0 +1,93 @@
+import time
+from datetime import datetime
+
+from feature_store import (
+    FeatureStore, USER_FEATURES, features_from_response, fold_events, owned_features
+)
+
+
+USER = {"credit_score": 720.0, "monthly_income": 8000.0}
+LOANS = {"total_borrowed": 50000.0, "pending_repay": 20000.0}
+
+
+def vector(**values) -> list:
+    return [values[name] for name in USER_FEATURES]
+
+
+def test_row_is_unavailable_until_every_source_has_reported():
+    store = FeatureStore(capacity=4)
+    now = time.time()
+
+    store.update(1, USER, now)
+    assert store.get(1, 60) is None
+
+    store.update(1, LOANS, now)
+    assert store.get(1, 60).tolist() == vector(**USER, **LOANS)
+
+
+def test_sources_are_ordered_independently():
+    store = FeatureStore(capacity=4)
+    now = time.time()
+    store.update(1, LOANS, now - 30)
+    store.update(1, USER, now - 10)
+
+    # 用户服务的事件更新后，较早发生但迟到的贷款事件仍然生效
+    assert store.update(1, {"total_borrowed": 60000.0, "pending_repay": 25000.0}, now - 20)
+    # 早于当前值的同一特征事件被忽略
+    assert not store.update(1, {"credit_score": 600.0}, now - 15)
+
+    row = dict(zip(USER_FEATURES, store.get(1, 60).tolist()))
+    assert row["total_borrowed"] == 60000.0
+    assert row["credit_score"] == 720.0
+
+
+def test_row_expires_with_its_oldest_feature():
+    store = FeatureStore(capacity=4)
+    now = time.time()
+    store.update(1, LOANS, now - 100)
+    store.update(1, USER, now)
+
+    assert store.get(1, 60) is None
+    assert store.get(1, 200) is not None
+    assert 100 <= store.age(1) < 110
+
+
+def test_get_many_grows_past_capacity():
+    store = FeatureStore(capacity=2)
+    now = time.time()
+    for user_id in range(5):
+        store.update(user_id, {**USER, **LOANS, "credit_score": 600.0 + user_id}, now)
+
+    matrix, fresh = store.get_many([4, 0, 99], 60)
+
+    assert len(store) == 5
+    assert fresh.tolist() == [True, True, False]
+    assert matrix[:2, USER_FEATURES.index("credit_score")].tolist() == [604.0, 600.0]
+
+
+def test_each_feature_is_owned_by_one_source():
+    features = {**USER, **LOANS}
+
+    assert owned_features("user_service", features) == USER
+    assert owned_features("loan_service", features) == LOANS
+    assert owned_features("unknown", features) == {}
+
+
+def test_features_from_response_fills_defaults():
+    assert features_from_response("user_service", {"credit_score": 650, "monthly_income": None}) == {
+        "credit_score": 650.0, "monthly_income": 0.0
+    }
+    assert features_from_response("loan_service", {"total_borrowed": 1000}) == {
+        "total_borrowed": 1000.0, "pending_repay": 0.0
+    }
+
+
+def test_fold_events_applies_in_event_time_order():
+    features, as_of = fold_events([
+        (datetime(2026, 5, 2), {"credit_score": 640.0}),
+        (datetime(2026, 5, 1), {"credit_score": 700.0, "monthly_income": 5000.0}),
+        (datetime(2026, 5, 3), {"pending_repay": 1200.0}),
+    ])
+
+    assert as_of == datetime(2026, 5, 3)
+    assert features == {"credit_score": 640.0, "monthly_income": 5000.0, "total_borrowed": 0.0, "pending_repay": 1200.0}
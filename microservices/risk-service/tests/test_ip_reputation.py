@@ -0,0 +1,112 @@
+import ipaddress
+import random
+
+import pytest
+
+from ip_reputation import IpRange, IpReputationTable, PrefixTrie, load_ranges_from_file
+
+
+def brute_force_lookup(networks, address):
+    """线性扫描所有网段取最长前缀，作为前缀树的对照"""
+    best = None
+    for network, entry in networks:
+        if address in network and (best is None or network.prefixlen > best[0].prefixlen):
+            best = (network, entry)
+    return best[1] if best else None
+
+
+def random_address(rng, width):
+    # 最高 8 位只取少数几个值，保证网段之间大量嵌套与分叉
+    return rng.choice((10, 172, 203)) << (width - 8) | rng.getrandbits(width - 8)
+
+
+def random_networks(rng, version, count):
+    width = 32 if version == 4 else 128
+    networks = {}
+    for _ in range(count):
+        length = rng.randint(1, width)
+        key = random_address(rng, width)
+        network = ipaddress.ip_network((key, length), strict=False)
+        networks[network] = IpRange(str(network), round(rng.random(), 4))
+    return list(networks.items())
+
+
+@pytest.mark.parametrize("version", [4, 6])
+def test_lookup_matches_brute_force_longest_prefix(version):
+    rng = random.Random(version)
+    width = 32 if version == 4 else 128
+    networks = random_networks(rng, version, 500)
+
+    trie = PrefixTrie(width)
+    for network, entry in networks:
+        trie.insert(int(network.network_address), network.prefixlen, entry)
+    assert trie.size == len(networks)
+
+    # 随机地址加上每个网段的首尾地址及其外侧相邻地址
+    addresses = [random_address(rng, width) for _ in range(2000)]
+    for network, _ in networks:
+        first, last = int(network.network_address), int(network.broadcast_address)
+        addresses.extend(a for a in (first - 1, first, last, last + 1) if 0 <= a < 1 << width)
+
+    for address in addresses:
+        ip = ipaddress.ip_address(address) if version == 4 else ipaddress.IPv6Address(address)
+        assert trie.lookup(address) is brute_force_lookup(networks, ip)
+
+
+def test_insert_order_does_not_change_result():
+    rng = random.Random(42)
+    networks = random_networks(rng, 4, 200)
+    shuffled = networks[:]
+    rng.shuffle(shuffled)
+
+    tries = []
+    for items in (networks, shuffled):
+        trie = PrefixTrie(32)
+        for network, entry in items:
+            trie.insert(int(network.network_address), network.prefixlen, entry)
+        tries.append(trie)
+
+    for _ in range(2000):
+        address = random_address(rng, 32)
+        assert tries[0].lookup(address) is tries[1].lookup(address)
+
+
+def test_default_route_and_duplicate_network():
+    table = IpReputationTable([
+        IpRange("0.0.0.0/0", 0.1, "default"),
+        IpRange("203.0.113.0/24", 0.5, "proxy"),
+        IpRange("203.0.113.7/24", 0.9, "tor"),  # 非规范写法，与上一条是同一网段
+    ], source="test")
+
+    assert table.lookup("198.51.100.1").category == "default"
+    assert table.lookup("203.0.113.200").category == "tor"
+    assert table.stats()["ipv4_ranges"] == 2
+
+
+def test_ipv4_mapped_ipv6_and_invalid_addresses():
+    table = IpReputationTable([
+        IpRange("203.0.113.0/24", 0.5, "proxy"),
+        IpRange("2001:db8::/32", 0.7, "datacenter"),
+    ], source="test")
+
+    assert table.lookup("::ffff:203.0.113.9").category == "proxy"
+    assert table.lookup("2001:db8:1::1").category == "datacenter"
+    assert table.lookup("2001:db9::1") is None
+    assert table.lookup_many(["not-an-ip", "", "999.1.1.1"]) == [None, None, None]
+
+
+def test_load_ranges_from_file(tmp_path):
+    path = tmp_path / "ip_reputation.csv"
+    path.write_text(
+        "network,score,category,asn\n"
+        "# 注释行\n"
+        "203.0.113.0/24,0.8,proxy,64500\n"
+        "2001:db8::/32,0.6,,\n"
+    )
+
+    ranges = load_ranges_from_file(str(path))
+
+    assert [(r.network, r.score, r.category, r.asn) for r in ranges] == [
+        ("203.0.113.0/24", 0.8, "proxy", 64500),
+        ("2001:db8::/32", 0.6, None, None),
+    ]
@@ -0,0 +1,108 @@
+import json
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from model_store import FEATURE_NAMES
+from rule_engine import DEFAULT_RULES, RuleEngine, compile_rules
+from shared.models.risk import RiskRule
+
+
+def legacy_rule_scores(features: np.ndarray) -> np.ndarray:
+    """规则引擎上线前 RiskAssessmentModel.rule_based_scores 的硬编码规则，作为对照"""
+    loan_amount = features[:, 0]
+    credit_score = features[:, 1]
+    monthly_income = features[:, 2]
+
+    risk_score = np.select([loan_amount > 100000, loan_amount > 50000], [0.3, 0.1], 0.0)
+    risk_score += np.select([credit_score < 550, credit_score < 650], [0.4, 0.2], 0.0)
+
+    has_income = (monthly_income > 0) & (loan_amount > 0)
+    debt_to_income = np.divide(
+        loan_amount,
+        monthly_income * 12,
+        out=np.zeros_like(loan_amount, dtype=float),
+        where=has_income
+    )
+    risk_score += np.select([debt_to_income > 0.5, debt_to_income > 0.3], [0.3, 0.1], 0.0)
+
+    return np.minimum(risk_score, 1.0)
+
+
+def feature_matrix(loan_amount, credit_score, monthly_income) -> np.ndarray:
+    features = np.zeros((len(loan_amount), len(FEATURE_NAMES)))
+    features[:, FEATURE_NAMES.index("loan_amount")] = loan_amount
+    features[:, FEATURE_NAMES.index("credit_score")] = credit_score
+    features[:, FEATURE_NAMES.index("monthly_income")] = monthly_income
+    return features
+
+
+def test_default_rules_match_legacy_scores_on_random_inputs():
+    rng = np.random.default_rng(7)
+    size = 20000
+    features = feature_matrix(
+        rng.uniform(0, 200000, size),
+        rng.integers(300, 850, size),
+        # 约十分之一的申请没有收入
+        np.where(rng.random(size) < 0.1, 0, rng.uniform(1000, 50000, size))
+    )
+
+    scores = compile_rules(DEFAULT_RULES, source="default").evaluate(features).scores
+
+    np.testing.assert_allclose(scores, legacy_rule_scores(features))
+
+
+def test_default_rules_match_legacy_scores_on_thresholds():
+    # 阈值本身及两侧，以及负债收入比恰好 0.3 / 0.5 的申请
+    loan_amount = [0, 50000, 50000.01, 100000, 100000.01, 36000, 60000, 36000.01, 60000.01]
+    credit_score = [549, 550, 551, 649, 650, 651, 0, 850, 700]
+    monthly_income = [0, 10000, 10000, 10000, 10000, 10000, 10000, 10000, 10000]
+    features = feature_matrix(loan_amount, credit_score, monthly_income)
+
+    scores = compile_rules(DEFAULT_RULES, source="default").evaluate(features).scores
+
+    np.testing.assert_allclose(scores, legacy_rule_scores(features))
+
+
+def test_reasons_follow_rule_priority():
+    features = feature_matrix([150000], [500], [10000])
+
+    evaluation = compile_rules(DEFAULT_RULES, source="default").evaluate(features)
+
+    assert evaluation.scores[0] == 1.0
+    assert evaluation.reasons(0) == ["信用分过低", "贷款金额过高", "负债收入比过高"]
+
+
+def test_invalid_rule_config_is_rejected():
+    rule = dict(DEFAULT_RULES[0], rule_config={"thresholds": [650, 550], "scores": [0, 0, 0]})
+
+    with pytest.raises(ValueError):
+        compile_rules([rule], source="test")
+
+
+def test_refresh_recompiles_when_rule_table_changes(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'rules.db'}")
+    RiskRule.__table__.create(engine)
+    Session = sessionmaker(bind=engine)
+    rule_engine = RuleEngine()
+
+    with Session() as db:
+        assert rule_engine.refresh(db) is True
+        assert rule_engine.rule_set.source == "default"
+        assert rule_engine.refresh(db) is False
+
+        db.add(RiskRule(
+            rule_name="strict_credit_score",
+            rule_type="credit_score",
+            priority=1,
+            rule_config=json.dumps({"thresholds": [700], "scores": [0.5, 0.0]})
+        ))
+        db.commit()
+
+        assert rule_engine.refresh(db) is True
+        assert rule_engine.rule_set.source == "database"
+        scores = rule_engine.evaluate(feature_matrix([1000, 1000], [699, 700], [10000, 10000])).scores
+        np.testing.assert_allclose(scores, [0.5, 0.0])
+    engine.dispose()
@@ -0,0 +1,96 @@
+import asyncio
+
+import numpy as np
+
+from shadow import ShadowScorer
+
+
+class StubExecutor:
+    """只记录调用的推理执行器"""
+
+    def __init__(self, pending: int = 0):
+        self.pending = pending
+        self.calls = []
+
+    async def score(self, version, features, timeout=None):
+        self.calls.append(version)
+        return np.full(len(features), 0.25)
+
+
+def make_scorer(champion_pending: int = 0, **kwargs):
+    shadow_executor = StubExecutor()
+    champion_executor = StubExecutor(pending=champion_pending)
+    recorded = []
+    scorer = ShadowScorer(shadow_executor, champion_executor, recorded.extend, busy_pending=2, busy_wait=0.01, **kwargs)
+    challenger = scorer.add("challenger-v2", sample_rate=1.0, latency_budget_ms=1000)
+    return scorer, challenger, shadow_executor, champion_executor, recorded
+
+
+def submit(scorer: ShadowScorer, user_ids):
+    scores = np.linspace(0.1, 0.9, len(user_ids))
+    scorer.submit(user_ids, np.zeros((len(user_ids), 5)), "champion-v1", scores)
+
+
+def test_challengers_score_on_their_own_executor():
+    scorer, challenger, shadow_executor, champion_executor, recorded = make_scorer()
+
+    async def scenario():
+        scorer.start()
+        submit(scorer, [1, 2])
+        await scorer.join()
+        await scorer.stop()
+
+    asyncio.run(scenario())
+
+    assert shadow_executor.calls == ["challenger-v2"]
+    assert champion_executor.calls == []
+    assert [(row["user_id"], row["champion_score"], row["challenger_score"]) for row in recorded] == [
+        (1, 0.1, 0.25),
+        (2, 0.9, 0.25),
+    ]
+    assert challenger.info()["skip_rate"] == 0
+
+
+def test_busy_champion_delays_shadow_work_instead_of_dropping_it():
+    scorer, challenger, shadow_executor, champion_executor, recorded = make_scorer(champion_pending=2)
+
+    async def scenario():
+        scorer.start()
+        submit(scorer, [1])
+        await asyncio.sleep(0.05)
+        delayed = list(shadow_executor.calls)
+        champion_executor.pending = 1
+        await scorer.join()
+        await scorer.stop()
+        return delayed
+
+    assert asyncio.run(scenario()) == []
+    assert [row["user_id"] for row in recorded] == [1]
+    assert challenger.skipped == {}
+
+
+def test_full_queue_drops_and_reports_skip_rate():
+    scorer, challenger, shadow_executor, champion_executor, recorded = make_scorer(
+        champion_pending=2, queue_size=1
+    )
+
+    async def scenario():
+        scorer.start()
+        submit(scorer, [1, 2])
+        await asyncio.sleep(0)
+        # 第一批已被取出等待负载回落，第二批占满队列，第三批丢弃
+        submit(scorer, [3])
+        submit(scorer, [4, 5, 6])
+        stats = scorer.stats()
+        champion_executor.pending = 0
+        await scorer.join()
+        await scorer.stop()
+        return stats
+
+    stats = asyncio.run(scenario())
+
+    assert stats["queued"] == 1
+    assert [row["user_id"] for row in recorded] == [1, 2, 3]
+    info = challenger.info()
+    assert (info["sampled"], info["scored"], info["skipped"]) == (6, 3, {"queue_full": 3})
+    assert info["skip_rate"] == 0.5
@@ -0,0 +1,109 @@
+import asyncio
+
+import fakeredis
+
+from velocity import LocalVelocityStore, RedisVelocityStore, VelocityCounter, WINDOWS, bucket_ids
+
+
+USER = ("user", "1")
+DEVICE = ("device", "fp-1")
+# 对齐到一天的开始，便于推算各窗口的桶编号
+T0 = 86400.0 * 20000
+
+
+def test_bucket_ids_cover_window_ending_at_current_bucket():
+    ids = bucket_ids("1m", T0 + 25)
+
+    assert len(ids) == 6
+    assert ids[-1] == int((T0 + 25) // 10)
+    assert ids == list(range(ids[-1] - 5, ids[-1] + 1))
+
+
+def test_local_counts_slide_out_of_each_window():
+    store = LocalVelocityStore()
+    store.record([USER], T0)
+    store.record([USER], T0 + 30)
+
+    assert store.read([USER], T0 + 59)[USER] == {"1m": 2, "1h": 2, "24h": 2}
+    # 第一个 10 秒桶移出 1 分钟窗口，仍在 1 小时、24 小时窗口内
+    assert store.read([USER], T0 + 60)[USER] == {"1m": 1, "1h": 2, "24h": 2}
+    assert store.read([USER], T0 + 3600)[USER] == {"1m": 0, "1h": 0, "24h": 2}
+
+
+def test_local_ring_slot_is_reset_when_it_wraps_around():
+    store = LocalVelocityStore()
+    store.record([USER], T0)
+    store.record([USER], T0)
+
+    # 一分钟后落在同一个槽位，旧桶的计数不能累加进来
+    counts = store.record([USER], T0 + 60)[USER]
+
+    assert counts["1m"] == 1
+    assert counts["1h"] == 3
+
+
+def test_local_store_evicts_subjects_idle_longer_than_longest_window():
+    store = LocalVelocityStore()
+    store.record([USER], T0)
+    store.record([DEVICE], T0 + 3600)
+
+    longest = max(size + bucket for size, bucket in WINDOWS.values())
+    store.record([DEVICE], T0 + longest + 1)
+
+    assert USER not in store._rings
+    assert DEVICE in store._rings
+    assert store.read([USER], T0 + longest + 1)[USER] == {"1m": 0, "1h": 0, "24h": 0}
+
+
+def test_exceeded_only_reports_counts_above_limit():
+    counter = VelocityCounter(limits={"user": {"1m": 2, "1h": 5}, "device": {"1m": 1}})
+
+    exceeded = counter.exceeded({
+        USER: {"1m": 2, "1h": 6, "24h": 100},
+        DEVICE: {"1m": 2, "1h": 0, "24h": 0},
+        ("ip", "10.0.0.1"): {"1m": 50, "1h": 50, "24h": 50},
+    })
+
+    assert exceeded == ["user:1h", "device:1m"]
+
+
+def test_redis_buckets_are_keyed_per_window_and_expire_after_it():
+    client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    store = RedisVelocityStore(client, prefix="test_velocity")
+
+    async def scenario():
+        await store.record([USER], T0)
+        counts = await store.record([USER], T0 + 30)
+        ttls = {key: await client.ttl(key) for key in await client.keys("test_velocity:*")}
+        later = await store.read([USER], T0 + 60)
+        return counts, ttls, later
+
+    counts, ttls, later = asyncio.run(scenario())
+
+    assert counts[USER] == {"1m": 2, "1h": 2, "24h": 2}
+    assert later[USER] == {"1m": 1, "1h": 2, "24h": 2}
+    minute = int(T0 // 10)
+    assert set(ttls) == {
+        f"test_velocity:user:1:1m:{minute}",
+        f"test_velocity:user:1:1m:{minute + 3}",
+        f"test_velocity:user:1:1h:{int(T0 // 60)}",
+        f"test_velocity:user:1:24h:{int(T0 // 3600)}",
+    }
+    for key, ttl in ttls.items():
+        size, bucket = WINDOWS[key.split(":")[3]]
+        assert size < ttl <= size + bucket
+
+
+def test_counter_falls_back_to_local_store_when_redis_is_down():
+    server = fakeredis.FakeServer()
+    server.connected = False
+    counter = VelocityCounter(fakeredis.FakeAsyncRedis(server=server), limits={"user": {"1m": 1}})
+
+    async def scenario():
+        await counter.record([USER])
+        return await counter.record([USER])
+
+    counts = asyncio.run(scenario())
+
+    assert counts[USER]["1m"] == 2
+    assert counter.exceeded(counts) == ["user:1m"]
@@ -0,0 +1,194 @@
+# 申请频率（速度）计数
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from redis.exceptions import RedisError
+
+
+# 统计窗口：名称 -> (窗口秒数, 桶秒数)；每个窗口固定桶数，更新和读取都是常数次操作
+WINDOWS = {
+    "1m": (60, 10),
+    "1h": (3600, 60),
+    "24h": (86400, 3600),
+}
+
+# 各维度在各窗口内允许的申请次数，超过即视为申请频率过高
+VELOCITY_LIMITS = {
+    "user": {"1m": 3, "1h": 10, "24h": 20},
+    "device": {"1m": 5, "1h": 20, "24h": 50},
+    "ip": {"1m": 10, "1h": 50, "24h": 200},
+}
+
+
+def bucket_ids(window: str, now: float) -> List[int]:
+    """窗口内各桶的编号，最后一个是当前桶"""
+    size, bucket = WINDOWS[window]
+    current = int(now // bucket)
+    return list(range(current - size // bucket + 1, current + 1))
+
+
+class RedisVelocityStore:
+    """Redis 按桶计数：每个桶一个键，INCR 后设置过期，读取时 MGET 窗口内所有桶（redis.asyncio 客户端）"""
+
+    def __init__(self, redis_client, prefix: str = "velocity"):
+        self.redis = redis_client
+        self.prefix = prefix
+
+    def _key(self, dimension: str, value: str, window: str, bucket_id: int) -> str:
+        return f"{self.prefix}:{dimension}:{value}:{window}:{bucket_id}"
+
+    async def record(self, subjects: List[Tuple[str, str]], now: float) -> Dict[Tuple[str, str], Dict[str, int]]:
+        """记录一次事件并返回每个维度各窗口的计数（含本次），一次往返完成"""
+        pipe = self.redis.pipeline(transaction=False)
+        reads = []
+        for dimension, value in subjects:
+            for window, (size, bucket) in WINDOWS.items():
+                ids = bucket_ids(window, now)
+                current_key = self._key(dimension, value, window, ids[-1])
+                pipe.incr(current_key)
+                pipe.expire(current_key, size + bucket)
+                pipe.mget([self._key(dimension, value, window, bucket_id) for bucket_id in ids])
+                reads.append((dimension, value, window))
+
+        results = await pipe.execute()
+        counts = {}
+        for (dimension, value, window), values in zip(reads, results[2::3]):
+            counts.setdefault((dimension, value), {})[window] = sum(int(v) for v in values if v)
+        return counts
+
+    async def read(self, subjects: List[Tuple[str, str]], now: float) -> Dict[Tuple[str, str], Dict[str, int]]:
+        """只读取计数"""
+        pipe = self.redis.pipeline(transaction=False)
+        reads = []
+        for dimension, value in subjects:
+            for window in WINDOWS:
+                pipe.mget([
+                    self._key(dimension, value, window, bucket_id)
+                    for bucket_id in bucket_ids(window, now)
+                ])
+                reads.append((dimension, value, window))
+
+        counts = {}
+        for (dimension, value, window), values in zip(reads, await pipe.execute()):
+            counts.setdefault((dimension, value), {})[window] = sum(int(v) for v in values if v)
+        return counts
+
+
+class _Ring:
+    """一个计数对象在所有窗口上的环形桶"""
+
+    __slots__ = ("ids", "counts", "last_seen")
+
+    def __init__(self):
+        self.ids = {window: [None] * (size // bucket) for window, (size, bucket) in WINDOWS.items()}
+        self.counts = {window: [0] * (size // bucket) for window, (size, bucket) in WINDOWS.items()}
+        self.last_seen = 0.0
+
+
+class LocalVelocityStore:
+    """进程内环形桶计数，Redis 不可用或未启用时使用，只统计本实例的事件"""
+
+    def __init__(self):
+        self._rings: "OrderedDict[Tuple[str, str], _Ring]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_age = max(size + bucket for size, bucket in WINDOWS.values())
+
+    def _counts(self, ring: _Ring, now: float) -> Dict[str, int]:
+        counts = {}
+        for window in WINDOWS:
+            ids = bucket_ids(window, now)
+            slots = len(ids)
+            ring_ids, ring_counts = ring.ids[window], ring.counts[window]
+            counts[window] = sum(
+                ring_counts[bucket_id % slots]
+                for bucket_id in ids
+                if ring_ids[bucket_id % slots] == bucket_id
+            )
+        return counts
+
+    def record(self, subjects: List[Tuple[str, str]], now: float) -> Dict[Tuple[str, str], Dict[str, int]]:
+        counts = {}
+        with self._lock:
+            for subject in subjects:
+                ring = self._rings.get(subject)
+                if ring is None:
+                    ring = self._rings[subject] = _Ring()
+                else:
+                    self._rings.move_to_end(subject)
+                ring.last_seen = now
+
+                for window, (_, bucket) in WINDOWS.items():
+                    current = int(now // bucket)
+                    slot = current % len(ring.ids[window])
+                    if ring.ids[window][slot] != current:
+                        ring.ids[window][slot] = current
+                        ring.counts[window][slot] = 0
+                    ring.counts[window][slot] += 1
+
+                counts[subject] = self._counts(ring, now)
+            self._evict(now)
+        return counts
+
+    def read(self, subjects: List[Tuple[str, str]], now: float) -> Dict[Tuple[str, str], Dict[str, int]]:
+        with self._lock:
+            return {
+                subject: self._counts(self._rings[subject], now) if subject in self._rings
+                else {window: 0 for window in WINDOWS}
+                for subject in subjects
+            }
+
+    def _evict(self, now: float):
+        """按最近使用顺序移除超过最长窗口未出现的计数对象"""
+        while self._rings:
+            subject, ring = next(iter(self._rings.items()))
+            if now - ring.last_seen <= self._max_age:
+                break
+            self._rings.popitem(last=False)
+
+
+class VelocityCounter:
+    """按用户、设备、IP 统计申请速度；Redis 出错时退回进程内计数"""
+
+    def __init__(self, redis_client=None, limits: Optional[dict] = None):
+        self.redis_store = RedisVelocityStore(redis_client) if redis_client is not None else None
+        self.local_store = LocalVelocityStore()
+        self.limits = limits or VELOCITY_LIMITS
+
+    @staticmethod
+    def subjects(user_id: int, device_fingerprint: Optional[str] = None,
+                 ip_address: Optional[str] = None) -> List[Tuple[str, str]]:
+        subjects = [("user", str(user_id))]
+        if device_fingerprint:
+            subjects.append(("device", device_fingerprint))
+        if ip_address:
+            subjects.append(("ip", ip_address))
+        return subjects
+
+    async def _call(self, method: str, subjects: List[Tuple[str, str]]):
+        now = time.time()
+        if self.redis_store is not None:
+            try:
+                return await getattr(self.redis_store, method)(subjects, now)
+            except RedisError as e:
+                print(f"速度计数读写Redis失败，使用进程内计数: {e}")
+        return getattr(self.local_store, method)(subjects, now)
+
+    async def record(self, subjects: List[Tuple[str, str]]) -> Dict[Tuple[str, str], Dict[str, int]]:
+        """记录一次申请，返回各维度各窗口的计数（含本次）"""
+        return await self._call("record", subjects)
+
+    async def read(self, subjects: List[Tuple[str, str]]) -> Dict[Tuple[str, str], Dict[str, int]]:
+        return await self._call("read", subjects)
+
+    def exceeded(self, counts: Dict[Tuple[str, str], Dict[str, int]]) -> List[str]:
+        """超过限制的 维度:窗口 列表"""
+        exceeded = []
+        for (dimension, _), windows in counts.items():
+            limits = self.limits.get(dimension, {})
+            for window, count in windows.items():
+                if window in limits and count > limits[window]:
+                    exceeded.append(f"{dimension}:{window}")
+        return exceeded
@@ -1,20 +1,20 @@
 # 共享数据模型
 
 from .user import User, CreditScore
-from .loan import Loan, Repayment
-from .risk import Blacklist, RiskAssessment, FraudDetection, RiskRule, RiskEvent
-from .notification import Notification, NotificationTemplate, NotificationChannel, NotificationStats
+from .loan import Loan, Repayment, RepaymentEntry, OverdueAging
+from .risk import Blacklist, RiskAssessment, FraudDetection, RiskRule, RiskEvent, IpReputation, UserFeatureEvent, ShadowScore
+from .notification import Notification, NotificationCampaign, NotificationTemplate, NotificationChannel, NotificationStats
 from .file import FileInfo, FileProcess, FileAccess, FileStorage
 
 __all__ = [
     # User models
     'User', 'CreditScore',
     # Loan models
-    'Loan', 'Repayment',
+    'Loan', 'Repayment', 'RepaymentEntry', 'OverdueAging',
     # Risk models
-    'Blacklist', 'RiskAssessment', 'FraudDetection', 'RiskRule', 'RiskEvent',
+    'Blacklist', 'RiskAssessment', 'FraudDetection', 'RiskRule', 'RiskEvent', 'IpReputation', 'UserFeatureEvent', 'ShadowScore',
     # Notification models
-    'Notification', 'NotificationTemplate', 'NotificationChannel', 'NotificationStats',
+    'Notification', 'NotificationCampaign', 'NotificationTemplate', 'NotificationChannel', 'NotificationStats',
     # File models
     'FileInfo', 'FileProcess', 'FileAccess', 'FileStorage'
 ]
@@ -23,7 +23,7 @@ class FileInfo(Base):
     url = Column(String(512))  # 访问URL
     status = Column(String(16), default='active')  # active, deleted, processing
     is_public = Column(Boolean, default=False)  # 是否公开访问
-    metadata = Column(JSON)  # JSON格式的文件元数据
+    file_metadata = Column('metadata', JSON)  # JSON格式的文件元数据（metadata 是声明式基类的保留属性名）
     created_at = Column(DateTime, default=datetime.utcnow, index=True)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     deleted_at = Column(DateTime)
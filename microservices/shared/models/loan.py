@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Numeric, ForeignKey, Date
+from sqlalchemy import Column, Integer, String, DateTime, Numeric, ForeignKey, Date, Index, UniqueConstraint
 from sqlalchemy.orm import declarative_base
 from datetime import datetime
 
@@ -40,3 +40,51 @@ class Repayment(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        # 覆盖还款计划/待还查询：按贷款取期次、按状态过滤、按到期日排序
+        Index(
+            'ix_repayments_loan_status_due',
+            'loan_id', 'status', 'due_date',
+            postgresql_include=['due_amount', 'paid_amount'],
+        ),
+        # 逾期扫描与账龄明细：按状态过滤、按到期日范围扫描
+        Index('ix_repayments_status_due_date', 'status', 'due_date'),
+    )
+
+
+class RepaymentEntry(Base):
+    """还款流水模型（只追加，不更新不删除）"""
+    __tablename__ = 'repayment_entries'
+
+    id = Column(Integer, primary_key=True)
+    payment_id = Column(String(64), nullable=False, index=True)  # 一次还款请求的唯一标识
+    loan_id = Column(Integer, nullable=False, index=True)
+    repayment_id = Column(Integer, nullable=False, index=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    amount = Column(Numeric(14, 2), nullable=False)  # 本次分配到该期次的金额
+    payment_method = Column(String(32))
+
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        # 同一次还款对同一期次只记一笔，重复提交不会重复入账
+        UniqueConstraint('payment_id', 'repayment_id', name='uq_repayment_entries_payment_repayment'),
+    )
+
+
+class OverdueAging(Base):
+    """逾期账龄汇总模型（按日、按账龄段）"""
+    __tablename__ = 'overdue_aging'
+
+    id = Column(Integer, primary_key=True)
+    as_of_date = Column(Date, nullable=False, index=True)
+    bucket = Column(String(16), nullable=False)  # 1-30/31-60/61-90/90+
+    overdue_count = Column(Integer, nullable=False, default=0)
+    overdue_amount = Column(Numeric(16, 2), nullable=False, default=0)  # 未还金额合计
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('as_of_date', 'bucket', name='uq_overdue_aging_date_bucket'),
+    )
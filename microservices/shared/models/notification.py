@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, ForeignKey, JSON, Index, UniqueConstraint
 from sqlalchemy.orm import declarative_base
 from datetime import datetime
 from typing import Optional
@@ -9,18 +9,55 @@ Base = declarative_base()
 class Notification(Base):
     """通知模型"""
     __tablename__ = 'notifications'
+    __table_args__ = (
+        # 投递协程按通道、状态与到期时间认领
+        Index('ix_notifications_queue', 'priority', 'status', 'next_attempt_at'),
+        # 用户通知历史按 (created_at, id) 键集分页
+        Index('ix_notifications_user_history', 'user_id', 'created_at', 'id'),
+        # 按月分区，分区由通知服务的维护任务创建与归档
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
 
-    id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, nullable=False, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, nullable=False)
     message = Column(Text, nullable=False)
     type = Column(String(32), nullable=False, index=True)  # loan_approved, loan_rejected, repayment_reminder, etc.
     channel = Column(String(16), nullable=False)  # email, sms, push, all
-    status = Column(String(16), nullable=False, index=True)  # pending, sent, failed
+    priority = Column(String(16), nullable=False, default="normal")  # 投递通道：critical, normal, bulk
+    status = Column(String(16), nullable=False, index=True)  # pending, sending, retry, sent, dead, cancelled
     sent_at = Column(DateTime)
     error_message = Column(Text)
+    channel_results = Column(JSON)  # 各渠道最近一次发送结果：{渠道: {status, error, latency_ms}}
+    attempts = Column(Integer, default=0, nullable=False)  # 已尝试投递次数
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)  # 下次可投递时间
+    locked_until = Column(DateTime)  # 投递租约到期时间
     template_id = Column(String(64))
     template_data = Column(JSON)  # JSON格式的模板数据
-    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    digest_items = Column(JSON)  # 合并发送的摘要通知中各条原始内容
+    campaign_id = Column(Integer, index=True)  # 所属批量通知活动
+    created_at = Column(DateTime, default=datetime.utcnow, primary_key=True)  # 分区键必须包含在主键中
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class NotificationCampaign(Base):
+    """批量通知活动模型"""
+    __tablename__ = 'notification_campaigns'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(128), nullable=False)
+    template_id = Column(String(64), nullable=False)
+    channel = Column(String(16), nullable=False)  # email, sms, push, all
+    type = Column(String(32), nullable=False)
+    source = Column(String(32), nullable=False)  # list, repayments_due
+    source_params = Column(JSON)  # 收件人列表或查询参数
+    status = Column(String(16), nullable=False, index=True)  # running, completed, failed, cancelled
+    resume_after = Column(Integer, default=0, nullable=False)  # 已入队到的位置：列表下标或还款记录ID
+    total_recipients = Column(Integer, default=0, nullable=False)
+    enqueued = Column(Integer, default=0, nullable=False)
+    render_failed = Column(Integer, default=0, nullable=False)
+    error_message = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
@@ -34,6 +71,7 @@ class NotificationTemplate(Base):
     content = Column(Text, nullable=False)
     channel = Column(String(16), nullable=False)  # email, sms, push, all
     variables = Column(JSON)  # JSON格式的变量列表
+    version = Column(Integer, default=1, nullable=False)  # 每次修改加一，编译缓存按版本区分
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -55,9 +93,13 @@ class NotificationChannel(Base):
 class NotificationStats(Base):
     """通知统计模型"""
     __tablename__ = 'notification_stats'
+    __table_args__ = (
+        # 投递协程按 (日期, 渠道) 累加
+        UniqueConstraint('date', 'channel', name='uq_notification_stats_date_channel'),
+    )
 
     id = Column(Integer, primary_key=True)
-    date = Column(DateTime, nullable=False, index=True)
+    date = Column(DateTime, nullable=False, index=True)  # 当天零点（UTC）
     channel = Column(String(16), nullable=False)
     total_sent = Column(Integer, default=0)
     success_count = Column(Integer, default=0)
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, Numeric, Boolean, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Numeric, Boolean, Text, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import declarative_base
 from datetime import datetime
 from typing import Optional
@@ -17,6 +18,7 @@ class Blacklist(Base):
     expires_at = Column(DateTime)
     is_active = Column(Boolean, default=True, index=True)
     created_by = Column(String(64))  # 操作员
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # 增量同步依据
 
 
 class RiskAssessment(Base):
@@ -29,9 +31,9 @@ class RiskAssessment(Base):
     risk_score = Column(Numeric(5, 4), nullable=False)  # 0.0000-1.0000
     risk_level = Column(String(16), nullable=False)  # 极低风险/低风险/中等风险/中高风险/高风险
     approved = Column(Boolean, nullable=False)
-    reasons = Column(Text)  # JSON格式的风险原因
-    recommendations = Column(Text)  # JSON格式的建议
-    assessment_data = Column(Text)  # JSON格式的评估数据
+    reasons = Column(JSONB)  # 风险原因列表
+    recommendations = Column(JSONB)  # 建议列表
+    assessment_data = Column(JSONB)  # 评估时的用户特征
     created_at = Column(DateTime, default=datetime.utcnow, index=True)
 
 
@@ -43,10 +45,10 @@ class FraudDetection(Base):
     user_id = Column(Integer, nullable=False, index=True)
     ip_address = Column(String(45))  # 支持IPv6
     device_fingerprint = Column(String(255))
-    behavior_data = Column(Text)  # JSON格式的行为数据
+    behavior_data = Column(JSONB)  # 行为数据
     is_fraud = Column(Boolean, nullable=False)
     fraud_score = Column(Numeric(5, 4), nullable=False)  # 0.0000-1.0000
-    risk_factors = Column(Text)  # JSON格式的风险因子
+    risk_factors = Column(JSONB)  # 风险因子列表
     confidence = Column(Numeric(5, 4), nullable=False)  # 0.0000-1.0000
     created_at = Column(DateTime, default=datetime.utcnow, index=True)
 
@@ -78,3 +80,47 @@ class RiskEvent(Base):
     is_suspicious = Column(Boolean, default=False)
     action_taken = Column(String(64))  # 采取的行动
     created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class IpReputation(Base):
+    """IP信誉模型：一个网段（IPv4/IPv6 CIDR）的风险分值"""
+    __tablename__ = 'ip_reputation'
+
+    id = Column(Integer, primary_key=True)
+    network = Column(String(64), nullable=False, unique=True)  # CIDR，如 203.0.113.0/24、2001:db8::/32
+    score = Column(Numeric(5, 4), nullable=False)  # 0-1，越高越可疑
+    category = Column(String(32))  # proxy, tor, datacenter, fraud, etc.
+    asn = Column(Integer)  # 所属自治系统号
+    source = Column(String(64))  # 数据来源
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class UserFeatureEvent(Base):
+    """用户特征变更事件，用于按时间点重建评估特征"""
+    __tablename__ = 'user_feature_events'
+    __table_args__ = (
+        Index('ix_user_feature_events_user_time', 'user_id', 'event_time'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    source = Column(String(32))  # user_service, loan_service, etc.
+    features = Column(JSONB, nullable=False)  # 本次变化的特征
+    event_time = Column(DateTime, nullable=False)  # 特征生效时间（UTC）
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ShadowScore(Base):
+    """挑战者模型影子评分记录，用于与冠军模型离线对比"""
+    __tablename__ = 'shadow_scores'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    champion_version = Column(String(64), nullable=False)  # 冠军模型版本，规则引擎为 rules
+    champion_score = Column(Numeric(5, 4), nullable=False)
+    challenger_version = Column(String(64), nullable=False, index=True)
+    challenger_score = Column(Numeric(5, 4), nullable=False)
+    latency_ms = Column(Numeric(10, 3))  # 挑战者本次推理耗时
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
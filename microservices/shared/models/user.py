@@ -2,9 +2,20 @@ from sqlalchemy import Column, Integer, String, Boolean, DateTime, Numeric, Text
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import declarative_base
 from datetime import datetime
+from typing import Optional
 
 Base = declarative_base()
 
+# 资料中的收入区间对应的月收入估计：取区间下限，最低一档按 1500 估算，偏保守
+MONTHLY_INCOME_ESTIMATES = {
+    '3000以下': 1500.0,
+    '3000-5000': 3000.0,
+    '5000-8000': 5000.0,
+    '8000-12000': 8000.0,
+    '12000-20000': 12000.0,
+    '20000以上': 20000.0,
+}
+
 
 class User(Base):
     """用户模型"""
@@ -16,6 +27,7 @@ class User(Base):
     real_name = Column(String(64))
     id_card = Column(String(32), index=True)
     phone = Column(String(20), unique=True, index=True)
+    email = Column(String(128), index=True)
 
     # 详细信息
     education = Column(String(32))
@@ -42,6 +54,11 @@ class User(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    @property
+    def monthly_income(self) -> Optional[float]:
+        """按收入区间估算的月收入，未填写时为 None"""
+        return MONTHLY_INCOME_ESTIMATES.get(self.income)
+
 
 class CreditScore(Base):
     """信用分模型"""
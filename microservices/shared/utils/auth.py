@@ -1,8 +1,9 @@
 from datetime import datetime, timedelta
 from typing import Optional
+import hmac
 import jwt
 from passlib.context import CryptContext
-from fastapi import HTTPException, status
+from fastapi import Header, HTTPException, status
 from shared.config.settings import settings
 
 # 密码加密上下文
@@ -32,6 +33,25 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
+# 服务间调用携带内部令牌的请求头
+INTERNAL_TOKEN_HEADER = "X-Internal-Token"
+
+
+def internal_headers() -> dict:
+    """调用其他服务内部接口时携带的请求头"""
+    return {INTERNAL_TOKEN_HEADER: settings.internal_service_token}
+
+
+def verify_internal_token(x_internal_token: str = Header("")):
+    """校验内部接口的服务令牌（FastAPI依赖）"""
+    expected = settings.internal_service_token
+    if not expected or not hmac.compare_digest(x_internal_token.encode(), expected.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="无效的内部服务令牌"
+        )
+
+
 def verify_token(token: str) -> dict:
     """验证令牌"""
     try:
@@ -11,10 +11,14 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'shared'))
 from shared.config.settings import settings
 from shared.utils.database import get_db_session
 from shared.utils.auth import verify_token, verify_password, get_password_hash, create_access_token
+from shared.utils.auth import internal_headers, verify_internal_token
 from shared.models.user import User, CreditScore
 from pydantic import BaseModel
 from datetime import datetime, timedelta
 import hashlib
+import json
+import httpx
+import redis.asyncio
 
 app = FastAPI(
     title="用户服务",
@@ -31,12 +35,14 @@ class UserCreate(BaseModel):
     password: str
     real_name: Optional[str] = None
     phone: Optional[str] = None
+    email: Optional[str] = None
 
 
 class UserUpdate(BaseModel):
     real_name: Optional[str] = None
     id_card: Optional[str] = None
     phone: Optional[str] = None
+    email: Optional[str] = None
     education: Optional[str] = None
     school: Optional[str] = None
     marital_status: Optional[str] = None
@@ -62,7 +68,9 @@ class UserResponse(BaseModel):
     username: str
     real_name: Optional[str]
     phone: Optional[str]
+    email: Optional[str] = None
     credit_score: Optional[int]
+    monthly_income: Optional[float] = None
     is_profile_completed: bool
     loan_limit: float
     total_borrowed: float
@@ -73,12 +81,29 @@ class UserResponse(BaseModel):
         from_attributes = True
 
 
+class ContactsRequest(BaseModel):
+    user_ids: List[int]
+
+
+class ContactResponse(BaseModel):
+    user_id: int
+    email: Optional[str]
+    phone: Optional[str]
+
+
 class TokenResponse(BaseModel):
     access_token: str
     token_type: str
     user: UserResponse
 
 
+# 单次批量查询联系方式的用户数上限
+MAX_CONTACT_BATCH = 1000
+
+# 通知服务缓存的联系方式字段，修改后需要通知其失效
+CONTACT_FIELDS = ("email", "phone")
+
+
 # 依赖注入
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
@@ -232,6 +257,7 @@ async def register_user(user_data: UserCreate, db: Session = Depends(lambda: nex
         password_hash=hashed_password,
         real_name=user_data.real_name,
         phone=user_data.phone,
+        email=user_data.email,
         credit_score=700,  # 默认信用分
         loan_limit=50000,  # 默认贷款额度
         is_profile_completed=False
@@ -265,6 +291,43 @@ async def login_user(login_data: UserLogin, db: Session = Depends(lambda: next(g
     )
 
 
+async def publish_user_features(user: User):
+    """把用户的信用分与估算月收入推送给风控服务的特征存储"""
+    async with httpx.AsyncClient() as client:
+        try:
+            await client.post(f"{settings.risk_service_url}/features/events", json={
+                "events": [{
+                    "user_id": user.id,
+                    "features": {"credit_score": user.credit_score, "monthly_income": user.monthly_income},
+                    "event_time": datetime.utcnow().isoformat(),
+                    "source": "user_service"
+                }]
+            })
+        except Exception:
+            pass  # 推送失败时风控服务在特征过期后回源
+
+
+# 联系方式变更经 Redis 广播给通知服务的所有实例
+redis_client = redis.asyncio.Redis.from_url(settings.redis_url)
+
+
+async def invalidate_notification_contacts(user_id: int):
+    """用户修改邮箱或手机号后让通知服务的所有实例清除缓存的联系方式"""
+    try:
+        await redis_client.publish(settings.notification_contact_invalidation_channel, json.dumps([user_id]))
+        return
+    except redis.RedisError as e:
+        print(f"广播联系方式失效失败，改为请求通知服务: {e}")
+    
+    async with httpx.AsyncClient() as client:
+        try:
+            await client.post(f"{settings.notification_service_url}/contacts/invalidate", json={
+                "user_ids": [user_id]
+            }, headers=internal_headers())
+        except Exception:
+            pass  # 失效请求失败时通知服务的缓存在过期后回源
+
+
 @app.get("/profile", response_model=UserResponse)
 async def get_user_profile(current_user: User = Depends(get_current_user)):
     """获取用户资料"""
@@ -279,7 +342,11 @@ async def update_user_profile(
 ):
     """更新用户资料"""
     # 更新用户信息
-    for field, value in user_data.dict(exclude_unset=True).items():
+    updates = user_data.dict(exclude_unset=True)
+    contact_changed = any(
+        field in updates and updates[field] != getattr(current_user, field) for field in CONTACT_FIELDS
+    )
+    for field, value in updates.items():
         setattr(current_user, field, value)
     
     # 计算新的信用分
@@ -314,6 +381,10 @@ async def update_user_profile(
     db.commit()
     db.refresh(current_user)
     
+    await publish_user_features(current_user)
+    if contact_changed:
+        await invalidate_notification_contacts(current_user.id)
+    
     return current_user
 
 
@@ -377,6 +448,28 @@ async def get_user_by_username(
     return user
 
 
+@app.post(
+    "/internal/contacts",
+    response_model=List[ContactResponse],
+    dependencies=[Depends(verify_internal_token)]
+)
+async def get_user_contacts(
+    request: ContactsRequest,
+    db: Session = Depends(lambda: next(get_db_session("user_service")))
+):
+    """批量获取用户邮箱与手机号（内部接口，通知服务解析收件人用），不存在的用户不返回"""
+    if len(request.user_ids) > MAX_CONTACT_BATCH:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"单次最多查询 {MAX_CONTACT_BATCH} 个用户"
+        )
+    if not request.user_ids:
+        return []
+
+    rows = db.query(User.id, User.email, User.phone).filter(User.id.in_(request.user_ids)).all()
+    return [ContactResponse(user_id=row.id, email=row.email, phone=row.phone) for row in rows]
+
+
 @app.get("/health")
 async def health_check():
     """健康检查"""